@@ -260,6 +260,7 @@ class IteratedRiverObs(RiverObs):
 
         # Calculate the centerline for this reach
         self.centerline = Centerline(x1, y1, k=self.k, ds=self.ds_init)
+        self.obs_coords = None
 
         # Associate an along-track dimension to each node
         if self.ds_init is not None:  # Evenly spaced nodes
@@ -403,3 +404,14 @@ class IteratedRiverObs(RiverObs):
 
         # The obs will have to be reprojected
         self.centerline_obs = {}
+
+    def reflag(self, second_pass=True):
+        """
+        Redo the in channel flagging with the first or second pass criteria,
+        keeping the current centerline and the observation projections.
+        """
+        self.second_pass = second_pass
+        self.robs_kwds['second_pass'] = second_pass
+
+        ext_dist_coef = self.reach.ext_dist_coef if second_pass else None
+        self.init_obs(self.xobs, self.yobs, self.seg_label, ext_dist_coef)
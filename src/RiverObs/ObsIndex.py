@@ -0,0 +1,135 @@
+"""
+A spatial index over a set of observation coordinates, used to quickly
+find the observations that may lie near a centerline.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+class ObsIndex:
+    """
+    A uniform grid over a set of observation coordinates.
+
+    The observations are sorted by grid cell once, so that all of the
+    observations in a row of cells are a contiguous slice of the sort
+    order. Queries for all observations within some distance of a set of
+    points (e.g., the nodes of a centerline) then only touch the
+    observations in the rows of cells covering the search disks.
+
+    Parameters
+    ----------
+
+    x, y : array_like
+        Observation coordinates (in m).
+    cell_size : float, default 100
+        Size of the grid cells (in m).
+    """
+
+    def __init__(self, x, y, cell_size=100.):
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+
+        self.cell_size = cell_size
+        self.nobs = len(x)
+
+        # observations with non-finite coordinates are never returned
+        good = np.logical_and(np.isfinite(x), np.isfinite(y))
+        if good.any():
+            self.x0 = x[good].min()
+            self.y0 = y[good].min()
+        else:
+            self.x0, self.y0 = 0., 0.
+
+        self.ix = np.zeros(self.nobs, dtype=np.int64)
+        self.iy = np.zeros(self.nobs, dtype=np.int64)
+        self.ix[good] = np.floor((x[good] - self.x0) / cell_size)
+        self.iy[good] = np.floor((y[good] - self.y0) / cell_size)
+        self.nx = self.ix.max() + 1 if self.nobs > 0 else 1
+
+        cell = self.iy * self.nx + self.ix
+        cell[~good] = -1
+        self.order = np.argsort(cell, kind='stable')
+        self.order = self.order[cell[self.order] >= 0]
+        self.sorted_cell = cell[self.order]
+
+    def query(self, x, y, radius):
+        """
+        Get the observations that may be within radius of any point (x, y).
+
+        The result is a superset of the observations within the disks: all
+        observations in grid cells overlapping any disk are returned.
+
+        Parameters
+        ----------
+
+        x, y : array_like
+            Coordinates of the search points.
+        radius : float or array_like
+            Search radius around each point. Points with a non-finite radius
+            are ignored.
+
+        Returns
+        -------
+
+        Sorted array with the indices of the observations.
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        radius = np.broadcast_to(
+            np.asarray(radius, dtype=np.float64), x.shape)
+
+        good = np.logical_and.reduce(
+            [np.isfinite(x), np.isfinite(y), np.isfinite(radius)])
+        if not good.any() or len(self.order) == 0:
+            return np.array([], dtype=np.int64)
+
+        # pad a little for round off in the distances
+        x, y = x[good], y[good]
+        radius = np.abs(radius[good]) * (1 + 1.e-9) + 1.e-6
+
+        # rows of cells covered by each disk
+        iy0 = np.floor((y - radius - self.y0) / self.cell_size).astype(int)
+        iy1 = np.floor((y + radius - self.y0) / self.cell_size).astype(int)
+        nrows = iy1 - iy0 + 1
+        point = np.repeat(np.arange(len(x)), nrows)
+        iy = np.repeat(iy0 - np.cumsum(nrows) + nrows, nrows) + np.arange(
+            nrows.sum())
+
+        # half width of each disk in each row, from the closest approach of
+        # the row to the center of the disk
+        row_bottom = self.y0 + iy * self.cell_size
+        dy = np.maximum(0., np.maximum(
+            row_bottom - y[point], y[point] - row_bottom - self.cell_size))
+        half_width = np.sqrt(np.maximum(radius[point]**2 - dy**2, 0.))
+        ix0 = np.floor((x[point] - half_width - self.x0) / self.cell_size)
+        ix1 = np.floor((x[point] + half_width - self.x0) / self.cell_size)
+
+        # skip the runs that are all left / right of the grid
+        inside = np.logical_and(ix1 >= 0, ix0 <= self.nx - 1)
+        iy, ix0, ix1 = iy[inside], ix0[inside], ix1[inside]
+        ix0 = np.clip(ix0, 0, self.nx - 1).astype(np.int64)
+        ix1 = np.clip(ix1, 0, self.nx - 1).astype(np.int64)
+
+        # each run of cells is a slice of the sorted observations
+        start = np.searchsorted(self.sorted_cell, iy * self.nx + ix0, 'left')
+        stop = np.searchsorted(self.sorted_cell, iy * self.nx + ix1, 'right')
+        keep = stop > start
+        start, stop = start[keep], stop[keep]
+        if len(start) == 0:
+            return np.array([], dtype=np.int64)
+
+        # union of the (possibly overlapping) slices
+        isort = np.argsort(start, kind='stable')
+        start, stop = start[isort], stop[isort]
+        stop_max = np.maximum.accumulate(stop)
+        first = np.flatnonzero(np.concatenate(
+            [[True], start[1:] > stop_max[:-1]]))
+        start = start[first]
+        stop = np.maximum.reduceat(stop, first)
+
+        lengths = stop - start
+        positions = np.repeat(start - np.cumsum(lengths) + lengths,
+                              lengths) + np.arange(lengths.sum())
+        return np.sort(self.order[positions])
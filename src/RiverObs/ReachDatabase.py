@@ -4,20 +4,23 @@ Classes and methods to interact with the "new" reach database
 
 import os
 import glob
+import json
 import netCDF4
 import logging
 import warnings
 import numpy as np
-import math
 import pyproj
 
 from collections import OrderedDict as odict
 
 from RiverObs.RiverReach import RiverReach
+import SWOTWater.products.netcdf as netcdf
 from SWOTWater.products.product import Product, FILL_VALUES, textjoin
 
 LOGGER = logging.getLogger(__name__)
 
+CATALOG_FILENAME = 'prd_catalog.json'
+
 class LatLonRegion:
     """
     Hacked up class to use for cheap-n-easy use of ReachExtractor
@@ -31,7 +34,181 @@ class LatLonRegion:
         self.proj = pyproj.Proj(
             proj='laea', x_0=0, y_0=0, lat_0=lat_0, lon_0=lon_0, ellps='WGS84')
 
-def get_blocking_widths(x, y):
+class ReachIndex:
+    """
+    Index from reach_id to the positions of its entries in a reach_id
+    array (e.g., the reach_id variable of the PRD nodes), made by sorting
+    the array once.
+
+    Masked entries are never returned. For 2D reach_id arrays, positions are
+    into the flattened array.
+    """
+    def __init__(self, reach_id):
+        self.reach_id = reach_id
+        reach_id = np.ma.asarray(reach_id)
+        positions = np.flatnonzero(~np.ma.getmaskarray(reach_id))
+        ids = np.ma.getdata(reach_id).ravel()[positions]
+
+        # stable, so that the positions of each reach stay increasing
+        order = np.argsort(ids, kind='stable')
+        self.positions = positions[order]
+        self.ids, self.starts = np.unique(ids[order], return_index=True)
+        self.stops = np.append(self.starts[1:], len(order))
+
+    def __call__(self, reach_id):
+        """Returns the increasing positions of the entries of reach_id"""
+        ii = np.searchsorted(self.ids, reach_id)
+        if ii < len(self.ids) and self.ids[ii] == reach_id:
+            return self.positions[self.starts[ii]:self.stops[ii]]
+        return self.positions[:0]
+
+    def subset(self, reach_ids):
+        """Returns the increasing positions of the entries of reach_ids"""
+        return np.unique(np.concatenate(
+            [self.positions[:0]] + [self(item) for item in reach_ids]))
+
+class ReachIndexMixIn(object):
+    """MixIn for PRD groups to look up their data by reach_id"""
+    ATTRS = Product.ATTRS + ['_reach_index']
+
+    def get_reach_index(self):
+        """Returns the ReachIndex of self.reach_id (made on first use)"""
+        reach_index = self.__dict__.get('_reach_index')
+        if reach_index is None or reach_index.reach_id is not self.reach_id:
+            reach_index = ReachIndex(self.reach_id)
+            self._reach_index = reach_index
+        return reach_index
+
+    def get_subset_index(self, reach_ids):
+        """
+        Returns the increasing positions along the last dimension of the
+        entries of reach_ids (see subset)
+        """
+        return self.get_reach_index().subset(reach_ids)
+
+def project_batches(proj, lons, lats):
+    """
+    Projects lists of lon/lat arrays with a single call to proj, returns lists
+    of the projected x/y arrays.
+    """
+    if len(lons) == 0:
+        return [], []
+    splits = np.cumsum([len(item) for item in lons])[:-1]
+    x, y = proj(np.ma.concatenate(lons), np.ma.concatenate(lats))
+    return np.split(x, splits), np.split(y, splits)
+
+def get_centerline_order(x, y, is_extra_vertex, max_dist=50):
+    """
+    Returns the indices of the centerline vertices in order, without the extra
+    vertices (those that joint adjacent reaches) that are not within max_dist
+    of either end of the centerline. Extra vertices that are close to one end
+    are put next to the vertex they are closest to.
+
+    x, y are the projected coordinates of all centerline vertices.
+    """
+    order = list(np.flatnonzero(np.logical_not(is_extra_vertex)))
+    found_start = 0
+    found_stop = 0
+    for extra_index in np.flatnonzero(is_extra_vertex):
+        start = order[0:found_start+1]
+        stop = order[-(found_stop+1):]
+        dist_start = np.sqrt(
+            (x[extra_index]-x[start])**2 + (y[extra_index]-y[start])**2)
+        dist_stop = np.sqrt(
+            (x[extra_index]-x[stop])**2 + (y[extra_index]-y[stop])**2)
+
+        if any(dist_start < max_dist):
+            # put vertex before one it is closest to
+            cut_idx = np.argmin(dist_start)
+            found_start += 1
+
+        elif any(dist_stop < max_dist):
+            # put vertex after one it is closest to
+            cut_idx = len(order)-found_stop+np.argmin(dist_stop)
+            found_stop += 1
+
+        else:
+            # skip this one
+            continue
+
+        order.insert(cut_idx, extra_index)
+    return np.array(order, dtype=int)
+
+def get_tile_info(db_file):
+    """
+    Returns the catalog entry (bounds, reach_id range and group dimensions) of
+    a PRD tile file. The reach_id range is None if it has no reaches.
+    """
+    with netCDF4.Dataset(db_file, 'r') as ifp:
+        reach_id = []
+        if 'reaches' in ifp.groups:
+            reach_id = np.ma.compressed(ifp['reaches']['reach_id'][:])
+        return {
+            'file': os.path.basename(db_file),
+            'mtime': os.path.getmtime(db_file),
+            'x_min': float(ifp.x_min), 'x_max': float(ifp.x_max),
+            'y_min': float(ifp.y_min), 'y_max': float(ifp.y_max),
+            'reach_id_min': int(reach_id.min()) if len(reach_id) else None,
+            'reach_id_max': int(reach_id.max()) if len(reach_id) else None,
+            'dimensions': {
+                key: {dim: len(value) for dim, value in
+                      group.dimensions.items()}
+                for key, group in ifp.groups.items()}}
+
+def make_catalog(reach_db_path):
+    """
+    Writes the catalog of the PRD tiles in the reach_db_path directory to
+    CATALOG_FILENAME in it, and returns it.
+    """
+    catalog = [get_tile_info(db_file) for db_file in
+               sorted(glob.glob(os.path.join(reach_db_path, '*.nc')))]
+    with open(os.path.join(reach_db_path, CATALOG_FILENAME), 'w') as ofp:
+        json.dump(catalog, ofp, indent=1)
+    return catalog
+
+def get_catalog(reach_db_path):
+    """
+    Returns the catalog of the PRD tiles in the reach_db_path directory.
+
+    Uses the entries of the CATALOG_FILENAME file in it (see make_catalog) for
+    tiles that have not been modified since; the other tiles are opened to
+    read their entries.
+    """
+    catalog_file = os.path.join(reach_db_path, CATALOG_FILENAME)
+    entries = {}
+    if os.path.isfile(catalog_file):
+        with open(catalog_file, 'r') as ifp:
+            entries = {item['file']: item for item in json.load(ifp)}
+    else:
+        LOGGER.info('No reach db catalog in {}'.format(reach_db_path))
+
+    catalog = []
+    for db_file in glob.glob(os.path.join(reach_db_path, '*.nc')):
+        entry = entries.get(os.path.basename(db_file))
+        if entry is None or entry['mtime'] != os.path.getmtime(db_file):
+            LOGGER.debug('Reading catalog entry of {}'.format(db_file))
+            entry = get_tile_info(db_file)
+        catalog.append(entry)
+    return catalog
+
+def read_subset(dataset, product, index):
+    """
+    Loads the variables of product (a PRD group) from the NetCDF dataset
+    (group), keeping only the entries at index (increasing) along their last
+    dimension, and its groups in the same way. Only reads the span of each
+    variable from the first to the last of index.
+    """
+    span = slice(index[0], index[-1]+1) if len(index) > 0 else slice(0, 0)
+    for key in netcdf.get_variable_keys(dataset):
+        if key in product.VARIABLES:
+            product[key] = netcdf.get_variable(dataset, key, span)[
+                ..., index - span.start]
+    for key, group in dataset.groups.items():
+        if key in product.GROUPS:
+            product[key] = product.get_product(product.GROUPS[key])()
+            read_subset(group, product[key], index)
+
+def get_blocking_widths(x, y, sizes=None):
     """
     Computes the blocking widths for nodes at x, y
 
@@ -40,83 +217,96 @@ def get_blocking_widths(x, y):
 
     widths are signed: looking from upstream to downstream, bending left is
     positive and bending right is negative.
-    """
-    widths = np.nan*np.ones(x.shape)
-
-    for ii in range(len(x)):
-        # consider a limited set of permutations of nodes that can block
-        # this node.
-        for joff_m in [1, 2, 3]:
-            for joff_p in [1, 2, 3]:
-                # skip first/last
-                if ii - joff_m < 0 or ii + joff_p >= len(x):
-                    continue
-
-                x1, y1 = x[ii-joff_m], y[ii-joff_m]
-                x2, y2 = x[ii], y[ii]
-                x3, y3 = x[ii+joff_p], y[ii+joff_p]
 
-                this_width = blocking_width(x1, y1, x2, y2, x3, y3)
-                if (np.isnan(widths[ii]) or
-                    np.abs(this_width) < np.abs(widths[ii])):
-                    widths[ii] = this_width
-    return widths
+    If sizes is given, x, y are the nodes of several reaches concatenated and
+    sizes are the numbers of nodes in each reach.
+    """
+    x = np.ma.getdata(x).astype(np.float64)
+    y = np.ma.getdata(y).astype(np.float64)
+    if sizes is None:
+        sizes = [len(x)]
+    sizes = np.asarray(sizes, dtype=int)
+    reach_start = np.repeat(np.cumsum(sizes)-sizes, sizes)
+    reach_stop = reach_start + np.repeat(sizes, sizes)
+    index = np.arange(len(x))
+
+    # consider a limited set of permutations of nodes that can block
+    # each node.
+    joffs = [(joff_m, joff_p) for joff_m in [1, 2, 3] for joff_p in [1, 2, 3]]
+    widths = np.nan*np.ones((len(joffs), len(x)))
+    for jj, (joff_m, joff_p) in enumerate(joffs):
+        # skip first/last
+        good = np.logical_and(
+            index - joff_m >= reach_start, index + joff_p < reach_stop)
+        ii = index[good]
+        widths[jj, good] = blocking_width(
+            x[ii-joff_m], y[ii-joff_m], x[ii], y[ii], x[ii+joff_p],
+            y[ii+joff_p])
+
+    # smallest width of each node (the first one of ties), ignoring NaNs
+    abs_widths = np.ma.masked_invalid(np.abs(widths))
+    abs_widths[np.isinf(widths)] = np.inf
+    jmin = abs_widths.argmin(axis=0, fill_value=np.inf)
+    return np.where(
+        abs_widths.mask.all(axis=0), np.nan, widths[jmin, index])
+
+def _square(value):
+    """value**2 with pow(), bit-identical to the scalar code"""
+    return np.power(value, np.full(np.shape(value), 2.))
 
 def blocking_width(x1, y1, x2, y2, x3, y3):
     """
     Computes width at which point (x2, y2) is blocked by other nodes
     i.e. point in plane eqi-distant to all three.
+
+    Works on scalars or arrays of points.
     """
-    # points midway beteen adjacent nodes
-    xa = 0.5*(x1+x2);
-    ya = 0.5*(y1+y2);
-
-    xb = 0.5*(x2+x3);
-    yb = 0.5*(y2+y3);
-
-    # construct normal to connecting vectors, which is the line of
-    # equidistant points
-
-    # normal to r2-f1:
-    x_normal_21 = y1-y2;
-    y_normal_21 = x2-x1;
-    norm = math.sqrt(x_normal_21**2 + y_normal_21**2);
-    x_normal_21 = x_normal_21 / norm;
-    y_normal_21 = y_normal_21 / norm;
-
-    # normal to r3-r2:
-    x_normal_32 = y2-y3;
-    y_normal_32 = x3-x2;
-    norm = math.sqrt(x_normal_32**2 + y_normal_32**2);
-    x_normal_32 = x_normal_32 / norm;
-    y_normal_32 = y_normal_32 / norm;
-
-    # test if points co-linear
-    if x_normal_21 == x_normal_32 and y_normal_21 == y_normal_32:
-        return np.Infinity, np.Infinity
-
-    # Solve this set of equations:
-    # xa+alpha*x_normal_21 = xb + beta*x_normal_32
-    # ya+alpha*y_normal_21 = yb + beta*y_normal_32
-
-    if x_normal_32 != 0:
-        # doing it on paper gives me (normal solution):
-        alpha = (
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # points midway beteen adjacent nodes
+        xa = 0.5*(x1+x2);
+        ya = 0.5*(y1+y2);
+
+        xb = 0.5*(x2+x3);
+        yb = 0.5*(y2+y3);
+
+        # construct normal to connecting vectors, which is the line of
+        # equidistant points
+
+        # normal to r2-f1:
+        x_normal_21 = y1-y2;
+        y_normal_21 = x2-x1;
+        norm = np.sqrt(_square(x_normal_21) + _square(y_normal_21));
+        x_normal_21 = x_normal_21 / norm;
+        y_normal_21 = y_normal_21 / norm;
+
+        # normal to r3-r2:
+        x_normal_32 = y2-y3;
+        y_normal_32 = x3-x2;
+        norm = np.sqrt(_square(x_normal_32) + _square(y_normal_32));
+        x_normal_32 = x_normal_32 / norm;
+        y_normal_32 = y_normal_32 / norm;
+
+        # Solve this set of equations:
+        # xa+alpha*x_normal_21 = xb + beta*x_normal_32
+        # ya+alpha*y_normal_21 = yb + beta*y_normal_32
+        alpha = np.where(
+            x_normal_32 != 0,
+            # doing it on paper gives me (normal solution):
             ((yb-ya) + y_normal_32/x_normal_32 * (xa-xb)) /
-            (y_normal_21-y_normal_32*x_normal_21/x_normal_32))
-        beta = (xa-xb)/x_normal_32 + alpha * x_normal_21/x_normal_32
-    else:
-        # equations simplify if x_normal_32 == 0
-        alpha = (xb-xa)/x_normal_21
-        beta = ((ya-yb) + (xa-xb)*y_normal_21 / x_normal_21)/y_normal_32
+            (y_normal_21-y_normal_32*x_normal_21/x_normal_32),
+            # equations simplify if x_normal_32 == 0
+            (xb-xa)/x_normal_21)
+
+        xc = xa+alpha*x_normal_21
+        yc = ya+alpha*y_normal_21
 
-    xc = xa+alpha*x_normal_21
-    yc = ya+alpha*y_normal_21
+        dist = np.sqrt(_square(x2-xc) + _square(y2-yc))
+        dist = np.where(alpha < 0, -dist, dist)
 
-    dist = math.sqrt((x2-xc)**2 + (y2-yc)**2)
-    if alpha < 0:
-        dist *= -1
-    return dist
+        # test if points co-linear
+        return np.where(np.logical_and(
+            x_normal_21 == x_normal_32, y_normal_21 == y_normal_32),
+            np.inf, dist)
 
 class ReachExtractor(object):
     """
@@ -143,8 +333,9 @@ class ReachExtractor(object):
 
         try_reach_idx = reach_db.reaches.extract(lat_lon_region.bounding_box)
 
-        self.reach = []
-        self.reach_idx = []
+        # gather the reaches first, so that all of their nodes and centerlines
+        # can be projected together
+        reaches = []
         for ii, reach_idx in enumerate(try_reach_idx):
 
             if ii % 100 == 0:
@@ -153,7 +344,6 @@ class ReachExtractor(object):
             this_reach = reach_db(reach_idx)
             lon = this_reach['nodes']['x']
             lat = this_reach['nodes']['y']
-            node_indx = this_reach['nodes']['node_id']
 
             if clip:
                 clip_lon = lon.copy()
@@ -173,61 +363,39 @@ class ReachExtractor(object):
             if len(lon) == 0:
                 continue
 
-            x, y = lat_lon_region.proj(lon, lat)
+            reaches.append((ii, reach_idx, this_reach, lon, lat))
+
+        xs, ys = project_batches(
+            lat_lon_region.proj,
+            [item[3] for item in reaches] +
+            [item[2]['centerlines']['x'] for item in reaches],
+            [item[4] for item in reaches] +
+            [item[2]['centerlines']['y'] for item in reaches])
+
+        # blocking widths of the nodes of all reaches at once
+        sizes = [len(item[3]) for item in reaches]
+        all_blocking_widths = np.split(get_blocking_widths(
+            np.concatenate(xs[:len(reaches)] + [[]]),
+            np.concatenate(ys[:len(reaches)] + [[]]), sizes),
+            np.cumsum(sizes)[:-1])
+
+        self.reach = []
+        self.reach_idx = []
+        for jj, (ii, reach_idx, this_reach, lon, lat) in enumerate(reaches):
+            x, y = xs[jj], ys[jj]
+            blocking_widths = all_blocking_widths[jj]
+            node_indx = this_reach['nodes']['node_id']
 
             # Remove centerline vertices that joint adjacent reaches and are
             # not close to nodes.
             if np.any(this_reach['centerlines']['is_extra_vertex']):
-                is_extra_mask = this_reach['centerlines']['is_extra_vertex']
-                not_extra_mask = np.logical_not(is_extra_mask)
-
-                lons = this_reach['centerlines']['x'][not_extra_mask]
-                lats = this_reach['centerlines']['y'][not_extra_mask]
-                xx, yy = lat_lon_region.proj(lons, lats)
-
-                found_start = 0
-                found_stop = 0
-                extra_indicies = is_extra_mask.nonzero()[0]
-                for ii, extra_index in enumerate(extra_indicies):
-                    try_lon = this_reach['centerlines']['x'][extra_index]
-                    try_lat = this_reach['centerlines']['y'][extra_index]
-                    try_xx, try_yy = lat_lon_region.proj(try_lon, try_lat)
-
-                    dist_start = np.sqrt(
-                        (try_xx-xx[0:found_start+1])**2 +
-                        (try_yy-yy[0:found_start+1])**2)
-
-                    dist_stop = np.sqrt(
-                        (try_xx-xx[-(found_stop+1):])**2 +
-                        (try_yy-yy[-(found_stop+1):])**2)
-
-                    if any(dist_start < 50):
-                        # put vertex before one it is closest to
-                        cut_idx = np.argmin(dist_start)
-                        found_start += 1
-
-                    elif any(dist_stop < 50):
-                        # put vertex after one it is closest to
-                        cut_idx = len(xx)-found_stop+np.argmin(dist_stop)
-                        found_stop += 1
-
-                    else:
-                        # skip this one
-                        continue
-
-                    lons = np.concatenate([
-                        lons[:cut_idx], [try_lon], lons[cut_idx:]])
-                    lats = np.concatenate([
-                        lats[:cut_idx], [try_lat], lats[cut_idx:]])
-                    xx = np.concatenate([
-                        xx[:cut_idx], [try_xx], xx[cut_idx:]])
-                    yy = np.concatenate([
-                        yy[:cut_idx], [try_yy], yy[cut_idx:]])
-
-                this_reach['centerlines']['x'] = lons
-                this_reach['centerlines']['y'] = lats
-
-            blocking_widths = get_blocking_widths(x, y)
+                order = get_centerline_order(
+                    xs[len(reaches) + jj], ys[len(reaches) + jj],
+                    this_reach['centerlines']['is_extra_vertex'])
+                this_reach['centerlines']['x'] = \
+                    this_reach['centerlines']['x'][order]
+                this_reach['centerlines']['y'] = \
+                    this_reach['centerlines']['y'][order]
 
             reach_metadata = {
                 'lakeFlag': this_reach['reaches']['lakeflag'][0],
@@ -258,6 +426,9 @@ class ReachExtractor(object):
             node_metadata = {
                 key: this_reach['nodes'][key] for key in node_metadata_keys}
 
+            # reach_index is the position of the reach in the candidate
+            # reaches from extract (try_reach_idx), not in self.reach, as
+            # candidates without nodes in the region are skipped
             self.reach_idx.append(reach_idx)
             self.reach.append(RiverReach(
                 lon=lon, lat=lat, x=x, y=y, metadata=reach_metadata,
@@ -312,12 +483,16 @@ class ReachDatabase(Product):
         klass.nodes = self.nodes.subset(reach_ids)
         klass.reaches = self.reaches.subset(reach_ids)
         klass.centerlines = self.centerlines.subset(reach_ids)
-        klass.x_min = np.min(klass.centerlines.x)
-        klass.x_max = np.max(klass.centerlines.x)
-        klass.y_min = np.min(klass.centerlines.y)
-        klass.y_max = np.max(klass.centerlines.y)
+        klass.set_bounds()
         return klass
 
+    def set_bounds(self):
+        """Sets the bounds attributes from the centerlines"""
+        self.x_min = np.min(self.centerlines.x)
+        self.x_max = np.max(self.centerlines.x)
+        self.y_min = np.min(self.centerlines.y)
+        self.y_max = np.max(self.centerlines.y)
+
 
     def __call__(self, reach_id):
         """Returns dict-o-stuff for reach_id"""
@@ -355,28 +530,66 @@ class ReachDatabase(Product):
 
         if lonmax < lonmin: lonmax += 360
         klass = None
-        for db_file in glob.glob(os.path.join(reach_db_path, '*.nc')):
-            with netCDF4.Dataset(db_file, 'r') as ifp:
-                reach_lonmin, reach_lonmax = ifp.x_min, ifp.x_max
-                reach_latmin, reach_latmax = ifp.y_min, ifp.y_max
+        for entry in get_catalog(reach_db_path):
+            db_file = os.path.join(reach_db_path, entry['file'])
 
-                # check for wraps
-                if reach_lonmax < reach_lonmin: reach_lonmax += 360
-
-                if (reach_lonmin < lonmax and reach_lonmax > lonmin and
-                    reach_latmin < latmax and reach_latmax > latmin):
-
-                    LOGGER.info('Using reach db tile {}'.format(db_file))
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore")
-                        this_db = cls.from_ncfile(db_file)
-                    if klass is None:
-                        klass = this_db
-                    else:
-                        klass = klass + this_db
+            # no reaches (or no reaches group) to read
+            if entry['reach_id_min'] is None:
+                continue
+
+            reach_lonmin, reach_lonmax = entry['x_min'], entry['x_max']
+            reach_latmin, reach_latmax = entry['y_min'], entry['y_max']
+
+            # check for wraps
+            if reach_lonmax < reach_lonmin: reach_lonmax += 360
+
+            if (reach_lonmin < lonmax and reach_lonmax > lonmin and
+                reach_latmin < latmax and reach_latmax > latmin):
+
+                LOGGER.info('Using reach db tile {}'.format(db_file))
+                this_db = cls.from_ncfile_region(db_file, bounding_box)
+                if this_db is None:
+                    continue
+                if klass is None:
+                    klass = this_db
+                else:
+                    klass = klass + this_db
+        return klass
+
+    @classmethod
+    def from_ncfile_region(cls, db_file, bounding_box):
+        """
+        Builds a ReachDatabase from a ReachDatabase file, with only the
+        reaches that intersect the bounding box (see
+        ReachDatabaseReaches.extract). Returns None if there are none.
+
+        Only the reach bounds and the reach_ids are read in full; the other
+        variables of each group are read over the span that holds those
+        reaches (see read_subset).
+
+        bounding_box = [min_lon, min_lat, max_lon, max_lat]
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            with netCDF4.Dataset(db_file, 'r') as ifp:
+                reaches = ReachDatabaseReaches()
+                for key in ['reach_id', 'x_min', 'x_max', 'y_min', 'y_max']:
+                    reaches[key] = netcdf.get_variable(ifp['reaches'], key)
+                reach_ids = reaches.extract(bounding_box)
+                if len(reach_ids) == 0:
+                    return None
+
+                klass = cls()
+                for key, class_name in cls.GROUPS.items():
+                    full = klass.get_product(class_name)()
+                    full.reach_id = netcdf.get_variable(ifp[key], 'reach_id')
+                    klass[key] = klass.get_product(class_name)()
+                    read_subset(
+                        ifp[key], klass[key], full.get_subset_index(reach_ids))
+        klass.set_bounds()
         return klass
 
-class ReachDatabaseNodes(Product):
+class ReachDatabaseNodes(ReachIndexMixIn, Product):
     """Prior Reach database nodes"""
     ATTRIBUTES = odict()
     DIMENSIONS = odict([['centerlines', 2], ['nodes', 0]])
@@ -419,9 +632,7 @@ class ReachDatabaseNodes(Product):
     def subset(self, reach_ids):
         """Subsets the PRD nodes by reach_ids"""
         klass = ReachDatabaseNodes()
-        mask = self.reach_id == reach_ids[0]
-        for reach_id in reach_ids[1:]:
-            mask = np.logical_or(mask, self.reach_id == reach_id)
+        mask = self.get_subset_index(reach_ids)
         outputs = {
             key: self[key][..., mask] for key in self.VARIABLES.keys()}
         for key, value in outputs.items():
@@ -430,9 +641,10 @@ class ReachDatabaseNodes(Product):
 
     def __call__(self, reach_id):
         """Returns dict-o-stuff for reach_id"""
-        mask = self.reach_id == reach_id
+        mask = self.get_reach_index()(reach_id)
         if reach_id % 10 != 6:
-            mask = np.logical_and(mask, self.width > 1)
+            mask = mask[np.ma.getdata(np.logical_and(
+                self.reach_id[mask] == reach_id, self.width[mask] > 1))]
         outputs = {
             key: self[key][..., mask] for key in self.VARIABLES.keys()}
         return outputs
@@ -448,7 +660,7 @@ class ReachDatabaseNodes(Product):
         klass.cl_ids = np.concatenate([self.cl_ids, other.cl_ids], 1)
         return klass
 
-class ReachDatabaseReaches(Product):
+class ReachDatabaseReaches(ReachIndexMixIn, Product):
     """Prior Reach database reaches"""
     ATTRIBUTES = odict([])
     GROUPS = odict([
@@ -518,9 +730,7 @@ class ReachDatabaseReaches(Product):
     def subset(self, reach_ids):
         """Subsets the PRD reaches by reach_ids"""
         klass = ReachDatabaseReaches()
-        mask = self.reach_id == reach_ids[0]
-        for reach_id in reach_ids[1:]:
-            mask = np.logical_or(mask, self.reach_id == reach_id)
+        mask = self.get_subset_index(reach_ids)
         outputs = {
             key: self[key][..., mask] for key in self.VARIABLES.keys()}
         outputs['area_fits'] = self.area_fits.subset(mask)
@@ -531,7 +741,7 @@ class ReachDatabaseReaches(Product):
 
     def __call__(self, reach_id):
         """Returns dict of reach attributes for reach_id"""
-        mask = self.reach_id == reach_id
+        mask = self.get_reach_index()(reach_id)
         outputs = {
             key: self[key][..., mask] for key in self.VARIABLES.keys()}
         outputs['area_fits'] = self.area_fits(mask)
@@ -566,25 +776,22 @@ class ReachDatabaseReaches(Product):
         if lonmax < lonmin:
             lonmax += 360
 
-        # iterate over reaches in self.reaches
-        reach_zips = zip(
-            self.x_min-BUFFER, self.y_min-BUFFER, self.x_max+BUFFER,
-            self.y_max+BUFFER, self.reach_id)
-
-        overlapping_reach_ids = []
-        for reach_zip in reach_zips:
-
-            reach_lonmin, reach_latmin, reach_lonmax, reach_latmax, reach_id =\
-                reach_zip
+        reach_lonmin = self.x_min-BUFFER
+        reach_latmin = self.y_min-BUFFER
+        reach_lonmax = self.x_max+BUFFER
+        reach_latmax = self.y_max+BUFFER
 
-            if reach_lonmax < reach_lonmin:
-                reach_lonmax += 360
+        # check for wraps
+        reach_lonmax = np.ma.where(
+            reach_lonmax < reach_lonmin, reach_lonmax+360, reach_lonmax)
 
-            # test for overlap (assumption is 2D decomp into two 1D intervals)
-            if(latmin < reach_latmax and latmax > reach_latmin and
-               lonmin < reach_lonmax and lonmax > reach_lonmin):
-                overlapping_reach_ids.append(reach_id)
-        return overlapping_reach_ids
+        # test for overlap (assumption is 2D decomp into two 1D intervals),
+        # reaches with masked bounds never overlap
+        overlaps = np.ones(self.reach_id.shape, dtype=bool)
+        for overlap in [latmin < reach_latmax, latmax > reach_latmin,
+                        lonmin < reach_lonmax, lonmax > reach_lonmin]:
+            overlaps = np.logical_and(overlaps, np.ma.filled(overlap, False))
+        return list(self.reach_id[overlaps])
 
 class ReachDatabaseReachDischargeModelsGroup(Product):
     ATTRIBUTES = odict()
@@ -901,7 +1108,7 @@ class ReachDatabaseReachAreaFits(Product):
                 getattr(self, dset), getattr(other, dset)], 2))
         return klass
 
-class ReachDatabaseCenterlines(Product):
+class ReachDatabaseCenterlines(ReachIndexMixIn, Product):
     """Prior Reach database centerlines"""
     ATTRIBUTES = odict()
     DIMENSIONS = odict([['centerlines', 4], ['points', 0]])
@@ -919,13 +1126,18 @@ class ReachDatabaseCenterlines(Product):
          odict([['dtype', 'i8'], ['dimensions', DIMENSIONS_POINTS]])],
         ])
 
+    def get_subset_index(self, reach_ids):
+        """
+        Returns the increasing positions of the points with any of the
+        reach_ids in any of the centerlines
+        """
+        return np.unique(
+            self.get_reach_index().subset(reach_ids) % self.reach_id.shape[1])
+
     def subset(self, reach_ids):
         """Subsets the PRD ReachDatabaseCenterlines by reach_ids"""
         klass = ReachDatabaseCenterlines()
-        mask = np.any(self.reach_id == reach_ids[0], axis=0)
-        for reach_id in reach_ids[1:]:
-            mask = np.logical_or(
-                mask, np.any(self.reach_id == reach_id, axis=0))
+        mask = self.get_subset_index(reach_ids)
         outputs = {
             key: self[key][..., mask] for key in self.VARIABLES.keys()}
         for key, value in outputs.items():
@@ -934,9 +1146,13 @@ class ReachDatabaseCenterlines(Product):
 
     def __call__(self, reach_id):
         """Returns dict of reach attributes for reach_id"""
-        mask_all = self.reach_id == reach_id
-        mask = np.any(mask_all, axis=0)
-        mask_extra = np.any(mask_all[1:, mask], axis=0)
+        # points with reach_id in any of the centerlines, and extra ones where
+        # it is not the first
+        num_points = self.reach_id.shape[1]
+        positions = self.get_reach_index()(reach_id)
+        mask = np.unique(positions % num_points)
+        mask_extra = np.isin(mask, positions[positions >= num_points] %
+                             num_points)
         outputs = {
             key: self[key][..., mask] for key in self.VARIABLES.keys()}
         outputs['is_extra_vertex'] = mask_extra
@@ -0,0 +1,73 @@
+"""
+The topology of a set of reaches, from the ids of their upstream and
+downstream reaches in the prior reach database.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+class ReachGraph:
+    """
+    Reach ids and the up/downstream reach ids of each reach.
+
+    Reach ids are looked up with a dict, so that finding the neighbours of a
+    reach does not need to search all of the reaches.
+
+    Parameters
+    ----------
+
+    reach_ids : list
+        Id of each reach.
+    up_ids, dn_ids : list of array_like, optional
+        Ids of the upstream / downstream reaches of each reach, in the
+        order of the prior reach database. 0 (or masked) means none.
+    """
+
+    def __init__(self, reach_ids, up_ids=None, dn_ids=None):
+        self.reach_ids = list(reach_ids)
+
+        # position of the first reach with each id
+        self.positions = {}
+        for position, reach_id in enumerate(self.reach_ids):
+            self.positions.setdefault(reach_id, position)
+
+        if up_ids is None:
+            up_ids = [[] for reach_id in self.reach_ids]
+        if dn_ids is None:
+            dn_ids = [[] for reach_id in self.reach_ids]
+        self.up_ids = [
+            np.ma.filled(np.ma.asarray(item, dtype=np.int64), 0)
+            for item in up_ids]
+        self.dn_ids = [
+            np.ma.filled(np.ma.asarray(item, dtype=np.int64), 0)
+            for item in dn_ids]
+
+    @classmethod
+    def from_reaches(cls, reaches):
+        """
+        Makes the graph of the reaches of a ReachExtractor (positions are
+        indices into it).
+        """
+        return cls(
+            reaches.reach_idx,
+            [reaches[ii].metadata['rch_id_up'][:, 0]
+             for ii in range(len(reaches))],
+            [reaches[ii].metadata['rch_id_dn'][:, 0]
+             for ii in range(len(reaches))])
+
+    def __len__(self):
+        return len(self.reach_ids)
+
+    def index(self, reach_id):
+        """Position of the first reach with reach_id, None if there is none"""
+        if np.ma.is_masked(reach_id):
+            return None
+        return self.positions.get(reach_id)
+
+    def adjacent_ids(self, position):
+        """Ids of the up and downstream reaches of the reach at position"""
+        adjacent_ids = np.concatenate(
+            [self.up_ids[position], self.dn_ids[position]])
+        return adjacent_ids[adjacent_ids != 0]
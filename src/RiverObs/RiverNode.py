@@ -9,6 +9,38 @@ import numpy as np
 import SWOTWater.aggregate as aggregate
 from SWOTWater.constants import PIXC_CLASSES
 
+def get_height_std_pix(phase_noise_std, dh_dphi):
+    """
+    Return the pixel height std used to weight the height aggregation
+    """
+    height_std_pix = np.abs(phase_noise_std * dh_dphi)
+    # set bad pix height std to high number to deweight
+    # instead of giving infs/nans
+    bad_num = 1.0e5
+    height_std_pix[height_std_pix<=0] = bad_num
+    height_std_pix[np.isinf(height_std_pix)] = bad_num
+    height_std_pix[np.isnan(height_std_pix)] = bad_num
+    return height_std_pix
+
+def get_area_klass(klass, edge_water, detected=False):
+    """
+    Return the water classes to send to the area aggregation
+
+    First set everything to interior water, then set
+    use_fractional_inundation pixels to water edge. Assumes we dont give
+    land pixels in the class_list if method=simple and that we set the
+    use_fractional_inundation to true for land edge pixels if
+    method=water_fraction or method=composite. If detected, also reject
+    dark water.
+    """
+    area_klass = np.zeros(np.shape(klass)) + PIXC_CLASSES['open_water']
+    area_klass[edge_water==1] = PIXC_CLASSES['water_near_land']
+    area_klass[klass == PIXC_CLASSES['land_near_dark_water']] = 0
+    if detected:
+        area_klass[klass == PIXC_CLASSES['dark_water_edge']] = 0
+        area_klass[klass == PIXC_CLASSES['dark_water']] = 0
+    return area_klass
+
 class RiverNode:
     """
     A river node holds all of the measurements associated with a node in a
@@ -304,13 +336,7 @@ class RiverNode:
         Return the aggregate height with corresponding uncertainty 
         """
         good = getattr(self, goodvar)
-        height_std_pix = np.abs(self.phase_noise_std * self.dh_dphi)
-        # set bad pix height std to high number to deweight 
-        # instead of giving infs/nans
-        bad_num = 1.0e5
-        height_std_pix[height_std_pix<=0] = bad_num
-        height_std_pix[np.isinf(height_std_pix)] = bad_num
-        height_std_pix[np.isnan(height_std_pix)] = bad_num
+        height_std_pix = get_height_std_pix(self.phase_noise_std, self.dh_dphi)
         # call the general function
         return aggregate.height_with_uncerts(
             self.h_noise,  good, self.num_rare_looks, self.num_med_looks,
@@ -332,19 +358,9 @@ class RiverNode:
         interior_water_klass = PIXC_CLASSES['open_water']
         water_edge_klass = PIXC_CLASSES['water_near_land']
         land_edge_klass = PIXC_CLASSES['land_near_water']
-        land_near_dark_water_klass = PIXC_CLASSES['land_near_dark_water']
-        dark_edge_klass = PIXC_CLASSES['dark_water_edge']
-        dark_klass = PIXC_CLASSES['dark_water']
 
         # decode/encode the water classes to send to external function
-        # first set everything to interior water
-        # then set use_fractional_inundation pixels to water edge 
-        # assumes we dont give land pixels in the class_list if method=simple
-        # and that we set the use_fractional_inundation to true for land edge
-        # pixels if method=water_fraction or method=composite
-        klass = np.zeros(np.shape(self.klass)) + interior_water_klass
-        klass[self.edge_water==1] = water_edge_klass
-        klass[self.klass == land_near_dark_water_klass] = 0
+        klass = get_area_klass(self.klass, self.edge_water)
 
         # call the external function to aggregate areas and uncertainties
         area, area_unc, area_pcnt_uncert = aggregate.area_with_uncert(
@@ -361,9 +377,7 @@ class RiverNode:
         width_area_unc = area_unc/self.ds
 
         # reject dark water and recompute areas and uncertainties
-        klass[self.klass == land_near_dark_water_klass] = 0
-        klass[self.klass == dark_edge_klass] = 0
-        klass[self.klass == dark_klass] = 0
+        klass = get_area_klass(self.klass, self.edge_water, detected=True)
 
         area_det, area_det_unc, area_det_pcnt_uncert = \
             aggregate.area_with_uncert(
@@ -1,13 +1,14 @@
 from __future__ import absolute_import, division, print_function
 
-import copy
 import collections
 import scipy.stats
 import numpy as np
 import logging
 
+import SWOTWater.aggregate as aggregate
 from Centerline import Centerline
-from .RiverNode import RiverNode
+from SWOTWater.constants import PIXC_CLASSES
+from .RiverNode import RiverNode, get_height_std_pix, get_area_klass
 
 LOGGER = logging.getLogger(__name__)
 
@@ -15,6 +16,85 @@ MISSING_VALUE_INT4 = -999
 MISSING_VALUE_INT9 = -99999999
 MISSING_VALUE_FLT = -999999999999
 
+def segment_reduce(ufunc, x, counts, empty=np.nan):
+    """
+    Apply ufunc.reduce to consecutive segments of x with the given counts.
+    Segments with no elements get the value empty.
+    """
+    x = np.asarray(x)
+    counts = np.asarray(counts)
+    nonempty = counts > 0
+    result = np.full(len(counts), empty, dtype=np.result_type(x, empty))
+    if nonempty.any():
+        starts = (np.cumsum(counts) - counts)[nonempty]
+        result[nonempty] = ufunc.reduceat(x, starts)
+    return result
+
+
+def segment_mean(x, counts):
+    """Mean of each segment of x (nan for empty segments)"""
+    x = np.asarray(x)
+    if x.dtype.kind in 'biu':
+        x = x.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (segment_reduce(np.add, x, counts, 0) / counts).astype(
+            x.dtype)
+
+
+def segment_std(x, counts):
+    """Standard deviation of each segment of x, as np.std"""
+    x = np.asarray(x)
+    if x.dtype.kind in 'biu':
+        x = x.astype(np.float64)
+    mean = segment_mean(x, counts)
+    deviation = x - np.repeat(mean, counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt(segment_reduce(
+            np.add, deviation * deviation, counts, 0) / counts).astype(
+                x.dtype)
+
+
+def segment_percentile(x, counts, q, median=False):
+    """
+    q-th percentile of each segment of x, as np.percentile (or np.median
+    if median is True). Segments holding a nan give nan, and empty
+    segments give nan.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    counts = np.asarray(counts)
+    starts = np.cumsum(counts) - counts
+    segment = np.repeat(np.arange(len(counts)), counts)
+
+    # sort within segments
+    x_sorted = x[np.lexsort((x, segment))]
+
+    result = np.full(len(counts), np.nan)
+    nonempty = counts > 0
+    start, count = starts[nonempty], counts[nonempty]
+
+    if median:
+        lower = x_sorted[start + (count - 1) // 2]
+        upper = x_sorted[start + count // 2]
+        value = np.where(count % 2 == 1, upper, (lower + upper) / 2.)
+    else:
+        virtual = np.true_divide(q, 100) * (count - 1)
+        previous = np.floor(virtual).astype(np.int64)
+        gamma = virtual - previous
+        nxt = np.minimum(previous + 1, count - 1)
+        lower = x_sorted[start + previous]
+        upper = x_sorted[start + nxt]
+        diff = upper - lower
+        value = np.where(
+            gamma >= 0.5, upper - diff * (1 - gamma), lower + diff * gamma)
+
+    # nan poisons the segment, as for np.median/np.percentile
+    has_nan = segment_reduce(
+        np.add, np.isnan(x).astype(np.int64), counts, 0)[nonempty] > 0
+    value[has_nan] = np.nan
+    result[nonempty] = value
+    return result
+
+
 class RiverObs:
     """
     A class for holding all of the river observations associated with a reach.
@@ -51,6 +131,10 @@ class RiverObs:
     missing_value : float, default -9999
         This value is reported when a node_stat is requested of an empty node.
         Output progress to stdout
+    obs_index : ObsIndex, optional
+        Spatial index over xobs, yobs. If given (and max_width is not None),
+        only the observations that can fall inside the channel are projected
+        onto the centerline; all others are flagged out of the channel.
     """
 
     def __init__(self,
@@ -64,7 +148,8 @@ class RiverObs:
                  minobs=1,
                  node_class=RiverNode,
                  missing_value=MISSING_VALUE_FLT,
-                 second_pass=False):
+                 second_pass=False,
+                 obs_index=None):
 
         self.missing_value = missing_value
 
@@ -73,6 +158,7 @@ class RiverObs:
 
         # Register the node class
         self.node_class = node_class
+        self._river_nodes = None
 
         # Copy metadata, in case it is present
         try:
@@ -104,21 +190,40 @@ class RiverObs:
         else:
             self.ds = reach.node_length
 
+        # Use variable ext_dist_coef on second pass
+        ext_dist_coef = reach.ext_dist_coef if self.second_pass else None
+
+        self.obs_index = obs_index
+        self.obs_coords = None
+        self.minobs = minobs
+        self.init_obs(xobs, yobs, seg_label, ext_dist_coef)
+
+    def init_obs(self, xobs, yobs, seg_label=None, ext_dist_coef=None):
+        """
+        Compute the local coordinates of the observations, flag out the
+        ones outside the channel, and map the rest to the nodes.
+
+        The local coordinates computed for the current centerline are kept,
+        so that calling this again (e.g., with a different seg_label or
+        ext_dist_coef) only projects observations not seen before.
+        """
+        # Only project the observations that can end up in the channel
+        self.candidates = None
+        if self.obs_index is not None and self.max_width is not None:
+            self.candidates = self.get_candidate_obs(
+                self.obs_index, seg_label, ext_dist_coef)
+
+        if self.candidates is not None and seg_label is not None:
+            seg_label = seg_label[self.candidates]
+
         # Calculate the local coordinates for each observation point
         # index: the index of the nearest point
         # d: distance to the point
         # x,y: The coordinates of the nearest point
         # s,n: The along and across river coordinates of the point
         # relative to the nearest point coordinate system.
-        self.index, self.d, self.x, self.y, self.s, self.n = self.centerline(
-            xobs, yobs)
-        # squeeze extra dimensions
-        self.index = np.squeeze(self.index)
-        self.d = np.squeeze(self.d)
-        self.x = np.squeeze(self.x)
-        self.y = np.squeeze(self.y)
-        self.s = np.squeeze(self.s)
-        self.n = np.squeeze(self.n)
+        self.index, self.d, self.x, self.y, self.s, self.n = \
+            self.get_local_coords(xobs, yobs, self.candidates)
 
         LOGGER.debug('Local coordiantes calculated')
 
@@ -127,26 +232,110 @@ class RiverObs:
 
         # Flag out pixels not in the dominant segmentation label
         if self.max_width is not None:
+            self.in_channel = self.flag_out_channel_and_label(
+                self.max_width, seg_label, ext_dist_coef=ext_dist_coef)
 
-            # Use variable ext_dist_coef on second pass
-            if self.second_pass:
-                self.in_channel = self.flag_out_channel_and_label(
-                    self.max_width, seg_label, ext_dist_coef=reach.ext_dist_coef)
-
-            else:
-                self.in_channel = self.flag_out_channel_and_label(
-                    self.max_width, seg_label, ext_dist_coef=None)
+            # expand the mask back to all of the observations
+            if self.candidates is not None:
+                in_channel = np.zeros(self.ndata, dtype=bool)
+                in_channel[self.candidates] = self.in_channel
+                self.in_channel = in_channel
 
         self.nedited_data = len(self.x)
         LOGGER.debug("num nodes in reach %d" % len(np.unique(self.index)))
         # Get the mapping from observation to node position (1 -> many);
         # i.e., the inverse of index (many -> 1), which maps node position
         # to observations
-
-        self.minobs = minobs
         self.populated_nodes, self.obs_to_node_map = self.get_obs_to_node_map(
             self.index, self.minobs)
 
+    def get_local_coords(self, xobs, yobs, candidates=None):
+        """
+        Get index, d, x, y, s, n (see Centerline.to_centerline) for the
+        candidate observations (all observations if None).
+
+        The results are kept in obs_coords, so only the observations not
+        previously projected onto the current centerline are projected.
+        """
+        if candidates is None:
+            candidates = np.arange(self.ndata)
+
+        if self.obs_coords is None:
+            new = candidates
+        else:
+            new = np.setdiff1d(
+                candidates, self.obs_coords[0], assume_unique=True)
+
+        if len(new) > 0 or self.obs_coords is None:
+            # squeeze extra dimensions
+            coords = [np.atleast_1d(np.squeeze(item)) for item in
+                      self.centerline(np.asarray(xobs)[new],
+                                      np.asarray(yobs)[new])]
+            if self.obs_coords is None:
+                self.obs_coords = [new] + coords
+            else:
+                obs_ids = np.concatenate([self.obs_coords[0], new])
+                isort = np.argsort(obs_ids, kind='stable')
+                self.obs_coords = [obs_ids[isort]] + [
+                    np.concatenate([old, item])[isort] for old, item in
+                    zip(self.obs_coords[1:], coords)]
+
+        obs_ids = self.obs_coords[0]
+        if len(obs_ids) == len(candidates) and (obs_ids == candidates).all():
+            return tuple(item.copy() for item in self.obs_coords[1:])
+
+        position = np.searchsorted(obs_ids, candidates)
+        return tuple(item[position] for item in self.obs_coords[1:])
+
+    def get_candidate_obs(self, obs_index, seg_label, ext_dist_coef=None):
+        """
+        Get the indexes of all of the observations which could be flagged
+        as inside the channel by flag_out_channel_and_label.
+
+        An observation is in the channel if it is within max_width/2 across
+        and 3*ds along the river from its nearest node, or if it is in the
+        dominant segmentation label and within the extreme distance of the
+        node. Both imply a maximum distance to the node, so only the
+        observations within that distance of some node need to be
+        considered. The result is a sorted superset of these observations,
+        or None if the node distances can not be computed.
+        """
+        n_nodes = len(self.centerline.x)
+        if np.ndim(self.ds) != 1 or len(self.ds) != n_nodes:
+            return None
+
+        if np.iterable(self.max_width):
+            max_distance = np.asarray(self.max_width) / 2.
+        else:
+            max_distance = self.max_width / 2. * np.ones(n_nodes)
+
+        ds = abs(np.asarray(self.ds))
+        if ext_dist_coef is None:
+            ext_dist_coef = 20.0
+        elif np.ndim(ext_dist_coef) != 1 or len(ext_dist_coef) != n_nodes:
+            return None
+
+        candidates = obs_index.query(
+            self.centerline.x, self.centerline.y,
+            np.hypot(max_distance, 3.0 * ds))
+
+        if seg_label is None or len(candidates) == 0:
+            return candidates
+
+        # The dominant label is taken from the observations above
+        labels = np.unique(seg_label[candidates])
+        labels = labels[labels > 0]
+        if len(labels) == 0:
+            return candidates
+
+        extreme_dist = np.asarray(ext_dist_coef) * np.maximum(
+            ds, max_distance)
+        extended = obs_index.query(
+            self.centerline.x, self.centerline.y,
+            np.sqrt(2.) * extreme_dist)
+        extended = extended[np.isin(seg_label[extended], labels)]
+        return np.union1d(candidates, extended)
+
     def flag_out_channel_and_label(
         self, max_width, seg_label, ext_dist_coef=None):
         """
@@ -237,29 +426,37 @@ class RiverObs:
         observations.
         """
 
-        # Get the list of potential nodes
-        nodes = np.unique(index)
+        # Group the observations by node with a single sort. The stable
+        # sort keeps the observations of each node in their original order.
+        index = np.asarray(index)
+        order = np.argsort(index, kind='stable')
+        nodes, counts = np.unique(index[order], return_counts=True)
+        populated = counts >= minobs
+
+        # CSR layout of the populated nodes: the observations of the i-th
+        # populated node are obs_order[node_offsets[i]:node_offsets[i+1]]
+        self.obs_order = order[np.repeat(populated, counts)]
+        self.node_offsets = np.zeros(populated.sum() + 1, dtype=np.int64)
+        self.node_offsets[1:] = np.cumsum(counts[populated])
 
         self.obs_to_node_map = collections.OrderedDict()
         self.nobs = np.zeros(len(self.centerline.x), dtype=np.int32)
-        self.populated_nodes = []
-        for node in nodes:
-            obs_index = np.flatnonzero(index == node)
-            nobs = len(obs_index)
-            if nobs >= minobs:
-                self.populated_nodes.append(node)
-                self.obs_to_node_map[node] = obs_index
-                self.nobs[node] = nobs
+        self.populated_nodes = list(nodes[populated])
+        for node, start, stop in zip(self.populated_nodes,
+                                     self.node_offsets[:-1],
+                                     self.node_offsets[1:]):
+            self.obs_to_node_map[node] = self.obs_order[start:stop]
+        self.nobs[nodes[populated]] = counts[populated]
         self.n_populated_nodes = len(self.populated_nodes)
+        self.populated_node_set = set(self.populated_nodes)
 
         # Store also a list of all the potential nodes and all the
         # unpopulated nodes
         self.n_nodes = len(self.centerline.s)
         self.all_nodes = np.arange(self.n_nodes, dtype=np.int32)
-        self.unpopulated_nodes = []
-        for node in self.all_nodes:
-            if not node in self.populated_nodes:
-                self.unpopulated_nodes.append(node)
+        is_populated = np.zeros(self.n_nodes, dtype=bool)
+        is_populated[nodes[populated]] = True
+        self.unpopulated_nodes = list(self.all_nodes[~is_populated])
         self.n_unpopulated_nodes = len(self.unpopulated_nodes)
         return self.populated_nodes, self.obs_to_node_map
 
@@ -304,7 +501,7 @@ class RiverObs:
         are no observations for that node.
         """
 
-        if not (int(node) in self.populated_nodes):
+        if not (int(node) in self.populated_node_set):
             return np.array([])
 
         # If only certain observations have been kept, get the edited vector
@@ -317,26 +514,61 @@ class RiverObs:
         """Load the desired variables into each of the populated nodes.
 
         All of the vars should have been loaded previously with add_obs.
+
+        The observations are stored sorted by node (node_obs, with the nodes
+        in loaded_nodes and the segment offsets in loaded_offsets), which
+        is what get_node_stat uses. The RiverNode objects are only made
+        when river_nodes is accessed.
         """
 
         if type(vars) == str:
             vars = [vars]
 
-        self.river_nodes = collections.OrderedDict()
-
-        for node in self.populated_nodes:
-            d = self.obs_to_node(self.d, node)
-            x = self.obs_to_node(self.x, node)
-            y = self.obs_to_node(self.y, node)
-            s = self.obs_to_node(self.s, node)
-            n = self.obs_to_node(self.n, node)
-            #h_flg = self.obs_to_node(self.h_flg,node)
-            self.river_nodes[node] = self.node_class(
-                node, d, x, y, s, n, ds=self.ds[node])
-
-            for var in vars:
-                obs = self.obs_to_node(getattr(self, var), node)
-                self.river_nodes[node].add_obs(var, obs, sort=False)
+        # Observation index of the populated nodes, one node after the other
+        self.loaded_nodes = np.asarray(self.populated_nodes, dtype=np.int64)
+        if list(self.obs_to_node_map.keys()) == self.populated_nodes:
+            obs_index = self.obs_order
+        elif len(self.populated_nodes) > 0:
+            obs_index = np.concatenate([
+                self.obs_to_node_map[node] for node in self.populated_nodes])
+        else:
+            obs_index = np.array([], dtype=np.int64)
+
+        self.loaded_offsets = np.zeros(
+            len(self.loaded_nodes) + 1, dtype=np.int64)
+        self.loaded_offsets[1:] = np.cumsum(
+            [len(self.obs_to_node_map[node]) for node in self.populated_nodes])
+
+        self.node_obs = collections.OrderedDict()
+        for var in ['d', 'x', 'y', 's', 'n'] + list(vars):
+            obs = getattr(self, var)
+            # If only certain observations have been kept, get the edited
+            # vector
+            if self.max_width is not None and len(obs) == self.ndata:
+                obs = obs[self.in_channel]
+            self.node_obs[var] = np.asarray(obs)[obs_index]
+
+        self.node_vars = list(vars)
+        self._river_nodes = None
+
+    @property
+    def river_nodes(self):
+        """The RiverNode of each loaded node (made on first access)."""
+        if self._river_nodes is None:
+            self._river_nodes = collections.OrderedDict()
+            bounds = zip(self.loaded_nodes, self.loaded_offsets[:-1],
+                         self.loaded_offsets[1:])
+            for node, start, stop in bounds:
+                obs = {var: value[start:stop]
+                       for var, value in self.node_obs.items()}
+                self._river_nodes[node] = self.node_class(
+                    node, obs['d'], obs['x'], obs['y'], obs['s'], obs['n'],
+                    ds=self.ds[node])
+
+                for var in self.node_vars:
+                    self._river_nodes[node].add_obs(var, obs[var], sort=False)
+
+        return self._river_nodes
 
     def get_node_stat(self, stat, var, all_nodes=False, good_flag=None):
         """
@@ -357,10 +589,28 @@ class RiverObs:
         The result is a list over desired nodes, with the populated nodes
         holding the result and the unpopulated nodes (when requested) holding
         the missing_value.
+
+        The common stats are computed for all the nodes at once from the
+        observations sorted by node (see get_node_stats). The RiverNode
+        stat functions are used for the others, or when the RiverNode
+        objects have been made, since they may have been edited (e.g., by
+        trim_nodes).
         """
+        values = None
+        if self._river_nodes is None and self.node_class is RiverNode:
+            values = self.get_node_stats(stat, var, good_flag)
+
+        if values is not None:
+            if not all_nodes:
+                return list(values)
+            result = np.full(self.n_nodes, self.missing_value,
+                             dtype=np.result_type(values, self.missing_value))
+            result[np.asarray(self.populated_nodes, dtype=int)] = values
+            return list(result)
+
         result = []
         for node in self.all_nodes:
-            if node in self.populated_nodes:
+            if node in self.populated_node_set:
                 river_node = self.river_nodes[node]
                 if good_flag is None:
                     result.append(getattr(river_node, stat)(var))
@@ -373,6 +623,139 @@ class RiverObs:
 
         return result
 
+    def get_node_segments(self):
+        """
+        Get the loaded observations of the populated nodes, sorted by node.
+
+        Returns the populated nodes, the number of observations in each,
+        and a function returning a loaded variable for those observations
+        (or None if it was not loaded). Returns None if some populated node
+        was not loaded.
+        """
+        nodes = np.asarray(self.populated_nodes, dtype=np.int64)
+        position = np.searchsorted(self.loaded_nodes, nodes)
+        if len(nodes) > 0 and (
+                position.max() >= len(self.loaded_nodes) or
+                (self.loaded_nodes[position] != nodes).any()):
+            return None
+
+        starts = self.loaded_offsets[:-1][position]
+        counts = self.loaded_offsets[1:][position] - starts
+        if len(nodes) == len(self.loaded_nodes):
+            take = None
+        else:
+            take = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+                np.arange(counts.sum())
+
+        def column(name):
+            if name not in self.node_obs:
+                return None
+            value = self.node_obs[name]
+            return value if take is None else value[take]
+
+        return nodes, counts, column
+
+    def get_node_stats(self, stat, var, good_flag=None):
+        """
+        Compute a RiverNode stat for all the populated nodes at once, using
+        segmented reductions over the observations sorted by node.
+
+        Returns an array over the populated nodes, or None if the stat (or
+        its inputs) is not supported, or if the RiverNode stat would raise
+        an exception (e.g., min of no observations).
+        """
+        segments = self.get_node_segments()
+        if segments is None:
+            return None
+        nodes, counts, column = segments
+
+        # RiverNode.percentile(var, q, goodvar) gets good_flag as q
+        goodvar, q = good_flag, None
+        if stat == 'percentile':
+            goodvar, q = None, good_flag
+
+        good = None
+        if goodvar is not None and goodvar != 'good':
+            good = column(goodvar)
+            if good is None or good.dtype != bool:
+                return None
+
+        if stat == 'count':
+            return counts.copy()
+
+        elif stat == 'countGood':
+            good = column(var)
+            if goodvar is not None or good is None or good.dtype != bool:
+                return None
+            return segment_reduce(
+                np.add, good.astype(np.float64), counts, 0.)
+
+        elif stat == 'value':
+            if var == 'ds':
+                return np.asarray(self.ds)[nodes]
+            elif var == 'index':
+                return nodes
+            return None
+
+        elif stat in ('width_ptp', 'width_std', 'width_area'):
+            if goodvar is not None:
+                return None
+            if stat == 'width_ptp':
+                if (counts == 0).any():
+                    return None
+                n = column('n')
+                return (segment_reduce(np.maximum, n, counts) -
+                        segment_reduce(np.minimum, n, counts))
+            elif stat == 'width_std':
+                return np.sqrt(12.) * segment_std(column('n'), counts)
+            else:
+                area = column(var)
+                if area is None:
+                    return None
+                return segment_reduce(np.add, area, counts, 0) / \
+                    np.asarray(self.ds)[nodes]
+
+        x = column(var)
+        if x is None or x.ndim != 1:
+            return None
+        if good is not None:
+            counts = segment_reduce(np.add, good.astype(np.int64), counts, 0)
+            x = x[good]
+
+        if stat == 'mean':
+            return segment_mean(x, counts)
+        elif stat == 'std':
+            return segment_std(x, counts)
+        elif stat == 'stderr':
+            return 1. / np.sqrt(counts.astype(np.float64)) * \
+                segment_std(x, counts)
+        elif stat == 'sum':
+            return segment_reduce(
+                np.add, x.astype(np.int64) if x.dtype == bool else x, counts,
+                0)
+        elif stat == 'median':
+            return segment_percentile(x, counts, 50, median=True)
+        elif stat == 'sincos_median':
+            x = np.deg2rad(x)
+            return np.rad2deg(np.arctan2(
+                segment_percentile(np.sin(x), counts, 50, median=True),
+                segment_percentile(np.cos(x), counts, 50, median=True)))
+
+        # the RiverNode stats below fail for nodes without observations
+        if (counts == 0).any():
+            return None
+        if stat == 'min':
+            return segment_reduce(np.minimum, x, counts)
+        elif stat == 'max':
+            return segment_reduce(np.maximum, x, counts)
+        elif stat == 'ptp':
+            return (segment_reduce(np.maximum, x, counts) -
+                    segment_reduce(np.minimum, x, counts))
+        elif stat == 'percentile' and np.ndim(q) == 0 and q is not None:
+            return segment_percentile(x, counts, q)
+
+        return None
+
     def get_node_agg(
         self, height_method='weight', area_method='composite',
         all_nodes=False, good_flag='good'):
@@ -386,13 +769,36 @@ class RiverObs:
         holding the result and the unpopulated nodes (when requested) holding
         the missing_value.
         """
-        outputs = {key: [] for key in [
+        keys = [
             'h', 'h_std', 'h_u', 'lat_u', 'lon_u', 'area', 'area_u',
             'area_det', 'area_det_u', 'width_area', 'width_area_u', 'sig0',
-            'sig0_u', 'sig0_std']}
+            'sig0_u', 'sig0_std']
+
+        values = None
+        if self._river_nodes is None and self.node_class is RiverNode:
+            values = self.get_node_aggs(height_method, area_method, good_flag)
+
+        if values is not None:
+            outputs = {}
+            for key in keys:
+                value = values[key]
+                if value is None:
+                    value = np.full(len(self.populated_nodes),
+                                    self.missing_value)
+                if all_nodes:
+                    result = np.full(
+                        self.n_nodes, self.missing_value,
+                        dtype=np.result_type(value, self.missing_value))
+                    result[np.asarray(self.populated_nodes, dtype=int)] = \
+                        value
+                    value = result
+                outputs[key] = np.asarray(value)
+            return outputs
+
+        outputs = {key: [] for key in keys}
 
         for node in self.all_nodes:
-            if node in self.populated_nodes:
+            if node in self.populated_node_set:
                 river_node = self.river_nodes[node]
 
                 h, h_std, h_u, lat_u, lon_u = river_node.height_with_uncert(
@@ -419,6 +825,88 @@ class RiverObs:
             outputs[key] = np.asarray(outputs[key])
         return outputs
 
+    def get_node_aggs(
+        self, height_method='weight', area_method='composite',
+        good_flag='good'):
+        """
+        Compute the RiverNode height, sig0 and area aggregations for all
+        the populated nodes at once, using the grouped aggregate functions
+        over the observations sorted by node.
+
+        Returns a dict of arrays over the populated nodes (None for the
+        outputs that RiverNode does not compute), or None if some input
+        was not loaded.
+        """
+        segments = self.get_node_segments()
+        if segments is None:
+            return None
+        nodes, counts, column = segments
+
+        names = [
+            'h_noise', 'phase_noise_std', 'dh_dphi', 'num_rare_looks',
+            'num_med_looks', 'ifgram', 'power1', 'power2',
+            'looks_to_efflooks', 'dlat_dphi', 'dlon_dphi', 'sig0', 'klass',
+            'edge_water', 'pixel_area', 'water_frac', 'water_frac_uncert',
+            'darea_dheight', 'false_detection_rate', 'missed_detection_rate']
+        obs = {name: column(name) for name in names}
+        if any(value is None for value in obs.values()):
+            return None
+
+        if good_flag == 'good':
+            good = np.ones(counts.sum(), dtype=bool)
+        else:
+            good = column(good_flag)
+            if good is None or good.dtype != bool:
+                return None
+
+        # every populated node has observations, so the features are nodes
+        feature_id = np.repeat(nodes, counts)
+        ds = np.asarray(self.ds)[nodes]
+
+        height_std_pix = get_height_std_pix(
+            obs['phase_noise_std'], obs['dh_dphi'])
+        h, h_std, h_u, lat_u, lon_u = \
+            aggregate.height_with_uncerts_grouped(
+                feature_id, obs['h_noise'], good, obs['num_rare_looks'],
+                obs['num_med_looks'], obs['ifgram'], obs['power1'],
+                obs['power2'], obs['looks_to_efflooks'], obs['dh_dphi'],
+                obs['dlat_dphi'], obs['dlon_dphi'], height_std_pix,
+                method=height_method)
+
+        sig0 = aggregate.simple_grouped(obs['sig0'], feature_id)
+        sig0_std = aggregate.height_uncert_std_grouped(
+            feature_id, obs['sig0'], good, obs['num_rare_looks'],
+            obs['num_med_looks'])
+
+        # areas use all the data, as RiverNode.area_with_uncert
+        all_good = np.ones(counts.sum(), dtype=bool)
+        area_kwds = dict(
+            Pca=0.9, Pw=0.5, Ptf=0.5, ref_dem_std=10,
+            interior_water_klass=PIXC_CLASSES['open_water'],
+            water_edge_klass=PIXC_CLASSES['water_near_land'],
+            land_edge_klass=PIXC_CLASSES['land_near_water'],
+            method=area_method)
+        area_vars = [obs[name] for name in [
+            'pixel_area', 'water_frac', 'water_frac_uncert',
+            'darea_dheight']]
+        rate_vars = [obs['false_detection_rate'],
+                     obs['missed_detection_rate'], all_good]
+
+        klass = get_area_klass(obs['klass'], obs['edge_water'])
+        area, area_u, _ = aggregate.area_with_uncert_grouped(
+            feature_id, *area_vars, klass, *rate_vars, **area_kwds)
+
+        klass = get_area_klass(obs['klass'], obs['edge_water'], detected=True)
+        area_det, area_det_u, _ = aggregate.area_with_uncert_grouped(
+            feature_id, *area_vars, klass, *rate_vars, **area_kwds)
+
+        return {
+            'h': h, 'h_std': h_std, 'h_u': h_u, 'lat_u': lat_u,
+            'lon_u': lon_u, 'area': area, 'area_u': area_u,
+            'area_det': area_det, 'area_det_u': area_det_u,
+            'width_area': area/ds, 'width_area_u': area_u/ds, 'sig0': sig0,
+            'sig0_u': None, 'sig0_std': sig0_std}
+
     def trim_nodes(self, fraction, mode='both', sort_variable='n'):
         """
         Trim the data in all the nodes.
@@ -442,19 +930,16 @@ class RiverObs:
         sorted at each step.
         """
         if not reverse:
-            from_list = copy.copy(self.populated_nodes)
-            to_list = copy.copy(self.unpopulated_nodes)
+            from_list = self.populated_nodes
+            to_list = self.unpopulated_nodes
         else:
-            to_list = copy.copy(self.populated_nodes)
-            from_list = copy.copy(self.unpopulated_nodes)
+            to_list = self.populated_nodes
+            from_list = self.unpopulated_nodes
 
-        for node in node_list:
-            try:
-                index = from_list.index(node)
-                from_list.pop(index)
-                to_list.append(node)
-            except ValueError:
-                pass
+        node_set = set(node_list)
+        moved = [node for node in from_list if node in node_set]
+        from_list = [node for node in from_list if node not in node_set]
+        to_list = to_list + moved
 
         from_list.sort()
         to_list.sort()
@@ -464,3 +949,4 @@ class RiverObs:
         else:
             self.populated_nodes = to_list
             self.unpopulated_nodes = from_list
+        self.populated_node_set = set(self.populated_nodes)
@@ -6,6 +6,8 @@ from .RiverNode import RiverNode
 from .RiverObs import RiverObs
 from .WidthDataBase import WidthDataBase
 from .IteratedRiverObs import IteratedRiverObs
+from .ObsIndex import ObsIndex
+from .ReachGraph import ReachGraph
 from .LatLonRegion import LatLonRegion
 # from .ReachPreProcessor import ReachPreProcessor
 from .RiverReach import RiverReach
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+import pytest
+import numpy as np
+
+from RiverObs.ObsIndex import ObsIndex
+
+@pytest.fixture(scope='module')
+def obs():
+    rng = np.random.RandomState(0)
+    x = 5000 * rng.rand(2000)
+    y = 3000 * rng.rand(2000)
+    x[:10] = np.nan
+    return x, y
+
+def brute_force(x, y, xx, yy, radius):
+    # observations within radius of any point (xx, yy)
+    dist2 = (x[:, np.newaxis] - xx)**2 + (y[:, np.newaxis] - yy)**2
+    return np.flatnonzero(np.any(dist2 <= np.asarray(radius)**2, axis=1))
+
+@pytest.mark.parametrize('cell_size', [50., 100., 1000.])
+def test_query(obs, cell_size):
+    x, y = obs
+    index = ObsIndex(x, y, cell_size=cell_size)
+    xx = np.linspace(-100, 5100, 30)
+    yy = 1500 + 1000*np.sin(xx/1000)
+    radius = np.linspace(20, 300, 30)
+    result = index.query(xx, yy, radius)
+
+    # a sorted superset of the observations within the disks, without the
+    # ones with non-finite coordinates
+    assert np.all(np.diff(result) > 0)
+    assert set(brute_force(x, y, xx, yy, radius)) <= set(result)
+    assert np.all(np.isfinite(x[result]))
+
+    # and only the observations in cells that can touch the disks
+    margin = np.sqrt(2) * cell_size
+    assert set(result) <= set(brute_force(x, y, xx, yy, radius + margin))
+
+def test_query_scalar_radius(obs):
+    x, y = obs
+    index = ObsIndex(x, y)
+    result = index.query([2500.], [1500.], 200.)
+    assert set(brute_force(x, y, [2500.], [1500.], 200.)) <= set(result)
+
+def test_query_empty():
+    index = ObsIndex([], [])
+    assert len(index.query([0.], [0.], 100.)) == 0
+
+    index = ObsIndex([0., 10.], [0., 10.])
+    assert len(index.query([], [], 100.)) == 0
+    assert len(index.query([0.], [0.], np.nan)) == 0
+    assert len(index.query([1.e6], [1.e6], 100.)) == 0
+
+def test_all_nan():
+    index = ObsIndex([np.nan, np.nan], [0., np.nan])
+    assert len(index.query([0.], [0.], 1.e9)) == 0
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import os
+import json
+import netCDF4
+import numpy as np
+
+import RiverObs.ReachDatabase as ReachDatabase
+
+def write_tile(filename, x_min, x_max, y_min, y_max):
+    with netCDF4.Dataset(filename, 'w') as ofp:
+        ofp.x_min, ofp.x_max = x_min, x_max
+        ofp.y_min, ofp.y_max = y_min, y_max
+
+def test_catalog(tmp_path):
+    reach_db_path = str(tmp_path)
+    for ii in range(3):
+        write_tile(os.path.join(reach_db_path, 'tile{}.nc'.format(ii)),
+                   ii, ii + 1, -ii, -ii + 1)
+
+    # without a catalog file all tiles are read
+    catalog = ReachDatabase.get_catalog(reach_db_path)
+    assert sorted(item['file'] for item in catalog) == [
+        'tile0.nc', 'tile1.nc', 'tile2.nc']
+
+    made_catalog = ReachDatabase.make_catalog(reach_db_path)
+    assert sorted(made_catalog, key=lambda item: item['file']) == sorted(
+        catalog, key=lambda item: item['file'])
+    for entry in made_catalog:
+        assert entry == ReachDatabase.get_tile_info(
+            os.path.join(reach_db_path, entry['file']))
+        assert set(entry) == {
+            'file', 'mtime', 'x_min', 'x_max', 'y_min', 'y_max',
+            'reach_id_min', 'reach_id_max', 'dimensions'}
+        # no reaches group
+        assert entry['reach_id_min'] is None
+
+    # entries of unmodified tiles come from the catalog file
+    catalog_file = os.path.join(reach_db_path, ReachDatabase.CATALOG_FILENAME)
+    with open(catalog_file, 'r') as ifp:
+        entries = json.load(ifp)
+    entries[0]['x_min'] = -99.
+    with open(catalog_file, 'w') as ofp:
+        json.dump(entries, ofp)
+    catalog = {
+        item['file']: item for item in ReachDatabase.get_catalog(
+            reach_db_path)}
+    assert catalog[entries[0]['file']]['x_min'] == -99.
+
+    # modified and new tiles are read again
+    filename = os.path.join(reach_db_path, entries[0]['file'])
+    write_tile(filename, 10., 11., 12., 13.)
+    os.utime(filename, (0, entries[0]['mtime'] + 10))
+    write_tile(os.path.join(reach_db_path, 'tile3.nc'), 3., 4., 5., 6.)
+    catalog = {
+        item['file']: item for item in ReachDatabase.get_catalog(
+            reach_db_path)}
+    assert len(catalog) == 4
+    assert catalog[entries[0]['file']]['x_min'] == 10.
+    assert catalog['tile3.nc']['y_max'] == 6.
+
+def test_empty_catalog(tmp_path):
+    assert ReachDatabase.get_catalog(str(tmp_path)) == []
+    assert ReachDatabase.make_catalog(str(tmp_path)) == []
+
+DIM_SIZES = {'nodes': 12, 'reaches': 4, 'points': 20, 'julian_day': 3,
+             'nCoeffs': 2, 'nReg': 3, 'hbreak_dim': 2}
+
+def fill(product, rng):
+    for key, form in product.VARIABLES.items():
+        shape = [size or DIM_SIZES[dim] for dim, size in
+                 form['dimensions'].items()]
+        product[key] = (100*rng.rand(*shape)).astype(form['dtype'])
+    for key, class_name in product.GROUPS.items():
+        product[key] = product.get_product(class_name)()
+        fill(product[key], rng)
+
+def write_prd(filename):
+    rng = np.random.RandomState(0)
+    prd = ReachDatabase.ReachDatabase()
+    fill(prd, rng)
+    reach_id = np.array([11, 12, 13, 14])
+    prd.reaches.reach_id = reach_id
+    prd.reaches.x_min = np.array([0., 10., 20., 30.])
+    prd.reaches.x_max = prd.reaches.x_min + 5
+    prd.reaches.y_min = np.zeros(4)
+    prd.reaches.y_max = np.ones(4)
+    prd.nodes.reach_id = reach_id[rng.randint(0, 4, 12)]
+    cl_reach_id = np.zeros((4, 20), dtype='i8')
+    cl_reach_id[0] = reach_id[np.sort(rng.randint(0, 4, 20))]
+    cl_reach_id[1, ::5] = reach_id[rng.randint(0, 4, 4)]
+    prd.centerlines.reach_id = cl_reach_id
+    prd.x_min, prd.x_max, prd.y_min, prd.y_max = 0., 35., 0., 1.
+    prd.to_ncfile(filename)
+
+def assert_products_equal(actual, desired):
+    for key in desired.VARIABLES:
+        np.testing.assert_array_equal(actual[key], desired[key])
+    for key in desired.GROUPS:
+        assert_products_equal(actual[key], desired[key])
+
+def test_from_ncfile_region(tmp_path):
+    filename = os.path.join(str(tmp_path), 'prd.nc')
+    write_prd(filename)
+    entry = ReachDatabase.get_tile_info(filename)
+    assert (entry['reach_id_min'], entry['reach_id_max']) == (11, 14)
+    assert entry['dimensions']['centerlines'] == {
+        'centerlines': 4, 'points': 20}
+
+    full = ReachDatabase.ReachDatabase.from_ncfile(filename)
+    bounding_box = [9., 0.2, 21., 0.8]
+    reach_ids = full.reaches.extract(bounding_box)
+    assert list(reach_ids) == [12, 13]
+    region = ReachDatabase.ReachDatabase.from_ncfile_region(
+        filename, bounding_box)
+    desired = full.subset(reach_ids)
+    for key in ['x_min', 'x_max', 'y_min', 'y_max']:
+        assert region[key] == desired[key]
+    for key in ReachDatabase.ReachDatabase.GROUPS:
+        assert_products_equal(region[key], desired[key])
+
+    assert ReachDatabase.ReachDatabase.from_ncfile_region(
+        filename, [50., 50., 51., 51.]) is None
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+import numpy as np
+
+from RiverObs.ReachGraph import ReachGraph
+
+def make_graph():
+    reach_ids = [11, 21, 31, 21]
+    up_ids = [[21, 0, 0, 0], [31, 0, 0, 0],
+              np.ma.masked_array([0, 99, 0, 0], mask=[0, 1, 0, 0]), []]
+    dn_ids = [[0, 0, 0, 0], [11, 0, 0, 0], [21, 41, 0, 0], [11]]
+    return ReachGraph(reach_ids, up_ids, dn_ids)
+
+def test_index():
+    graph = make_graph()
+    assert len(graph) == 4
+    # the first reach with an id, as list.index
+    for reach_id in [11, 21, 31]:
+        assert graph.index(reach_id) == graph.reach_ids.index(reach_id)
+    assert graph.index(41) is None
+    assert graph.index(np.ma.masked) is None
+
+def test_adjacent_ids():
+    graph = make_graph()
+    assert list(graph.adjacent_ids(0)) == [21]
+    assert list(graph.adjacent_ids(1)) == [31, 11]
+    # masked and 0 ids are not neighbours
+    assert list(graph.adjacent_ids(2)) == [21, 41]
+    assert list(graph.adjacent_ids(3)) == [11]
+
+def test_no_topology():
+    graph = ReachGraph([11, 21])
+    assert len(graph.adjacent_ids(0)) == 0
+    assert len(ReachGraph([])) == 0
@@ -4,7 +4,6 @@ Module for running RiverObs on a SWOT L2 PixelCloud data product
 Author (s): Alex Fore
 """
 import sys
-import os
 import copy
 import argparse
 import warnings
@@ -32,6 +31,7 @@ class L2PixcToRiverTile(object):
         self.index_file = index_file
         self.is_new_pixc = is_new_pixc
         self.node_outputs, self.reach_outputs = None, None
+        self.pixcvec = None
 
         # if is_new_pixc is not supplied, test pixc file to see if it is true
         if self.is_new_pixc is None:
@@ -101,6 +101,12 @@ class L2PixcToRiverTile(object):
         if 'slope_method' not in self.config:
             self.config['slope_method'] = 'weighted'
 
+        if 'num_processes' not in self.config:
+            self.config['num_processes'] = 1
+
+        if 'enhanced_slope_max_sigmas' not in self.config:
+            self.config['enhanced_slope_max_sigmas'] = None
+
         # key/value arguments for constructing SWOTRiverEstimator
         kwargs = {
             'bounding_box': self.compute_bounding_box(),
@@ -115,7 +121,7 @@ class L2PixcToRiverTile(object):
             'use_heights': self.config['use_heights'],
             'min_points': self.config['min_points'],
             'trim_ends': False, 'store_obs': False, 'store_reaches': False,
-            'output_file': self.index_file,
+            'output_file': None,
             'proj': 'laea', 'x_0': 0, 'y_0': 0, 'lat_0': None, 'lon_0': None,
             'subsample_factor': 1,
             'height_agg_method': self.config['height_agg_method'],
@@ -143,7 +149,9 @@ class L2PixcToRiverTile(object):
             smooth=self.config['smooth'],
             alpha=self.config['alpha'],
             max_iter=self.config['max_iter'],
-            enhanced=True)
+            max_sigmas=self.config['enhanced_slope_max_sigmas'],
+            enhanced=True,
+            num_processes=self.config['num_processes'])
 
         if len(self.reach_collection) > 0:
             reach_variables = list(self.reach_collection[0].metadata.keys())
@@ -177,10 +185,14 @@ class L2PixcToRiverTile(object):
         else:
             warnings.warn('Reach collection has zero entries')
 
+        # make the pixcvecriver product from the river processing outputs
+        # (written to self.index_file by build_products)
+        self.pixcvec = L2PIXCVector()
+        for key, value in river_estimator.get_index_data().items():
+            self.pixcvec[key] = value
+
         # add attributes from pixc to pixcvecriver file
-        pixcvec = L2PIXCVector.from_ncfile(self.index_file)
-        pixcvec.update_from_pixc(self.pixc_file)
-        pixcvec.to_ncfile(self.index_file)
+        self.pixcvec.update_from_pixc(self.pixc_file)
 
         # save for use later to fill in missing nodes/reaches
         self.prd_reaches = river_estimator.reaches
@@ -188,7 +200,8 @@ class L2PixcToRiverTile(object):
     def do_improved_geolocation(self):
         """
         Uses output of river processing (nodes) and rare sensor data to
-        improve geolocation on lat, lon datasets in index.nc file.
+        improve geolocation on lat, lon datasets of the pixcvecriver product
+        (read from the index.nc file written by match_pixc_idx).
         """
         LOGGER.info('do_improved_geolocation')
         if (self.node_outputs is None or not
@@ -218,11 +231,10 @@ class L2PixcToRiverTile(object):
             interpolate_pixc_between_nodes=True,
             method=self.config['geolocation_method'])
 
-        # update geoloc in place in index file
-        with netCDF4.Dataset(self.index_file, 'a') as ifp:
-            ifp.variables['latitude_vectorproc'][:] = lat_corr
-            ifp.variables['longitude_vectorproc'][:] = lon_corr
-            ifp.variables['height_vectorproc'][:] = height_corr
+        # update geoloc in the pixcvecriver product (written by build_products)
+        self.pixcvec.latitude_vectorproc = np.asarray(lat_corr)
+        self.pixcvec.longitude_vectorproc = np.asarray(lon_corr)
+        self.pixcvec.height_vectorproc = np.asarray(height_corr)
 
     def match_pixc_idx(self):
         """Matches the pixels from pixcvector to input pixc"""
@@ -240,48 +252,44 @@ class L2PixcToRiverTile(object):
 
             pixc_idx = np.array(azi_index * int(nr_pixels) + rng_index)
 
-        with netCDF4.Dataset(self.index_file, 'a') as ofp:
-            pixcvec_idx = np.array(
-                ofp.variables['azimuth_index'][:] * int(nr_pixels) +
-                ofp.variables['range_index'][:])
+        pixcvec_idx = np.array(
+            self.pixcvec.azimuth_index * int(nr_pixels) +
+            self.pixcvec.range_index)
 
-            indx, indx_pv, indx_pixc = np.intersect1d(
-                pixcvec_idx, pixc_idx, return_indices=True)
+        indx, indx_pv, indx_pixc = np.intersect1d(
+            pixcvec_idx, pixc_idx, return_indices=True)
 
-            # re-order PIXCVecRiver datasets to ordering of pixc_index.
-            for dset in ofp.variables.keys():
-                data = ofp.variables[dset][:]
-                ofp.variables[dset][:] = data[indx_pv]
+        # re-order PIXCVecRiver datasets to ordering of pixc_index.
+        pixcvec = self.pixcvec.copy(with_variables=False)
+        for dset, data in self.pixcvec.variables.items():
+            pixcvec[dset] = data[indx_pv]
 
-            ofp.variables['pixc_index'][:] = indx_pixc.astype('int32')
+        pixcvec.pixc_index = indx_pixc.astype('int32')
+        self.pixcvec = pixcvec
+
+        # do_improved_geolocation reads it from the index file
+        if (self.node_outputs is not None and self.is_new_pixc and
+                self.config['do_improved_geolocation']):
+            self.pixcvec.to_ncfile(self.index_file)
 
     def build_products(self):
         """Constructs the L2HRRiverTile data product / updates the index file"""
         LOGGER.info('build_products')
         # If lake flag is set don't output width, area, or slope.
         try:
-            for ireach, reach_id in enumerate(self.reach_outputs['reach_idx']):
-                if self.reach_outputs['lake_flag'][ireach] != 0:
-                    self.reach_outputs['slope'][ireach] = MISSING_VALUE_FLT
-                    self.reach_outputs['slope2'][ireach] = MISSING_VALUE_FLT
-                    self.reach_outputs['slope_u'][ireach] = MISSING_VALUE_FLT
-                    # TODO mask out slope2_u and slope?_r_u datasets when available
-                    self.reach_outputs['width'][ireach] = MISSING_VALUE_FLT
-                    self.reach_outputs['width_u'][ireach] = MISSING_VALUE_FLT
-                    self.reach_outputs['area'][ireach] = MISSING_VALUE_FLT
-                    self.reach_outputs['area_u'][ireach] = MISSING_VALUE_FLT
-                    self.reach_outputs['area_det'][ireach] = MISSING_VALUE_FLT
-                    self.reach_outputs['area_det_u'][ireach] = MISSING_VALUE_FLT
-                    self.reach_outputs['area_of_ht'][ireach] = MISSING_VALUE_FLT
-
-                    mask = self.node_outputs['reach_indx'] == reach_id
-                    self.node_outputs['w_area'][mask] = MISSING_VALUE_FLT
-                    self.node_outputs['width_u'][mask] = MISSING_VALUE_FLT
-                    self.node_outputs['area'][mask] = MISSING_VALUE_FLT
-                    self.node_outputs['area_det'][mask] = MISSING_VALUE_FLT
-                    self.node_outputs['area_of_ht'][mask] = MISSING_VALUE_FLT
-                    self.node_outputs['area_u'][mask] = MISSING_VALUE_FLT
-                    self.node_outputs['area_det_u'][mask] = MISSING_VALUE_FLT
+            is_lake = self.reach_outputs['lake_flag'] != 0
+            # TODO mask out slope2_u and slope?_r_u datasets when available
+            for key in ['slope', 'slope2', 'slope_u', 'width', 'width_u',
+                        'area', 'area_u', 'area_det', 'area_det_u',
+                        'area_of_ht']:
+                self.reach_outputs[key][is_lake] = MISSING_VALUE_FLT
+
+            mask = np.isin(
+                self.node_outputs['reach_indx'],
+                self.reach_outputs['reach_idx'][is_lake])
+            for key in ['w_area', 'width_u', 'area', 'area_det', 'area_of_ht',
+                        'area_u', 'area_det_u']:
+                self.node_outputs[key][mask] = MISSING_VALUE_FLT
 
             self.rivertile_product = L2HRRiverTile.from_riverobs(
                 self.node_outputs, self.reach_outputs, self.reach_collection,
@@ -292,14 +300,12 @@ class L2PixcToRiverTile(object):
             self.rivertile_product = L2HRRiverTile()
 
         # add in a bunch more stuff from PIXC
-        if not os.path.isfile(self.index_file):
-            L2PIXCVector().to_ncfile(self.index_file)
-        self.rivertile_product.update_from_pixc(
-            self.pixc_file, self.index_file)
-
-        pixcvec = L2PIXCVector.from_ncfile(self.index_file)
-        pixcvec.update_from_rivertile(self.rivertile_product)
-        pixcvec.to_ncfile(self.index_file)
+        if self.pixcvec is None:
+            self.pixcvec = L2PIXCVector()
+        self.rivertile_product.update_from_pixc(self.pixc_file, self.pixcvec)
+
+        self.pixcvec.update_from_rivertile(self.rivertile_product)
+        self.pixcvec.to_ncfile(self.index_file)
 
         history_string = "Created {}".format(
             datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f'))
@@ -5,32 +5,204 @@ Given a SWOTL2 file, fit all of the reaches observed and output results.
 from __future__ import absolute_import, division, print_function
 
 import os
+import multiprocessing
 import scipy.ndimage
 import numpy as np
 import netCDF4 as nc
 import collections
 import scipy.stats
 import scipy.ndimage
-import statsmodels.api
+import scipy.sparse
+import scipy.sparse.csgraph
 import logging
 
 import RiverObs.ReachDatabase
 import SWOTWater.aggregate
+import SWOTWater.fit
 import SWOTRiver.discharge
 from SWOTWater.products.constants import FILL_VALUES
 from .SWOTL2 import SWOTL2
 from RiverObs import WidthDataBase
 from RiverObs import IteratedRiverObs
+from RiverObs import ObsIndex
+from RiverObs import ReachGraph
 from RiverObs import RiverNode
 from RiverObs import RiverReach
 from RiverObs.RiverObs import \
     MISSING_VALUE_FLT, MISSING_VALUE_INT4, MISSING_VALUE_INT9
 
 from Centerline.Centerline import CenterLineException
-from scipy.ndimage.morphology import binary_dilation
 
 LOGGER = logging.getLogger(__name__)
 
+# State shared with the worker processes of
+# SWOTRiverEstimator.pool_process_reaches (inherited when they are forked)
+_POOL_STATE = {}
+
+# RiverObs attributes that refer to the pixel data of the whole tile, which
+# the worker processes already share with the parent
+_POOL_SHARED_OBS_ATTRS = ['xobs', 'yobs', 'seg_label', 'obs_index']
+
+
+def _pool_process_reach(index):
+    """
+    Estimate the node and reach quantities of one reach in a worker process.
+    Returns the RiverReach, the index file rows, and the RiverObs if stored
+    (without the pixel data of the whole tile, see _POOL_SHARED_OBS_ATTRS).
+    """
+    estimator = _POOL_STATE['estimator']
+    river_obs, reach_idx, ireach = _POOL_STATE['reach_zips'][index]
+
+    estimator.index_rows = []
+    river_reach = estimator.process_reach_nodes(
+        river_obs, reach_idx, ireach, **_POOL_STATE['node_kwds'])
+    river_reach = estimator.process_reach(
+        river_reach, estimator.reaches[ireach], ireach, reach_idx,
+        min_fit_points=_POOL_STATE['min_fit_points'], compute_fits=False)
+    index_rows = estimator.index_rows
+
+    if estimator.store_obs:
+        for name in _POOL_SHARED_OBS_ATTRS:
+            if hasattr(river_obs, name):
+                setattr(river_obs, name, None)
+    else:
+        river_obs = None
+    return river_reach, index_rows, river_obs
+
+
+def nanmedian_filter(image, rows, cols, size=11, chunk_size=100000):
+    """
+    Median filter of image ignoring NaNs, evaluated only at the pixels
+    (rows, cols). Gives the same values as
+    scipy.ndimage.generic_filter(image, np.nanmedian, size=size) (with its
+    default 'reflect' boundaries) at those pixels.
+
+    The windows of chunk_size pixels are sorted at a time, so that memory use
+    stays bounded.
+    """
+    image = np.asarray(image, dtype=np.float64)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    offsets = np.arange(size) - size//2
+
+    def reflect(index, num):
+        # (d c b a | a b c d | d c b a)
+        index = np.mod(index, 2*num)
+        return np.where(index < num, index, 2*num-1-index)
+
+    medians = np.nan*np.ones(len(rows))
+    for start in range(0, len(rows), chunk_size):
+        these_rows = reflect(
+            rows[start:start+chunk_size, np.newaxis] + offsets, image.shape[0])
+        these_cols = reflect(
+            cols[start:start+chunk_size, np.newaxis] + offsets, image.shape[1])
+        windows = image[these_rows[:, :, np.newaxis],
+                        these_cols[:, np.newaxis, :]].reshape(
+                            len(these_rows), -1)
+
+        # sorting puts NaNs last
+        windows.sort(axis=1)
+        count = np.sum(~np.isnan(windows), axis=1)
+        index = np.arange(len(windows))
+        low = windows[index, np.maximum(count-1, 0)//2]
+        high = windows[index, count//2]
+        medians[start:start+chunk_size] = np.where(
+            count % 2 == 1, low, (low+high)/2)
+    return medians
+
+
+def segment_pixels(img_y, img_x, is_water, dilation_iter=0):
+    """
+    Labels the connected (4-connectivity) water features of the pixels at
+    (img_y, img_x). Gives the same labels as scipy.ndimage.label of the
+    image of is_water, but only looks at the pixels (and, if dilating, the
+    cells around them) instead of making the full image.
+
+    If dilation_iter > 0, all pixels are water and features with
+    2*dilation_iter or fewer cells between them are connected (as with a
+    binary_dilation of the pixels image by dilation_iter iterations).
+
+    Pixels that are not water get the largest label of their 8 neighbours,
+    or 0 if none (as with a 3x3 grey_dilation of the labels image).
+
+    Returns the labels of the pixels, numbered in raster order of the
+    features as scipy.ndimage.label does.
+    """
+    img_y = np.asarray(img_y, dtype=np.int64)
+    img_x = np.asarray(img_x, dtype=np.int64)
+    num_rows, num_cols = np.max(img_y) + 1, np.max(img_x) + 1
+    pixel_cells = img_y * num_cols + img_x
+
+    def lookup(cells, values, query):
+        # values of the (sorted) cells at query, 0 if not in cells
+        if len(cells) == 0:
+            return np.zeros(query.shape, dtype=values.dtype)
+        index = np.minimum(np.searchsorted(cells, query), len(cells) - 1)
+        return np.where(cells[index] == query, values[index], 0)
+
+    def neighbours(cells, dy, dx):
+        # cells offset by dy, dx, and if they are in the image
+        cell_y, cell_x = cells // num_cols, cells % num_cols
+        good = np.logical_and.reduce([
+            cell_y + dy >= 0, cell_y + dy < num_rows,
+            cell_x + dx >= 0, cell_x + dx < num_cols])
+        return cells + dy * num_cols + dx, good
+
+    # water cells (the value of the last of repeated pixels is used)
+    cells, inverse = np.unique(pixel_cells, return_inverse=True)
+    last = np.zeros(len(cells), dtype=np.int64)
+    last[inverse] = np.arange(len(pixel_cells))
+    water_cells = cells[np.asarray(is_water)[last] != 0]
+
+    # Do some regularization with morphological operations
+    # so that water features very close to each other
+    # (with 2*dilation_iter or fewer land pixels separating them)
+    # are given same label
+    if dilation_iter > 0:
+        water_cells = cells
+        for dy in range(-dilation_iter, dilation_iter + 1):
+            max_dx = dilation_iter - abs(dy)
+            for dx in range(-max_dx, max_dx + 1):
+                these_cells, good = neighbours(cells, dy, dx)
+                water_cells = np.union1d(water_cells, these_cells[good])
+
+    # connected components of the water cells and their right / down
+    # neighbours
+    index = np.arange(len(water_cells))
+    edges_from, edges_to = [], []
+    for dy, dx in [(0, 1), (1, 0)]:
+        these_cells, good = neighbours(water_cells, dy, dx)
+        these_index = lookup(water_cells, index + 1, these_cells[good]) - 1
+        found = these_index >= 0
+        edges_from.append(index[good][found])
+        edges_to.append(these_index[found])
+    edges_from = np.concatenate(edges_from)
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(len(edges_from)), (edges_from, np.concatenate(edges_to))),
+        shape=(len(water_cells), len(water_cells)))
+    num_labels, component = scipy.sparse.csgraph.connected_components(
+        graph, directed=False)
+
+    # number the features in raster order of their first cell
+    _, first = np.unique(component, return_index=True)
+    rank = np.zeros(num_labels, dtype=np.int32)
+    rank[np.argsort(first)] = np.arange(1, num_labels + 1)
+    water_labels = rank[component]
+
+    labels = lookup(water_cells, water_labels, pixel_cells).astype(np.int32)
+
+    # assign land edge pixels (label 0) to neighbouring water feature
+    # (label >0), this will arbitrarily assign it to the one with the largest
+    # label index if it touches two different features
+    land = np.flatnonzero(labels == 0)
+    for dy in [-1, 0, 1]:
+        for dx in [-1, 0, 1]:
+            these_cells, good = neighbours(pixel_cells[land], dy, dx)
+            labels[land[good]] = np.maximum(labels[land[good]], lookup(
+                water_cells, water_labels, these_cells[good]))
+    return labels
+
+
 class SWOTRiverEstimator(SWOTL2):
     """
     Given a SWOTL2 file, fit all of the reaches observed and output results.
@@ -147,6 +319,21 @@ class SWOTRiverEstimator(SWOTL2):
     platform_height = 970.e3
     earth_radius = 6378e3
 
+    # pixel cloud vector (index file) variables: (dtype, fill_value)
+    INDEX_VARIABLES = collections.OrderedDict([
+        ['range_index', ('i4', FILL_VALUES['i4'])],
+        ['azimuth_index', ('i4', FILL_VALUES['i4'])],
+        ['node_id', ('i8', FILL_VALUES['i4'])],
+        ['reach_id', ('i8', FILL_VALUES['i4'])],
+        ['segmentation_label', ('i4', FILL_VALUES['i4'])],
+        ['distance_to_node', ('f4', FILL_VALUES['i4'])],
+        ['along_reach', ('f4', FILL_VALUES['f4'])],
+        ['cross_reach', ('f4', FILL_VALUES['f4'])],
+        ['latitude_vectorproc', ('f8', FILL_VALUES['f8'])],
+        ['longitude_vectorproc', ('f8', FILL_VALUES['f8'])],
+        ['height_vectorproc', ('f8', FILL_VALUES['f8'])],
+        ])
+
     def __init__(self,
                  swotL2_file,
                  bounding_box=None,
@@ -205,6 +392,7 @@ class SWOTRiverEstimator(SWOTL2):
         self.store_reaches = store_reaches
         self.input_file = os.path.split(swotL2_file)[-1]
         self.output_file = output_file  # index file
+        self.index_rows = []
         self.subsample_factor = subsample_factor
         self.slope_method = slope_method
 
@@ -241,7 +429,8 @@ class SWOTRiverEstimator(SWOTL2):
             subsample_factor=subsample_factor,
             **proj_kwds)
 
-        self.create_index_file()
+        if self.output_file is not None:
+            self.create_index_file()
 
         if np.ma.is_masked(self.lat):
             mask = self.lat.mask
@@ -419,11 +608,11 @@ class SWOTRiverEstimator(SWOTL2):
         hgt_2d = np.nan*np.ones((np.max(self.img_y)+1, np.max(self.img_x)+1))
         hgt_2d[self.img_y, self.img_x] = self.h_noise
 
-        # do a 2d median filter on the heights
-        hgt_filt = scipy.ndimage.generic_filter(hgt_2d, np.nanmedian, size=11)
+        # do a 2d median filter on the heights (only needed at the pixels)
+        hgt_filt = nanmedian_filter(hgt_2d, self.img_y, self.img_x, size=11)
 
         target_xyz = geoloc.convert_llh2ecef(
-            self.lat, self.lon, hgt_filt[self.img_y, self.img_x],
+            self.lat, self.lon, hgt_filt,
             GEN_RAD_EARTH_EQ, GEN_RAD_EARTH_POLE)
 
 
@@ -440,49 +629,8 @@ class SWOTRiverEstimator(SWOTL2):
         do image segmentation algorithm on the water class to label
         unconnected features
         """
-        maxX = np.max(self.img_x)
-        maxY = np.max(self.img_y)
-        cls_img = np.zeros((maxY + 1, maxX + 1))
-        cls_img[self.img_y, self.img_x] = self.isWater
-
-        # Do some regularization with morphological operations
-        # so that water features very close to each other
-        # (with 2*preseg_dilation_iter or fewer land pixels separating them)
-        # are given same label
-        if preseg_dilation_iter > 0:
-            cls_tmp = np.zeros((maxY + 1, maxX + 1))
-            cls_tmp[self.img_y, self.img_x] = 1
-            cls_tmp = binary_dilation(cls_tmp, iterations=preseg_dilation_iter)
-            cls_img[cls_tmp == 1] = 1
-
-        # segment the water class image
-        lbl, nlbl = scipy.ndimage.label(cls_img)
-
-        # assign land edge segments (label 0) to nearest water feature
-        # (label >0) using grey dilation for this, probably need to re-think
-        # how to handle land edge pixels that touch two different
-        # segments (this will arbitrarily assign it to the one with
-        # the largest label index)
-        lbl2 = scipy.ndimage.grey_dilation(lbl, 3)
-        lbl_out = lbl.copy()
-        lbl_out[lbl == 0] = lbl2[lbl == 0]
-
-        # write out segmentation images to a nc file for testing
-        dumpLbl = False
-        if dumpLbl:
-            M0, M1 = np.shape(lbl)
-            with nc.Dataset("segDump.nc", 'w') as f:
-                f.createDimension('azimuth', M0)
-                f.createDimension('range', M1)
-                ol = f.createVariable(
-                    'orig_label', 'i4', ('azimuth', 'range'), fill_value=-128)
-                fl = f.createVariable(
-                    'final_label', 'i4', ('azimuth', 'range'), fill_value=-128)
-                ol[:] = lbl[:]
-                fl[:] = lbl_out[:]
-
-        # create the segmentation label variable
-        self.seg_label = lbl_out[self.img_y, self.img_x]
+        self.seg_label = segment_pixels(
+            self.img_y, self.img_x, self.isWater, preseg_dilation_iter)
 
     def get_reaches(self, reach_db_path, clip=False, clip_buffer=0.1):
         """Get all of the reaches using a ReachExtractor."""
@@ -527,7 +675,9 @@ class SWOTRiverEstimator(SWOTL2):
                         max_window_size=10000,
                         min_sigma=1000,
                         window_size_sigma_ratio=5,
-                        enhanced=False):
+                        max_sigmas=None,
+                        enhanced=False,
+                        num_processes=1):
         """
         Process all of the reaches in the data bounding box.
 
@@ -556,6 +706,12 @@ class SWOTRiverEstimator(SWOTL2):
         max_window_size : max window for gaussian averaging, default is 10km
         min_sigma : min sigma for gaussian averaging, default is 1km
         window_size_sigma_ratio : default is 5
+        max_sigmas : if given, number of sigmas at which to truncate the
+            Gaussian (as well as at the window)
+        num_processes : int, default 1
+            Number of worker processes used to process the reaches. If
+            larger than 1, the reaches are distributed over a pool of
+            forked processes.
 
         Returns
         -------
@@ -568,60 +724,66 @@ class SWOTRiverEstimator(SWOTL2):
             self.assign_reaches_two_pass(
                 scalar_max_width, minobs, use_width_db, ds)
 
-        river_reach_collection = []
-        reach_zips = zip(river_obs_list, reach_idx_list, ireach_list)
-        for river_obs, reach_idx, ireach in reach_zips:
+        node_kwds = {
+            'scalar_max_width': scalar_max_width,
+            'use_width_db': use_width_db,
+            'ds': ds,
+            'refine_centerline': refine_centerline,
+            'smooth': smooth,
+            'alpha': alpha,
+            'max_iter': max_iter}
+
+        reach_metadata = None
+        if num_processes > 1 and len(river_obs_list) > 1:
+            river_reach_collection, reach_metadata = self.pool_process_reaches(
+                list(zip(river_obs_list, reach_idx_list, ireach_list)),
+                num_processes, min_fit_points, node_kwds)
 
-            if use_width_db:
-                max_width = self.get_max_width_from_db(reach_idx)
-                LOGGER.debug('max_width read')
+        else:
+            river_reach_collection = []
+            reach_zips = zip(river_obs_list, reach_idx_list, ireach_list)
+            for river_obs, reach_idx, ireach in reach_zips:
 
-            else:
-                try:
-                    # probably should scale this to look some fraction
-                    # farther than the database width
-                    max_width = (
-                        self.reaches[ireach].metadata['Wmean'] * np.ones(
-                            np.shape(self.reaches[i_reach].x)))  # *2.0
-
-                except KeyError:
-                    max_width = scalar_max_width
-
-            # Ugly way process_reach/process_node uses the data
-            self.river_obs = river_obs
-
-            river_reach = self.process_node(
-                self.reaches[ireach],
-                ireach,
-                reach_idx,
-                scalar_max_width=scalar_max_width,
-                use_width_db=use_width_db,
-                max_width=max_width,
-                ds=ds,
-                refine_centerline=refine_centerline,
-                smooth=smooth,
-                alpha=alpha,
-                max_iter=max_iter)
-
-            river_reach_collection.append(river_reach)
-            if self.store_reaches:
-                self.river_reach_collection[ireach] = river_reach
-
-            LOGGER.debug('reach pocessed')
+                river_reach = self.process_reach_nodes(
+                    river_obs, reach_idx, ireach, **node_kwds)
+
+                river_reach_collection.append(river_reach)
+                if self.store_reaches:
+                    self.river_reach_collection[ireach] = river_reach
+
+                LOGGER.debug('reach pocessed')
+
+        # up/downstream reaches of the reaches in river_reach_collection
+        reach_graph = ReachGraph(
+            [item.reach_indx[0] for item in river_reach_collection],
+            [self.reaches[ireach].metadata['rch_id_up'][:, 0]
+             for ireach in ireach_list],
+            [self.reaches[ireach].metadata['rch_id_dn'][:, 0]
+             for ireach in ireach_list])
 
         out_river_reach_collection = []
+        out_ireach_list = []
         # Now iterate over reaches again and do reach average computations
         reach_zips = zip(
             river_reach_collection, river_obs_list, reach_idx_list,
             ireach_list)
-        for river_reach, river_obs, reach_idx, ireach in reach_zips:
+        for i, (river_reach, river_obs, reach_idx, ireach) in enumerate(
+                reach_zips):
 
-            # Ugly way process_reach/process_node uses the data
-            self.river_obs = river_obs
+            if reach_metadata is None:
+                # Ugly way process_reach/process_node uses the data
+                self.river_obs = river_obs
 
-            out_river_reach = self.process_reach(
-                river_reach, self.reaches[ireach], ireach, reach_idx,
-                min_fit_points=min_fit_points)
+                out_river_reach = self.process_reach(
+                    river_reach, self.reaches[ireach], ireach, reach_idx,
+                    min_fit_points=min_fit_points, compute_fits=False)
+
+            else:
+                # Reach quantities were computed by the worker processes.
+                # Restore them in order, since the enhanced slope only uses
+                # the upstream reaches that were processed before this one.
+                river_reach.metadata = reach_metadata[i]
+                out_river_reach = river_reach
 
             if out_river_reach is not None:
                 if enhanced:
@@ -629,7 +791,8 @@ class SWOTRiverEstimator(SWOTL2):
                         river_reach, river_reach_collection, ireach,
                         max_window_size=max_window_size,
                         min_sigma=min_sigma,
-                        window_size_sigma_ratio=window_size_sigma_ratio)
+                        window_size_sigma_ratio=window_size_sigma_ratio,
+                        max_sigmas=max_sigmas, reach_graph=reach_graph)
 
                     # flip sign, convert to m/m
                     enhanced_slope = enhanced_slope * -1
@@ -639,9 +802,126 @@ class SWOTRiverEstimator(SWOTL2):
                 # add enhanced slope to river reach outputs
                 out_river_reach.metadata['slope2'] = enhanced_slope
                 out_river_reach_collection.append(out_river_reach)
+                out_ireach_list.append(ireach)
+
+        # Fit the heights and slopes of all of the reaches at once
+        self.fit_reaches(out_river_reach_collection)
+
+        # Compute discharge of all of the reaches at once
+        if len(out_river_reach_collection) > 0:
+            discharge_model_values = SWOTRiver.discharge.compute_reaches(
+                [self.reaches[ireach] for ireach in out_ireach_list],
+                *[[item.metadata[key] for item in out_river_reach_collection]
+                  for key in ['height', 'width', 'slope']])
+            for i, out_river_reach in enumerate(out_river_reach_collection):
+                out_river_reach.metadata.update({
+                    key: value[i]
+                    for key, value in discharge_model_values.items()})
+
+        # write out the image coordinates for each node in a netcdf file
+        if self.output_file is not None:
+            self.create_index_file(self.get_index_data())
 
         return out_river_reach_collection
 
+    def process_reach_nodes(self,
+                            river_obs,
+                            reach_idx,
+                            ireach,
+                            scalar_max_width=600.,
+                            use_width_db=False,
+                            ds=None,
+                            refine_centerline=False,
+                            smooth=1.e-2,
+                            alpha=1.,
+                            max_iter=1):
+        """
+        Estimate the node quantities of one of the assigned reaches (see
+        process_node).
+        """
+        if use_width_db:
+            max_width = self.get_max_width_from_db(reach_idx)
+            LOGGER.debug('max_width read')
+
+        else:
+            try:
+                # probably should scale this to look some fraction
+                # farther than the database width
+                max_width = (
+                    self.reaches[ireach].metadata['Wmean'] * np.ones(
+                        np.shape(self.reaches[ireach].x)))  # *2.0
+
+            except KeyError:
+                max_width = scalar_max_width
+
+        # Ugly way process_reach/process_node uses the data
+        self.river_obs = river_obs
+
+        return self.process_node(
+            self.reaches[ireach],
+            ireach,
+            reach_idx,
+            scalar_max_width=scalar_max_width,
+            use_width_db=use_width_db,
+            max_width=max_width,
+            ds=ds,
+            refine_centerline=refine_centerline,
+            smooth=smooth,
+            alpha=alpha,
+            max_iter=max_iter)
+
+    def pool_process_reaches(
+        self, reach_zips, num_processes, min_fit_points, node_kwds):
+        """
+        Estimate the node and reach quantities of the assigned reaches
+        with a pool of worker processes.
+
+        The workers are forked from this process, so that they share the
+        pixel data instead of getting a copy pickled with each reach. The
+        index file rows of each reach are sent back and added here in
+        reach order. If store_obs is set, the RiverObs of each reach is also
+        sent back, and gets the pixel data of the whole tile again here.
+
+        Returns the list of RiverReach instances (without the reach
+        quantities) and the list of their reach quantities (metadata),
+        without the fits (see fit_reaches).
+        """
+        _POOL_STATE.update(
+            estimator=self, reach_zips=reach_zips,
+            min_fit_points=min_fit_points, node_kwds=node_kwds)
+
+        river_reach_collection = []
+        reach_metadata = []
+        try:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(num_processes, len(reach_zips))) as pool:
+                results = pool.imap(
+                    _pool_process_reach, range(len(reach_zips)))
+                for (shared_obs, reach_idx, ireach), result in zip(
+                        reach_zips, results):
+                    river_reach, index_rows, river_obs = result
+
+                    self.index_rows.extend(index_rows)
+
+                    reach_metadata.append(river_reach.metadata)
+                    river_reach.metadata = {}
+                    river_reach_collection.append(river_reach)
+
+                    if self.store_reaches:
+                        self.river_reach_collection[ireach] = river_reach
+                    if self.store_obs:
+                        for name in _POOL_SHARED_OBS_ATTRS:
+                            if hasattr(shared_obs, name):
+                                setattr(river_obs, name,
+                                        getattr(shared_obs, name))
+                        self.river_obs_collection[reach_idx] = river_obs
+
+                    LOGGER.debug('reach pocessed')
+        finally:
+            _POOL_STATE.clear()
+
+        return river_reach_collection, reach_metadata
+
     def assign_reaches(self,
                        scalar_max_width,
                        minobs=10,
@@ -651,11 +931,32 @@ class SWOTRiverEstimator(SWOTL2):
         """
         Assigns pixels to nodes for every reach.
         """
-        # First extract the segmentation lables to keep
-        all_dominant_labels = []
-        all_ids = []
-        all_up_ids = []
-        all_dn_ids = []
+        river_obs_list, reach_idx_list, ireach_list = self.init_reach_obs(
+            scalar_max_width, minobs, ds, second_pass)
+
+        return self.select_reach_obs(
+            river_obs_list, reach_idx_list, ireach_list)
+
+    def init_reach_obs(self,
+                       scalar_max_width,
+                       minobs=10,
+                       ds=None,
+                       second_pass=False):
+        """
+        Makes the IteratedRiverObs for every reach, with the segmentation
+        labels of adjacent reaches merged and the search widths from the
+        reach database. Pixels may still be assigned to several reaches.
+        """
+        # One spatial index over all pixels, shared by all reaches, so that
+        # each reach only projects the pixels near its centerline.
+        obs_index = ObsIndex(self.x, self.y)
+
+        reach_graph = ReachGraph.from_reaches(self.reaches)
+
+        # First extract the segmentation lables to keep (reach id -> dominant
+        # label)
+        dominant_labels = {}
+        first_river_obs = {}
         for i_reach, reach_idx in enumerate(self.reaches.reach_idx):
             if len(self.reaches[i_reach].x) <= 3:
                 continue
@@ -663,18 +964,16 @@ class SWOTRiverEstimator(SWOTL2):
                 river_obs = IteratedRiverObs(
                     self.reaches[i_reach], self.x, self.y, ds=ds,
                     seg_label=self.seg_label, max_width=scalar_max_width,
-                    minobs=minobs, second_pass=second_pass)
+                    minobs=minobs, second_pass=second_pass,
+                    obs_index=obs_index)
             except CenterLineException as e:
                 print("CenterLineException: ", e)
                 continue
 
+            first_river_obs[i_reach] = river_obs
             if river_obs.dominant_label is not None:
-                all_dominant_labels.append(river_obs.dominant_label)
-                all_ids.append(reach_idx)
-                all_up_ids.append(
-                    self.reaches[i_reach].metadata['rch_id_up'][:,0])
-                all_dn_ids.append(
-                    self.reaches[i_reach].metadata['rch_id_dn'][:,0])
+                dominant_labels.setdefault(
+                    reach_idx, river_obs.dominant_label)
 
         # Iterate over reaches, assign pixels to nodes
         river_obs_list = []
@@ -687,34 +986,35 @@ class SWOTRiverEstimator(SWOTL2):
 
             seg_label = self.seg_label.copy()
 
-            try:
-                this_idx = np.where(reach_idx == all_ids)[0][0]
-                adjacent_ids = np.concatenate([
-                    all_up_ids[this_idx], all_dn_ids[this_idx]])
-                adjacent_ids = adjacent_ids[adjacent_ids != 0]
-
-                this_label = all_dominant_labels[this_idx]
-                for that_label, that_id in zip(all_dominant_labels, all_ids):
-                    if that_id in adjacent_ids:
-                        seg_label[self.seg_label == that_label] = this_label
+            if reach_idx in dominant_labels:
+                this_label = dominant_labels[reach_idx]
+                for that_id in set(reach_graph.adjacent_ids(i_reach)):
+                    if that_id in dominant_labels:
+                        seg_label[self.seg_label == dominant_labels[
+                            that_id]] = this_label
 
-            except IndexError:
-                pass
-
-            try:
-                river_obs = IteratedRiverObs(
-                    self.reaches[i_reach],
-                    self.x,
-                    self.y,
-                    ds=ds,
-                    seg_label=seg_label,
-                    max_width=scalar_max_width,
-                    minobs=minobs,
-                    second_pass=second_pass)
+            # Only the centerline is used before reinitialize below, which
+            # is the same as for the first IteratedRiverObs of this reach.
+            if i_reach in first_river_obs:
+                river_obs = first_river_obs[i_reach]
+                river_obs.seg_label = seg_label
 
-            except CenterLineException as e:
-                print("CenterLineException: ", e)
-                continue
+            else:
+                try:
+                    river_obs = IteratedRiverObs(
+                        self.reaches[i_reach],
+                        self.x,
+                        self.y,
+                        ds=ds,
+                        seg_label=seg_label,
+                        max_width=scalar_max_width,
+                        minobs=minobs,
+                        second_pass=second_pass,
+                        obs_index=obs_index)
+
+                except CenterLineException as e:
+                    print("CenterLineException: ", e)
+                    continue
 
             # Add width per node to centerline and re-init IteratedRiverObs.
             # Search width is the width it uses to always include (1/2 on
@@ -726,6 +1026,23 @@ class SWOTRiverEstimator(SWOTL2):
                 search_width, 'max_width')
             river_obs.reinitialize()
 
+            river_obs_list.append(river_obs)
+            reach_idx_list.append(reach_idx)
+            ireach_list.append(i_reach)
+
+        return river_obs_list, reach_idx_list, ireach_list
+
+    def select_reach_obs(self, river_obs_list, reach_idx_list, ireach_list):
+        """
+        Ensures unique and optimal assignments of pixels to reaches, and
+        returns the non-ghost reaches with populated nodes.
+
+        The river_obs are edited in place.
+        """
+        # Skip the reaches with no observations mapped to their nodes
+        reach_zips = zip(river_obs_list, reach_idx_list, ireach_list)
+        river_obs_list, reach_idx_list, ireach_list = [], [], []
+        for river_obs, reach_idx, ireach in reach_zips:
             if len(river_obs.x) == 0:
                 LOGGER.debug(
                     'No observations mapped to nodes in this reach')
@@ -733,7 +1050,7 @@ class SWOTRiverEstimator(SWOTL2):
 
             river_obs_list.append(river_obs)
             reach_idx_list.append(reach_idx)
-            ireach_list.append(i_reach)
+            ireach_list.append(ireach)
 
         # Ensure unique and optimal assignments of pixels to reach.
         min_dist = 9999999 * np.ones(self.x.shape)
@@ -805,12 +1122,24 @@ class SWOTRiverEstimator(SWOTL2):
         """
         Does the second pass of reach assignments using the results from the
         first pass.
+
+        The second pass only changes the extent criteria (ext_dist_coef), so
+        the centerlines and pixel projections of the first pass are reused.
         """
-        river_obs_list1, reach_idx_list1, ireach_list1 = self.assign_reaches(
-            scalar_max_width, minobs, use_width_db, ds)
+        all_river_obs = self.init_reach_obs(scalar_max_width, minobs, ds)
+
+        river_obs_list1, reach_idx_list1, ireach_list1 = \
+            self.select_reach_obs(*all_river_obs)
+
+        # select_reach_obs edits the river_obs, keep the first pass masks
+        in_channel_list1 = [
+            river_obs.in_channel.copy() for river_obs in river_obs_list1]
+
+        for river_obs in all_river_obs[0]:
+            river_obs.reflag(second_pass=True)
 
-        river_obs_list, reach_idx_list, ireach_list = self.assign_reaches(
-            scalar_max_width, minobs, use_width_db, ds, second_pass=True)
+        river_obs_list, reach_idx_list, ireach_list = self.select_reach_obs(
+            *all_river_obs)
 
         # iterate over reaches in second pass, only keep pixels that were
         # also assigned to the same reach in first pass assignments
@@ -818,12 +1147,12 @@ class SWOTRiverEstimator(SWOTL2):
         for river_obs, reach_idx, ireach in reach_zips:
 
             irch1 = np.argwhere(reach_idx_list1==reach_idx)[0][0]
-            river_obs1 = river_obs_list1[irch1]
+            in_channel1 = in_channel_list1[irch1]
 
-            if (river_obs1.in_channel != river_obs.in_channel).any():
+            if (in_channel1 != river_obs.in_channel).any():
                 # Make new in channel mask
                 new_in_channel = np.logical_and(
-                    river_obs.in_channel, river_obs1.in_channel)
+                    river_obs.in_channel, in_channel1)
 
                 # subset it to the previous subset of in_channel for mask
                 # of pixels to keep that were already kept.
@@ -1161,9 +1490,9 @@ class SWOTRiverEstimator(SWOTL2):
             self.river_obs.populated_nodes]
 
         fit_xx = np.array([np.ones(x_median.shape), x_median, y_median]).T
-        fit = statsmodels.api.OLS(xtrack_median, fit_xx).fit()
-        dxt_dx = fit.params[1]
-        dxt_dy = fit.params[2]
+        params, _ = SWOTWater.fit.wls(xtrack_median, fit_xx)
+        dxt_dx = params[1]
+        dxt_dy = params[2]
         xt_angle = np.arctan2(dxt_dy, dxt_dx)
         at_angle = xt_angle-np.pi/2
         tangent_angle = np.arctan2(tangent[:, 1], tangent[:, 0])
@@ -1238,7 +1567,8 @@ class SWOTRiverEstimator(SWOTL2):
         return river_reach
 
     def process_reach(
-        self, river_reach, reach, reach_id, reach_idx=None, min_fit_points=3):
+        self, river_reach, reach, reach_id, reach_idx=None, min_fit_points=3,
+        compute_fits=True):
         """
         Estimate the width, height, and slope for one reach.
 
@@ -1258,6 +1588,10 @@ class SWOTRiverEstimator(SWOTL2):
             to the reach_id.
         min_fit_points : int, default 3
             Minimum number of populated nodes required for height/slope fit
+        compute_fits : bool, default True
+            Fit the heights and slopes, and compute the discharge models?
+            process_reaches does the fits for all of the reaches at once
+            instead (see fit_reaches).
 
         Returns
         -------
@@ -1306,9 +1640,6 @@ class SWOTRiverEstimator(SWOTL2):
         ss = all_ss[self.river_obs.populated_nodes]
 
         hh = river_reach.wse
-        ww = 1/(river_reach.wse_std**2)
-        SS = np.c_[ss, np.ones(len(ss), dtype=ss.dtype)]
-
         mask = np.logical_and(hh > -500, hh < 9000)
 
         reach_stats['n_good_nod'] = mask.sum()
@@ -1328,24 +1659,11 @@ class SWOTRiverEstimator(SWOTL2):
                 reach_stats['height_u'] = MISSING_VALUE_FLT
 
             elif self.slope_method in ['unweighted', 'weighted']:
-                # use weighted fit if commanded and all weights are good
-                if self.slope_method == 'weighted' and all(np.isfinite(ww[mask])):
-                    fit = statsmodels.api.WLS(
-                        hh[mask], SS[mask], weights=ww[mask]).fit()
-
-                # use unweighted fit
-                else:
-                    fit = statsmodels.api.OLS(hh[mask], SS[mask]).fit()
-
-                # fit slope is meters per meter
-                reach_stats['slope'] = fit.params[0]
-                reach_stats['height'] = fit.params[1]
-
-                # use White’s (1980) heteroskedasticity robust standard errors.
-                # https://www.statsmodels.org/dev/generated/
-                #        statsmodels.regression.linear_model.RegressionResults.html
-                reach_stats['slope_u'] = fit.HC0_se[0]
-                reach_stats['height_u'] = fit.HC0_se[1]
+                # set by fit_reaches
+                reach_stats['slope'] = MISSING_VALUE_FLT
+                reach_stats['height'] = MISSING_VALUE_FLT
+                reach_stats['slope_u'] = MISSING_VALUE_FLT
+                reach_stats['height_u'] = MISSING_VALUE_FLT
 
         else:
             reach_stats['slope'] = MISSING_VALUE_FLT
@@ -1353,15 +1671,9 @@ class SWOTRiverEstimator(SWOTL2):
             reach_stats['height'] = MISSING_VALUE_FLT
             reach_stats['height_u'] = MISSING_VALUE_FLT
 
-        # do fit on geoid heights
-        gg = river_reach.geoid_hght
-        geoid_fit = statsmodels.api.OLS(gg, SS).fit()
-
-        # fit slope is meters per meter
-        reach_stats['geoid_slop'] = geoid_fit.params[0]
-        reach_stats['geoid_hght'] = geoid_fit.params[1]
-
-        LOGGER.debug('Reach height/slope processing finished')
+        # fit on geoid heights, set by fit_reaches
+        reach_stats['geoid_slop'] = MISSING_VALUE_FLT
+        reach_stats['geoid_hght'] = MISSING_VALUE_FLT
 
         # trap out of range / missing data
         if reach.metadata['lakeFlag'] < 0 or reach.metadata['lakeFlag'] > 255:
@@ -1373,18 +1685,6 @@ class SWOTRiverEstimator(SWOTL2):
         reach_stats['centerline_lat'] = reach.metadata['centerline_lat']
         reach_stats['prior_node_s'] = self.river_obs.centerline.s
 
-        # Compute discharge
-        discharge_model_values = SWOTRiver.discharge.compute(
-            reach, reach_stats['height'], reach_stats['width'],
-            reach_stats['slope'])
-
-        # add fit_height for improved geolocation
-        if reach_stats['slope'] != MISSING_VALUE_FLT:
-            river_reach.fit_height = (
-                reach_stats['height'] + reach_stats['slope'] * ss)
-        else:
-            river_reach.fit_height = MISSING_VALUE_FLT * np.ones(ss.shape)
-
         # copy things from the prior DB into reach outputs
         reach_stats['rch_id_up'] = np.array([
             item[0] for item in reach.metadata['rch_id_up']], dtype='i8')
@@ -1415,73 +1715,155 @@ class SWOTRiverEstimator(SWOTL2):
         reach_stats['n_chan_max'] = reach.metadata['n_chan_max']
         reach_stats['n_chan_mod'] = reach.metadata['n_chan_mod']
 
-        # Put in discharge_model_values into reach_stats for output
-        reach_stats.update(discharge_model_values)
-
+        river_reach.flow_dist = ss
         river_reach.metadata = reach_stats
+        if compute_fits:
+            self.fit_reaches([river_reach])
+
+            # Compute discharge
+            reach_stats.update(SWOTRiver.discharge.compute(
+                reach, reach_stats['height'], reach_stats['width'],
+                reach_stats['slope']))
         return river_reach
 
-    def create_index_file(self):
-        """Initializes the pixel cloud vector file"""
+    def fit_reaches(self, river_reaches):
+        """
+        Fits the heights and slopes (if slope_method is 'weighted' or
+        'unweighted') and the geoid heights and slopes of the river_reaches
+        from process_reach, with one batched fit for all of them (see
+        SWOTWater.fit.wls_grouped), and sets their fit_height.
+        """
+        fit_data = []
+        geoid_data = []
+        for i, river_reach in enumerate(river_reaches):
+            ss = river_reach.flow_dist
+            hh = river_reach.wse
+            ww = 1/(river_reach.wse_std**2)
+            SS = np.c_[ss, np.ones(len(ss), dtype=ss.dtype)]
+
+            mask = np.logical_and(hh > -500, hh < 9000)
+
+            if (mask.sum() > 1 and
+                    self.slope_method in ['unweighted', 'weighted']):
+                # use weighted fit if commanded and all weights are good
+                if (self.slope_method == 'weighted' and
+                        all(np.isfinite(ww[mask]))):
+                    weights = ww[mask]
+
+                # use unweighted fit
+                else:
+                    weights = np.ones(mask.sum())
+
+                fit_data.append((
+                    np.full(mask.sum(), i), hh[mask], SS[mask], weights))
+
+            geoid_data.append((
+                np.full(len(ss), i), river_reach.geoid_hght, SS))
+
+        if len(fit_data) > 0:
+            feature_id, endog, exog, weights = [
+                np.concatenate(item) for item in zip(*fit_data)]
+            params, params_u = SWOTWater.fit.wls_grouped(
+                feature_id, endog, exog, weights)
+            for i, item, item_u in zip(
+                    np.unique(feature_id), params, params_u):
+                reach_stats = river_reaches[i].metadata
+
+                # fit slope is meters per meter
+                reach_stats['slope'] = item[0]
+                reach_stats['height'] = item[1]
+
+                # use White’s (1980) heteroskedasticity robust standard errors.
+                # https://www.statsmodels.org/dev/generated/
+                #        statsmodels.regression.linear_model.RegressionResults.html
+                reach_stats['slope_u'] = item_u[0]
+                reach_stats['height_u'] = item_u[1]
+
+        # do fit on geoid heights (zero for reaches without nodes)
+        geoid_params = np.zeros((len(river_reaches), 2))
+        if len(geoid_data) > 0:
+            feature_id, endog, exog = [
+                np.concatenate(item) for item in zip(*geoid_data)]
+            if len(feature_id) > 0:
+                geoid_params[np.unique(feature_id)], _ = \
+                    SWOTWater.fit.wls_grouped(feature_id, endog, exog)
+
+        for river_reach, item in zip(river_reaches, geoid_params):
+            reach_stats = river_reach.metadata
+
+            # fit slope is meters per meter
+            reach_stats['geoid_slop'] = item[0]
+            reach_stats['geoid_hght'] = item[1]
+
+            # add fit_height for improved geolocation
+            ss = river_reach.flow_dist
+            if reach_stats['slope'] != MISSING_VALUE_FLT:
+                river_reach.fit_height = (
+                    reach_stats['height'] + reach_stats['slope'] * ss)
+            else:
+                river_reach.fit_height = MISSING_VALUE_FLT * np.ones(ss.shape)
+
+        LOGGER.debug('Reach height/slope processing finished')
+
+    def create_index_file(self, index_data=None):
+        """
+        Initializes the pixel cloud vector file, or writes it with the
+        index_data (see get_index_data)
+        """
         with nc.Dataset(self.output_file, 'w') as ofp:
-            ofp.createDimension('points', None)
-            ofp.createVariable(
-                'range_index', 'i4', 'points', fill_value=FILL_VALUES['i4'])
-            ofp.createVariable(
-                'azimuth_index', 'i4', 'points', fill_value=FILL_VALUES['i4'])
-            ofp.createVariable(
-                'node_id', 'i8', 'points', fill_value=FILL_VALUES['i4'])
-            ofp.createVariable(
-                'reach_id', 'i8', 'points', fill_value=FILL_VALUES['i4'])
-            ofp.createVariable(
-                'segmentation_label', 'i4', 'points',
-                fill_value=FILL_VALUES['i4'])
-            ofp.createVariable(
-                'distance_to_node', 'f4', 'points',
-                fill_value=FILL_VALUES['i4'])
-            ofp.createVariable(
-                'along_reach', 'f4', 'points', fill_value=FILL_VALUES['f4'])
-            ofp.createVariable(
-                'cross_reach', 'f4', 'points', fill_value=FILL_VALUES['f4'])
-            ofp.createVariable(
-                'latitude_vectorproc', 'f8', 'points',
-                fill_value=FILL_VALUES['f8'])
-            ofp.createVariable(
-                'longitude_vectorproc', 'f8', 'points',
-                fill_value=FILL_VALUES['f8'])
-            ofp.createVariable(
-                'height_vectorproc', 'f8', 'points',
-                fill_value=FILL_VALUES['f8'])
+            if index_data is None:
+                ofp.createDimension('points', None)
+            else:
+                ofp.createDimension(
+                    'points', len(index_data['range_index']))
+
+            for name, (dtype, fill_value) in self.INDEX_VARIABLES.items():
+                variable = ofp.createVariable(
+                    name, dtype, 'points', fill_value=fill_value)
+                if index_data is not None:
+                    variable[:] = index_data[name]
 
     def write_index_file(self, img_x, img_y, node_index, dst, along_reach,
                          cross_reach, reach_index, seg_lbl, lat, lon,
                          height):
         """
-        Write out the river obs indices for each pixel that get mapped to a
+        Add the river obs indices for each pixel that get mapped to a
         node as well as the pixel cloud coordinates (range and azimuth, or
         original image coordinate [e.g., gdem along- and cross-track index])
+        to the pixel cloud vector data.
+
+        The data are kept in index_rows, and written all at once (see
+        get_index_data and create_index_file).
         """
-        # append the new data
-        with nc.Dataset(self.output_file, 'a') as ofp:
-            curr_len = len(ofp.variables['range_index'])
-            new_len = curr_len + len(img_x)
-            ofp.variables['range_index'][curr_len:new_len] = img_x
-            ofp.variables['azimuth_index'][curr_len:new_len] = img_y
-            ofp.variables['node_id'][curr_len:new_len] = node_index
-            ofp.variables['reach_id'][curr_len:new_len] = reach_index
-            ofp.variables['segmentation_label'][curr_len:new_len] = seg_lbl
-            ofp.variables['distance_to_node'][curr_len:new_len] = dst
-            ofp.variables['along_reach'][curr_len:new_len] = along_reach
-            ofp.variables['cross_reach'][curr_len:new_len] = cross_reach
-            # for improved geolocation
-            ofp.variables['latitude_vectorproc'][curr_len:new_len] = lat
-            ofp.variables['longitude_vectorproc'][curr_len:new_len] = lon
-            ofp.variables['height_vectorproc'][curr_len:new_len] = height
-        return
+        self.index_rows.append((
+            img_x, img_y, node_index, reach_index, seg_lbl, dst, along_reach,
+            cross_reach, lat, lon, height))
+
+    def get_index_data(self):
+        """
+        Returns an OrderedDict with the pixel cloud vector variables of all
+        the pixels written with write_index_file.
+        """
+        index_data = collections.OrderedDict()
+        for i, (name, (dtype, fill_value)) in enumerate(
+                self.INDEX_VARIABLES.items()):
+            values = []
+            for row in self.index_rows:
+                # some (e.g., reach_index) are a single value for the reach
+                value = np.ma.asarray(row[i]).astype(dtype)
+                if value.ndim == 0:
+                    value = np.ma.repeat(value, len(row[0]))
+                values.append(value)
+            if len(values) > 0:
+                index_data[name] = np.ma.concatenate(values)
+            else:
+                index_data[name] = np.ma.zeros(0, dtype=dtype)
+        return index_data
 
     def compute_enhanced_slope(
         self, river_reach, river_reach_collection, ireach,
-        max_window_size, min_sigma, window_size_sigma_ratio):
+        max_window_size, min_sigma, window_size_sigma_ratio,
+        max_sigmas=None, reach_graph=None):
         """
         This function calculate enhanced reach slope from smoothed
         node height using Gaussian moving average.
@@ -1495,12 +1877,16 @@ class SWOTRiverEstimator(SWOTL2):
         max_window_size: the max of Gaussian window, default is 10km
         min_sigma : min sigma for gaussian averaging, default is 1km
         window_size_sigma_ratio : default is 5
+        max_sigmas : if given, truncate the Gaussian at max_sigmas*sigma
+        reach_graph : ReachGraph of river_reach_collection (made from it if
+            not given)
 
         Output:
         enhanced_slope: enhanced reach slope
         """
-        this_id = river_reach.reach_indx[0]
-        other_ids = [item.reach_indx[0] for item in river_reach_collection]
+        if reach_graph is None:
+            reach_graph = ReachGraph(
+                [item.reach_indx[0] for item in river_reach_collection])
 
         # get up/dn id from prior db
         up_id = self.reaches[ireach].metadata['rch_id_up'][0, 0]
@@ -1508,15 +1894,8 @@ class SWOTRiverEstimator(SWOTL2):
 
         prior_s = river_reach.metadata['prior_node_s']
 
-        try:
-            up_idx = np.where(other_ids == up_id)[0][0]
-        except IndexError:
-            up_idx = None
-
-        try:
-            dn_idx = np.where(other_ids == dn_id)[0][0]
-        except IndexError:
-            dn_idx = None
+        up_idx = reach_graph.index(up_id)
+        dn_idx = reach_graph.index(dn_id)
 
         # Build up array of data to be smoothed from downstream to
         # upstream.  Adjust along-reach to be cumulative across
@@ -1556,7 +1935,7 @@ class SWOTRiverEstimator(SWOTL2):
         slope = np.polyfit(distances, heights, 1)[0]
         heights_detrend = heights - slope*distances
         heights_smooth = self.gaussian_averaging(
-            distances, heights_detrend, window_size, sigma)
+            distances, heights_detrend, window_size, sigma, max_sigmas)
         heights_smooth = heights_smooth + slope*(distances - distances[0])
         enhanced_slope = (
             heights_smooth[last_node] - heights_smooth[first_node]
@@ -1565,30 +1944,48 @@ class SWOTRiverEstimator(SWOTL2):
         return enhanced_slope
 
     @staticmethod
-    def gaussian_averaging(distances, heights, window_size, sigma):
+    def gaussian_averaging(
+        distances, heights, window_size, sigma, max_sigmas=None):
         """
         Gaussian smoothing of heights using distances
         distances:   along-flow distance
         heights:     water heights
         window_size: size of data window to use for averaging
         sigma:       STD of Gaussian used for averaging
+        max_sigmas:  if given, also truncate the Gaussian at max_sigmas*sigma
 
         outputs:
         smooth_heights : smoothed elevations
         """
-        smooth_heights = np.zeros(heights.shape)
-        for ii, this_distance in enumerate(distances):
-
-            # get data window
-            mask = np.logical_and(
-                np.abs(this_distance-distances) <= window_size / 2,
-                ~np.isnan(heights))
-
-            weights = scipy.stats.norm.pdf(
-                this_distance, distances[mask], sigma)
+        half_width = window_size / 2
+        if max_sigmas is not None:
+            half_width = min(half_width, max_sigmas * sigma)
+
+        # Only evaluate the pairs of points within half_width of each other,
+        # which are a band of the pairs when sorted by distance (padded a
+        # little for round off, the exact test is done on the pairs).
+        order = np.argsort(distances, kind='stable')
+        sorted_distances = distances[order]
+        pad = 1e-9 * (np.abs(distances) + half_width)
+        first = np.searchsorted(
+            sorted_distances, distances - half_width - pad, 'left')
+        last = np.searchsorted(
+            sorted_distances, distances + half_width + pad, 'right')
+        counts = last - first
+
+        ii = np.repeat(np.arange(len(distances)), counts)
+        jj = order[np.repeat(first - np.cumsum(counts) + counts, counts) +
+                   np.arange(counts.sum())]
+
+        # get data windows
+        mask = np.logical_and(
+            np.abs(distances[ii]-distances[jj]) <= half_width,
+            ~np.isnan(heights[jj]))
+        ii, jj = ii[mask], jj[mask]
 
-            smooth_heights[ii] = (
-                np.multiply(weights, heights[mask]).sum() /
-                weights.sum())
+        weights = scipy.stats.norm.pdf(distances[ii], distances[jj], sigma)
 
+        smooth_heights = (
+            np.bincount(ii, weights*heights[jj], minlength=len(distances)) /
+            np.bincount(ii, weights, minlength=len(distances)))
         return smooth_heights
@@ -8,242 +8,284 @@ from RiverObs.RiverObs import \
 
 def compute(reach, reach_height, reach_width, reach_slope):
     """Computes the discharge models"""
-    area_fit_outputs = area(
-        reach_height, reach_width, reach.metadata['area_fits'])
+    outputs = compute_arrays(
+        np.array([reach_height]), np.array([reach_width]),
+        np.array([reach_slope]), reach.metadata['area_fits'],
+        reach.metadata['discharge_models'])
+    return {key: value[0] for key, value in outputs.items()}
 
-    d_x_area = area_fit_outputs[0]
-    if d_x_area < -10000000:
-        d_x_area = MISSING_VALUE_FLT
+def compute_reaches(reaches, reach_heights, reach_widths, reach_slopes):
+    """
+    Computes the discharge models of several reaches at once
+
+    reaches - list of prior db reaches (with metadata area_fits and
+              discharge_models)
+    reach_heights, reach_widths, reach_slopes - observed values of each
+                                                reach
+    Returns dict of arrays with the outputs of compute for each reach.
+    """
+    def concatenate(items):
+        # concatenate the prior db values of the reaches (reach axis last)
+        if isinstance(items[0], dict):
+            return {key: concatenate([item[key] for item in items])
+                    for key in items[0]}
+        return np.ma.concatenate(items, axis=-1)
+
+    return compute_arrays(
+        np.asarray(reach_heights, dtype=np.float64),
+        np.asarray(reach_widths, dtype=np.float64),
+        np.asarray(reach_slopes, dtype=np.float64),
+        concatenate([reach.metadata['area_fits'] for reach in reaches]),
+        concatenate([reach.metadata['discharge_models'] for reach in reaches]))
+
+def compute_arrays(
+    reach_height, reach_width, reach_slope, area_fits, discharge_models):
+    """
+    Computes the discharge models for arrays of reaches.
+
+    reach_height, reach_width, reach_slope - observed values for each reach
+    area_fits, discharge_models - dicts of prior db arrays, with the reach
+                                  axis last
+    """
+    def get(value):
+        # prior db value as floats with NaN for missing
+        return np.ma.filled(np.ma.asarray(value, dtype=np.float64), np.nan)
+
+    area_fit_outputs = area_arrays(reach_height, reach_width, area_fits)
+
+    with np.errstate(all='ignore'):
+        d_x_area = area_fit_outputs[0]
+        d_x_area = np.where(d_x_area < -10000000, MISSING_VALUE_FLT, d_x_area)
 
-    d_x_area_u = area_fit_outputs[3]
-    if d_x_area_u < 0:
-        d_x_area_u = MISSING_VALUE_FLT
+        d_x_area_u = area_fit_outputs[3]
+        d_x_area_u = np.where(d_x_area_u < 0, MISSING_VALUE_FLT, d_x_area_u)
 
-    outputs = {'d_x_area': d_x_area, 'd_x_area_u': d_x_area_u}
-    for key, models in reach.metadata['discharge_models'].items():
+        is_valid = np.logical_and(reach_width > 0, reach_slope > 0)
 
-        metro_ninf = models['MetroMan']['ninf']
-        metro_Abar = models['MetroMan']['Abar']
-        metro_p = models['MetroMan']['p']
+        outputs = {'d_x_area': d_x_area, 'd_x_area_u': d_x_area_u}
+        for key, models in discharge_models.items():
 
-        if (reach_width > 0 and reach_slope > 0 and metro_Abar+d_x_area >= 0 and
-            metro_Abar > 0 and metro_ninf > 0):
+            def manning(Abar, n_inv):
+                # Manning's equation with the cross-sectional area from Abar
+                return (
+                    (d_x_area+Abar)**(5/3) * reach_width**(-2/3) *
+                    (reach_slope)**(1/2)) * n_inv
+
+            metro_ninf = get(models['MetroMan']['ninf'])
+            metro_Abar = get(models['MetroMan']['Abar'])
+            metro_p = get(models['MetroMan']['p'])
 
             metro_n = metro_ninf * (
                 (d_x_area+metro_Abar) / reach_width)**metro_p
-            metro_q = (
-                (d_x_area+metro_Abar)**(5/3) * reach_width**(-2/3) *
-                (reach_slope)**(1/2)) / metro_n
-        else:
-            metro_q = MISSING_VALUE_FLT
-
-        # 3: Compute BAM model
-        bam_n = models['BAM']['n']
-        bam_Abar = models['BAM']['Abar']
-
-        if (reach_width > 0 and reach_slope > 0 and bam_Abar+d_x_area >= 0 and
-            bam_Abar > 0 and bam_n > 0):
-
-            bam_q = (
-                (d_x_area+bam_Abar)**(5/3) * reach_width**(-2/3) *
-                (reach_slope)**(1/2)) / bam_n
-        else:
-            bam_q = MISSING_VALUE_FLT
-
-        # 4: Compute HiVDI model
-        hivdi_Abar = models['HiVDI']['Abar']
-        hivdi_alpha = models['HiVDI']['alpha']
-        hivdi_beta = models['HiVDI']['beta']
-
-        if (reach_width > 0 and reach_slope > 0 and hivdi_Abar+d_x_area >= 0 and
-            hivdi_Abar > 0 and hivdi_alpha > 0):
+            metro_q = np.where(np.logical_and.reduce([
+                is_valid, metro_Abar+d_x_area >= 0, metro_Abar > 0,
+                metro_ninf > 0]), manning(metro_Abar, 1/metro_n),
+                MISSING_VALUE_FLT)
+
+            # 3: Compute BAM model
+            bam_n = get(models['BAM']['n'])
+            bam_Abar = get(models['BAM']['Abar'])
+
+            bam_q = np.where(np.logical_and.reduce([
+                is_valid, bam_Abar+d_x_area >= 0, bam_Abar > 0, bam_n > 0]),
+                manning(bam_Abar, 1/bam_n), MISSING_VALUE_FLT)
+
+            # 4: Compute HiVDI model
+            hivdi_Abar = get(models['HiVDI']['Abar'])
+            hivdi_alpha = get(models['HiVDI']['alpha'])
+            hivdi_beta = get(models['HiVDI']['beta'])
+
             hivdi_n_inv = hivdi_alpha * (
                 (d_x_area+hivdi_Abar)/reach_width)**hivdi_beta
-            hivdi_q = (
-                (d_x_area+hivdi_Abar)**(5/3) * reach_width**(-2/3) *
-                (reach_slope)**(1/2)) * hivdi_n_inv
-        else:
-            hivdi_q = MISSING_VALUE_FLT
-
-        # 5: Compute MOMMA model
-        momma_B = models['MOMMA']['B']
-        momma_H = models['MOMMA']['H']
-        momma_Save = models['MOMMA']['Save']
-        momma_r = 2
-
-        momma_nb = 0.11 * momma_Save**0.18
-        log_factor = np.log10((momma_H-momma_B)/(reach_height-momma_B))
-        if reach_height <= momma_H:
-            momma_n = momma_nb*(1+log_factor)
-            log_check = log_factor > -1
-        else:
-            momma_n = momma_nb*(1-log_factor)
-            log_check = log_factor < 1
-
-        if (reach_width > 0 and reach_slope > 0 and momma_n > 0 and
-            momma_Save > 0 and momma_H > momma_B and momma_nb > 0 and log_check):
-
-            momma_q = (
-                ((reach_height - momma_B)*(momma_r/(1+momma_r)))**(5/3) *
-                reach_width * reach_slope**(1/2)) / momma_n
-        else:
-            momma_q = MISSING_VALUE_FLT
-
-        # 6: Compute SADS model
-        sads_Abar = models['SADS']['Abar']
-        sads_n = models['SADS']['n']
-
-        if (reach_width > 0 and reach_slope > 0 and sads_Abar+d_x_area >= 0 and
-            sads_Abar > 0 and sads_n > 0):
-            sads_q = (
-                (d_x_area+sads_Abar)**(5/3) * reach_width**(-2/3) *
-                (reach_slope)**(1/2)) / sads_n
-        else:
-            sads_q = MISSING_VALUE_FLT
-
-        if key == 'constrained':
-            outputs['metro_q_c'] = metro_q
-            outputs['bam_q_c'] = bam_q
-            outputs['hivdi_q_c'] = hivdi_q
-            outputs['momma_q_c'] = momma_q
-            outputs['sads_q_c'] = sads_q
-        elif key == 'unconstrained':
-            outputs['metro_q_uc'] = metro_q
-            outputs['bam_q_uc'] = bam_q
-            outputs['hivdi_q_uc'] = hivdi_q
-            outputs['momma_q_uc'] = momma_q
-            outputs['sads_q_uc'] = sads_q
+            hivdi_q = np.where(np.logical_and.reduce([
+                is_valid, hivdi_Abar+d_x_area >= 0, hivdi_Abar > 0,
+                hivdi_alpha > 0]), manning(hivdi_Abar, hivdi_n_inv),
+                MISSING_VALUE_FLT)
+
+            # 5: Compute MOMMA model
+            momma_B = get(models['MOMMA']['B'])
+            momma_H = get(models['MOMMA']['H'])
+            momma_Save = get(models['MOMMA']['Save'])
+            momma_r = 2
+
+            momma_nb = 0.11 * momma_Save**0.18
+            log_factor = np.log10((momma_H-momma_B)/(reach_height-momma_B))
+            is_below = reach_height <= momma_H
+            momma_n = np.where(
+                is_below, momma_nb*(1+log_factor), momma_nb*(1-log_factor))
+            log_check = np.where(is_below, log_factor > -1, log_factor < 1)
+
+            momma_q = np.where(np.logical_and.reduce([
+                is_valid, momma_n > 0, momma_Save > 0, momma_H > momma_B,
+                momma_nb > 0, log_check]), (
+                    ((reach_height - momma_B)*(momma_r/(1+momma_r)))**(5/3) *
+                    reach_width * reach_slope**(1/2)) / momma_n,
+                MISSING_VALUE_FLT)
+
+            # 6: Compute SADS model
+            sads_Abar = get(models['SADS']['Abar'])
+            sads_n = get(models['SADS']['n'])
+
+            sads_q = np.where(np.logical_and.reduce([
+                is_valid, sads_Abar+d_x_area >= 0, sads_Abar > 0, sads_n > 0]),
+                manning(sads_Abar, 1/sads_n), MISSING_VALUE_FLT)
+
+            if key == 'constrained':
+                outputs['metro_q_c'] = metro_q
+                outputs['bam_q_c'] = bam_q
+                outputs['hivdi_q_c'] = hivdi_q
+                outputs['momma_q_c'] = momma_q
+                outputs['sads_q_c'] = sads_q
+            elif key == 'unconstrained':
+                outputs['metro_q_uc'] = metro_q
+                outputs['bam_q_uc'] = bam_q
+                outputs['hivdi_q_uc'] = hivdi_q
+                outputs['momma_q_uc'] = momma_q
+                outputs['sads_q_uc'] = sads_q
     return outputs
 
 def area(observed_height, observed_width, area_fits):
     """
-    Provides a nicer interface for _area wrapping up the unpacking of prior
-    db area_fits into CalculatedAEIV.m inputs.
+    Computes cross-sectional area from the prior db area_fits, based on
+    CalculatedAEIV.m at https://github.com/mikedurand/SWOTAprimeCalcs
 
     observed_height - swot observed height for this reach
     observed_width - swot observed width for this reach
     area_fits - dictionary of things extracted from prior DB
+    Returns delta_area_hat, observed_width_hat, observed_height_hat, dAunc
     """
-    height_breakpoints = np.squeeze(area_fits['h_break'])
-    poly_fits = [
-        np.squeeze(area_fits['fit_coeffs'])[:, 0],
-        np.squeeze(area_fits['fit_coeffs'])[:, 1],
-        np.squeeze(area_fits['fit_coeffs'])[:, 2]]
+    outputs = area_arrays(
+        np.array([observed_height], dtype=np.float64),
+        np.array([observed_width], dtype=np.float64), area_fits)
+    return tuple(output[0] for output in outputs)
 
-    area_median_flow = np.squeeze(area_fits['med_flow_area'])
+def area_arrays(observed_height, observed_width, area_fits):
+    """
+    Like area, but for arrays of reaches, with the prior db area_fits of
+    all reaches stacked along the last axis.
 
-    fit_width_std = np.squeeze(area_fits['w_err_stdev'])
-    fit_height_std = np.squeeze(area_fits['h_err_stdev'])
+    observed_height - swot observed height for each reach
+    observed_width - swot observed width for each reach
+    area_fits - dictionary of things extracted from prior DB
+    """
+    def get(key):
+        # reach axis first, with NaN for missing values
+        return np.ma.filled(np.ma.asarray(
+            area_fits[key], dtype=np.float64), np.nan).T
 
-    cov_height_width = np.zeros([2, 2])
-    cov_height_width[0, 0] = np.squeeze(area_fits['w_variance'])
-    cov_height_width[0, 1] = np.squeeze(area_fits['hw_covariance'])
-    cov_height_width[1, 0] = cov_height_width[0, 1]
-    cov_height_width[1, 1] = np.squeeze(area_fits['h_variance'])
-    num_obs = np.squeeze(area_fits['h_w_nobs'])
+    # (num reaches, num breakpoints) and (num reaches, num fits, num coeffs)
+    height_breakpoints = get('h_break').reshape(len(observed_height), -1)
+    poly_fits = get('fit_coeffs').reshape(
+        len(observed_height), height_breakpoints.shape[1]-1, -1)
 
-    return _area(
+    return _area_arrays(
         observed_height, observed_width, height_breakpoints, poly_fits,
-        area_median_flow, fit_width_std**2, fit_height_std**2,
-        cov_height_width, num_obs)
+        get('med_flow_area').reshape(-1), get('w_err_stdev').reshape(-1)**2,
+        get('h_err_stdev').reshape(-1)**2, get('h_variance').reshape(-1))
+
+def _polyval(coeffs, value):
+    """np.polyval for arrays of polynomials (coeffs along the last axis)"""
+    result = np.zeros(np.shape(value))
+    for ii in range(coeffs.shape[-1]):
+        result = result * value + coeffs[..., ii]
+    return result
 
-def _area(
+def _area_arrays(
     observed_height, observed_width, height_breakpoints, poly_fits,
-    area_median_flow, fit_width_var, fit_height_var, cov_height_width,
-    num_obs):
+    area_median_flow, fit_width_var, fit_height_var, height_var):
     """
-    Computes cross-sectional area from fit, based on CalculatedAEIV.m at
-    https://github.com/mikedurand/SWOTAprimeCalcs
+    Computes the cross-sectional area of arrays of reaches at once.
 
-    observed_height - swot observed height for this reach
-    observed_width - swot observed width for this reach
-    height_breakpoints - boundaries for fits in height
-    poly_fits - polynominal coeffs for the fits
-    area_median_flow - cross-sectional area at median flow
-    fit_width_var - width error std**2
-    fit_height_var - height error std**2
-    cov_height_width - covariance matrix for width / height
+    height_breakpoints - (num reaches, num fits + 1) boundaries for fits
+    poly_fits - (num reaches, num fits, num coeffs) polynomial coeffs
+    height_var - height variance of the prior db fit (h_variance)
+    other inputs are arrays with one value for each reach.
     """
-    poly_ints = np.array([np.polyint(item) for item in poly_fits])
-
-    height_fits_ll = height_breakpoints[0:-1]
-    height_fits_ul = height_breakpoints[1:]
-
-    ifit = np.argwhere(np.logical_and(
-        observed_height >= height_fits_ll,
-        observed_height < height_fits_ul))
-
-    low_height_snr = (
-        cov_height_width[1, 1] - fit_height_var)/fit_height_var < 2
-
-    if ifit.size == 0:
-        observed_height_hat = np.nan
-        observed_width_hat = observed_width
-        if observed_height > height_breakpoints.max():
-            delta_area_hat = (
-                np.polyval(poly_ints[-1], height_breakpoints[-1]) -
-                np.polyval(poly_ints[-1], height_breakpoints[-2]) +
-                area_median_flow)
-            dAunc = np.sqrt(
-                fit_height_var*observed_width**2 +
-                2*fit_width_var*(observed_height-height_breakpoints[-1])**2)
-
-        else:
-            delta_area_hat = (
-                - area_median_flow - ((height_breakpoints[0]-observed_height)
-                * (observed_width + poly_fits[0][0]*height_breakpoints[0]
-                + poly_fits[0][1])/2))
-            dAunc = np.sqrt(
-                fit_height_var*observed_width**2 +
-                2*fit_width_var*(observed_height-height_breakpoints[0])**2)
-
-    else:
-        ifit = ifit[0][0]
-        if low_height_snr:
-            observed_height_hat = observed_height
-        else:
-            observed_height_hat = estimate_height(
-                observed_width, observed_height, poly_fits[ifit],
-                fit_width_var, fit_height_var)
-
-        ifit_hat = np.argwhere(np.logical_and(
-            observed_height_hat >= height_fits_ll,
-            observed_height_hat < height_fits_ul))
-
-        if ifit_hat.size > 0:
-            ifit = ifit_hat[0][0]
-            observed_height_hat = estimate_height(
-                observed_width, observed_height, poly_fits[ifit],
-                fit_width_var, fit_height_var)
-
-        if low_height_snr:
-            observed_width_hat = observed_width
-        else:
-            observed_width_hat = np.polyval(
-                poly_fits[ifit], observed_height_hat)
-
-        delta_area_hat = 0
-        for poly_int, height_ll, height_ul in zip(
-            poly_ints[:ifit+1], height_fits_ll[:ifit+1],
-            height_fits_ul[:ifit+1]):
-
-            delta_area_hat += (
-                np.polyval(poly_int, np.min([observed_height_hat, height_ul]))
-                - np.polyval(poly_int, height_ll))
+    num_reaches, num_fits, num_coeffs = poly_fits.shape
+    reaches = np.arange(num_reaches)
+
+    # np.polyint of the fits
+    poly_ints = np.concatenate([
+        poly_fits / np.arange(num_coeffs, 0, -1),
+        np.zeros((num_reaches, num_fits, 1))], axis=-1)
+
+    height_fits_ll = height_breakpoints[:, 0:-1]
+    height_fits_ul = height_breakpoints[:, 1:]
+
+    def find_fit(height):
+        # index of the first fit containing each height, -1 if none
+        in_fit = np.logical_and(
+            height[:, np.newaxis] >= height_fits_ll,
+            height[:, np.newaxis] < height_fits_ul)
+        return np.where(
+            np.any(in_fit, axis=1), np.argmax(in_fit, axis=1), -1)
+
+    with np.errstate(all='ignore'):
+        low_height_snr = (height_var - fit_height_var)/fit_height_var < 2
+
+        # reaches with an observed height outside of all fits
+        ifit = find_fit(observed_height)
+        no_fit = ifit < 0
+        is_above = observed_height > np.max(height_breakpoints, axis=1)
+
+        delta_area_above = (
+            _polyval(poly_ints[:, -1], height_breakpoints[:, -1]) -
+            _polyval(poly_ints[:, -1], height_breakpoints[:, -2]) +
+            area_median_flow)
+        delta_area_below = (
+            - area_median_flow - ((height_breakpoints[:, 0]-observed_height)
+            * (observed_width + poly_fits[:, 0, 0]*height_breakpoints[:, 0]
+            + poly_fits[:, 0, 1])/2))
+        height_breakpoint = np.where(
+            is_above, height_breakpoints[:, -1], height_breakpoints[:, 0])
+        dAunc_no_fit = np.sqrt(
+            fit_height_var*observed_width**2 +
+            2*fit_width_var*(observed_height-height_breakpoint)**2)
+
+        # reaches with an observed height in one of the fits
+        ifit[no_fit] = 0
+        observed_height_hat = np.where(
+            low_height_snr, observed_height, estimate_height(
+                observed_width, observed_height,
+                poly_fits[reaches, ifit].T, fit_width_var, fit_height_var))
+
+        ifit_hat = find_fit(observed_height_hat)
+        has_fit_hat = ifit_hat >= 0
+        ifit = np.where(has_fit_hat, ifit_hat, ifit)
+        poly_fit = poly_fits[reaches, ifit]
+        observed_height_hat = np.where(
+            has_fit_hat, estimate_height(
+                observed_width, observed_height, poly_fit.T, fit_width_var,
+                fit_height_var), observed_height_hat)
+
+        observed_width_hat = np.where(
+            low_height_snr, observed_width,
+            _polyval(poly_fit, observed_height_hat))
+
+        delta_area_hat = np.zeros(num_reaches)
+        for ii in range(num_fits):
+            delta_area_hat += np.where(ii <= ifit, (
+                _polyval(poly_ints[:, ii], np.minimum(
+                    observed_height_hat, height_fits_ul[:, ii]))
+                - _polyval(poly_ints[:, ii], height_fits_ll[:, ii])), 0)
 
         delta_area_hat -= area_median_flow
 
-        if poly_fits[ifit][0] == 0:
-            dAunc = poly_fits[ifit][1] * np.sqrt(fit_height_var)
-        else:
-            mu = (np.sqrt(
-                poly_fits[ifit][0]/2) *
-                (observed_height_hat - height_fits_ul[ifit]) + np.polyval(
-                poly_fits[ifit], height_fits_ul[ifit]) / np.sqrt(
-                2 * poly_fits[ifit][0]))
-            sigma = np.sqrt(poly_fits[ifit][0]/2) * np.sqrt(fit_height_var)
-            dAunc = np.sqrt(4*mu**2*sigma**2 + 2*sigma**4);
-
+        height_ul = height_fits_ul[reaches, ifit]
+        mu = (np.sqrt(
+            poly_fit[:, 0]/2) *
+            (observed_height_hat - height_ul) + _polyval(
+            poly_fit, height_ul) / np.sqrt(2 * poly_fit[:, 0]))
+        sigma = np.sqrt(poly_fit[:, 0]/2) * np.sqrt(fit_height_var)
+        dAunc = np.where(
+            poly_fit[:, 0] == 0, poly_fit[:, 1] * np.sqrt(fit_height_var),
+            np.sqrt(4*mu**2*sigma**2 + 2*sigma**4))
+
+    observed_height_hat[no_fit] = np.nan
+    observed_width_hat[no_fit] = observed_width[no_fit]
+    delta_area_hat[no_fit] = np.where(
+        is_above, delta_area_above, delta_area_below)[no_fit]
+    dAunc[no_fit] = dAunc_no_fit[no_fit]
     return delta_area_hat, observed_width_hat, observed_height_hat, dAunc
 
 def estimate_height(observed_width, observed_height, poly_fit, fit_width_var,
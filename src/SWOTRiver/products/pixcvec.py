@@ -320,12 +320,22 @@ class L2PIXCVector(Product):
 
     def update_from_rivertile(self, rivertile):
         """Updates some stuff in PIXCVecRiver from RiverTile"""
-        for node_id, ice_clim_f, ice_dyn_f in zip(
-            rivertile.nodes.node_id, rivertile.nodes.ice_clim_f,
-            rivertile.nodes.ice_dyn_f):
-            mask = self.node_id == node_id
-            self.ice_clim_f[mask] = ice_clim_f
-            self.ice_dyn_f[mask] = ice_dyn_f
+        # sorted unique node ids (using the last of any repeated node)
+        node_ids = np.ma.getdata(rivertile.nodes.node_id)
+        node_ids, node_index = np.unique(node_ids[::-1], return_index=True)
+        node_index = len(rivertile.nodes.node_id) - 1 - node_index
+        if len(node_ids) == 0:
+            return
+
+        # rivertile node of each pixel
+        pixel_node_ids = np.ma.getdata(self.node_id)
+        pixel_index = np.searchsorted(node_ids, pixel_node_ids)
+        pixel_index[pixel_index == len(node_ids)] = 0
+        mask = node_ids[pixel_index] == pixel_node_ids
+        pixel_index = node_index[pixel_index[mask]]
+
+        self.ice_clim_f[mask] = rivertile.nodes.ice_clim_f[pixel_index]
+        self.ice_dyn_f[mask] = rivertile.nodes.ice_dyn_f[pixel_index]
 
     def update_from_pixc(self, pixc_file):
         """Adds some attributes from PIXC file"""
@@ -50,9 +50,13 @@ class L2HRRiverSP(L2HRRiverTile):
         Builds a River SP product from a list of rivetile data products
         """
         klass = cls()
-        # It does somthing like this
-        for rivertile in rivertiles:
-           klass += rivertile
+        # concatenate each variable of all the tiles at once, as adding them
+        # one at a time re-copies everything for each tile
+        if len(rivertiles) > 0:
+            klass.nodes = RiverTileNodes.concatenate(
+                [klass.nodes] + [item.nodes for item in rivertiles])
+            klass.reaches = RiverTileReaches.concatenate(
+                [klass.reaches] + [item.reaches for item in rivertiles])
 
         # sort them by increasing reach id
         klass.sort()
@@ -16,6 +16,7 @@ import warnings
 from shapely.geometry import Point, mapping, LineString
 from collections import OrderedDict as odict
 
+import SWOTWater.aggregate as aggregate
 from SWOTRiver.products.pixcvec import L2PIXCVector
 from SWOTWater.products.product import Product, FILL_VALUES, textjoin
 from RiverObs.RiverObs import \
@@ -184,13 +185,16 @@ class L2HRRiverTile(Product):
     def sort(self):
         """sorts self according to the PDD"""
         # sort first by reach_id, then by node_id
+        # (reordering keeps the variables consistent with the dimensions)
         node_sort_idx = np.argsort(self.nodes.node_id)
-        for key, values in self.nodes.variables.items():
-            self.nodes[key] = values[node_sort_idx]
+        self.nodes._set_variables(odict(
+            (key, values[node_sort_idx])
+            for key, values in self.nodes.variables.items()))
 
         reach_sort_idx = np.argsort(self.reaches.reach_id)
-        for key, values in self.reaches.variables.items():
-            self.reaches[key] = values[reach_sort_idx]
+        self.reaches._set_variables(odict(
+            (key, values[reach_sort_idx])
+            for key, values in self.reaches.variables.items()))
 
     @staticmethod
     def dump_xmls(node_xml_file, reach_xml_file):
@@ -205,149 +209,14 @@ class L2HRRiverTile(Product):
         """Constructs self from riverobs outputs"""
         klass = cls()
 
-        # add missing reaches and nodes
-        for reach, reach_id in zip(prd_reaches, prd_reaches.reach_idx):
+        # add missing reaches and nodes (skipping ghost reaches)
+        prd_items = [
+            (reach, reach_id) for reach, reach_id in zip(
+                prd_reaches, prd_reaches.reach_idx) if reach_id % 10 != 6]
 
-            # skip ghost reaches
-            if reach_id % 10 == 6:
-                continue
-
-            # check for missing nodes
-            mask_nodes = node_outputs['reach_indx'] == reach_id
-
-            missing_node_ids = np.setdiff1d(
-                reach.node_indx, node_outputs['node_indx'][mask_nodes])
-
-            if len(missing_node_ids) > 0:
-                for missing_node_id in np.sort(missing_node_ids):
-
-                    rch_idx = np.argwhere(
-                        reach.node_indx == missing_node_id)[0][0]
-
-                    try:
-                        insert_idx = np.where(
-                            missing_node_id > node_outputs['node_indx'])[0][-1]
-                    except IndexError:
-                        insert_idx = 0
-
-                    node_outputs['x_prior'] = np.insert(
-                        node_outputs['x_prior'], insert_idx, reach.x[rch_idx])
-                    node_outputs['y_prior'] = np.insert(
-                        node_outputs['y_prior'], insert_idx, reach.y[rch_idx])
-                    node_outputs['lon_prior'] = np.insert(
-                        node_outputs['lon_prior'], insert_idx, reach.lon[rch_idx])
-                    node_outputs['lat_prior'] = np.insert(
-                        node_outputs['lat_prior'], insert_idx, reach.lat[rch_idx])
-                    node_outputs['p_wse'] = np.insert(
-                        node_outputs['p_wse'], insert_idx, reach.wse[rch_idx])
-                    node_outputs['p_wse_var'] = np.insert(
-                        node_outputs['p_wse_var'], insert_idx,
-                        reach.wse_var[rch_idx])
-                    node_outputs['p_width'] = np.insert(
-                        node_outputs['p_width'], insert_idx,
-                        reach.width[rch_idx])
-                    node_outputs['p_wid_var'] = np.insert(
-                        node_outputs['p_wid_var'], insert_idx,
-                        reach.width_var[rch_idx])
-                    node_outputs['p_dist_out'] = np.insert(
-                        node_outputs['p_dist_out'], insert_idx,
-                        reach.dist_out[rch_idx])
-                    node_outputs['p_length'] = np.insert(
-                        node_outputs['p_length'], insert_idx,
-                        reach.node_length[rch_idx])
-                    node_outputs['grand_id'] = np.insert(
-                        node_outputs['grand_id'], insert_idx,
-                        reach.grod_id[rch_idx])
-                    node_outputs['n_chan_max'] = np.insert(
-                        node_outputs['n_chan_max'], insert_idx,
-                        reach.n_chan_max[rch_idx])
-                    node_outputs['n_chan_mod'] = np.insert(
-                        node_outputs['n_chan_mod'], insert_idx,
-                        reach.n_chan_mod[rch_idx])
-                    node_outputs['node_indx'] = np.insert(
-                        node_outputs['node_indx'], insert_idx, missing_node_id)
-                    node_outputs['reach_indx'] = np.insert(
-                        node_outputs['reach_indx'], insert_idx, reach_id)
-
-                    for key in ['nobs', 'nobs_h', 'node_blocked']:
-                        node_outputs[key] = np.insert(
-                            node_outputs[key], insert_idx, MISSING_VALUE_INT4)
-
-                    for key in [
-                        'lat', 'lon', 'x', 'y', 's', 'w_ptp', 'w_std', 'w_area',
-                         'w_db', 'area', 'area_u', 'area_det', 'area_det_u',
-                         'area_of_ht', 'wse', 'wse_std', 'wse_u', 'rdr_sig0',
-                         'rdr_sig0_u', 'latitude_u', 'longitud_u', 'width_u',
-                         'geoid_hght', 'solid_tide', 'load_tidef', 'load_tideg',
-                         'pole_tide', 'flow_dir', 'dark_frac', 'xtrack',
-                         'h_n_ave', 'fit_height']:
-                        node_outputs[key] = np.insert(
-                            node_outputs[key], insert_idx, MISSING_VALUE_FLT)
-
-            # for missing reaches
-            if reach_id not in reach_outputs['reach_idx']:
-                for key in ['centerline_lon', 'centerline_lat']:
-                    reach_outputs[key] = np.array(list(
-                        reach_outputs[key])+[reach.metadata[key],])
-
-                this_rch_id_up = reach.metadata['rch_id_up'].T
-                reach_outputs['rch_id_up'] = np.concatenate(
-                    (reach_outputs['rch_id_up'], this_rch_id_up))
-
-                this_rch_id_dn = reach.metadata['rch_id_dn'].T
-                reach_outputs['rch_id_dn'] = np.concatenate(
-                    (reach_outputs['rch_id_dn'], this_rch_id_up))
-                reach_outputs['n_reach_up'] = np.append(
-                    reach_outputs['n_reach_up'], (this_rch_id_up>0).sum())
-                reach_outputs['n_reach_dn'] = np.append(
-                    reach_outputs['n_reach_dn'], (this_rch_id_dn>0).sum())
-                reach_outputs['reach_idx'] = np.append(
-                        reach_outputs['reach_idx'], reach_id)
-                reach_outputs['p_lon'] = np.append(
-                        reach_outputs['p_lon'], reach.metadata['lon'])
-                reach_outputs['p_lat'] = np.append(
-                        reach_outputs['p_lat'], reach.metadata['lat'])
-                reach_outputs['p_wse'] = np.append(
-                        reach_outputs['p_wse'], reach.metadata['wse'])
-                reach_outputs['p_wse_var'] = np.append(
-                        reach_outputs['p_wse_var'], reach.metadata['wse_var'])
-                reach_outputs['p_width'] = np.append(
-                    reach_outputs['p_width'], reach.metadata['width'])
-                reach_outputs['p_wid_var'] = np.append(
-                    reach_outputs['p_wid_var'], reach.metadata['width_var'])
-                reach_outputs['p_n_nodes'] = np.append(
-                        reach_outputs['p_n_nodes'], len(reach.x))
-                reach_outputs['p_dist_out'] = np.append(
-                        reach_outputs['p_dist_out'], reach.metadata['dist_out'])
-                reach_outputs['p_length'] = np.append(
-                    reach_outputs['p_length'], reach.metadata['reach_length'])
-                reach_outputs['grand_id'] = np.append(
-                    reach_outputs['grand_id'], reach.metadata['grod_id'])
-                reach_outputs['n_chan_max'] = np.append(
-                    reach_outputs['n_chan_max'], reach.metadata['n_chan_max'])
-                reach_outputs['n_chan_mod'] = np.append(
-                    reach_outputs['n_chan_mod'], reach.metadata['n_chan_mod'])
-                reach_outputs['reach_id'] = np.append(
-                    reach_outputs['reach_id'], MISSING_VALUE_INT9)
-                reach_outputs['n_good_nod'] = np.append(
-                    reach_outputs['n_good_nod'], MISSING_VALUE_INT4)
-                reach_outputs['lake_flag'] = np.append(
-                    reach_outputs['lake_flag'], MISSING_VALUE_INT4)
-
-                for key in ['length', 'node_dist', 'area', 'area_u', 'area_det',
-                            'area_det_u', 'area_of_ht', 'width', 'width_u',
-                            'loc_offset', 'xtrk_dist', 'frac_obs',
-                            'slope', 'height', 'slope_u', 'height_u',
-                            'geoid_slop', 'geoid_hght', 'prior_node_s',
-                            'd_x_area', 'd_x_area_u', 'dark_frac', 'slope2',
-                            'metro_q_c', 'bam_q_c', 'hivdi_q_c', 'momma_q_c',
-                            'sads_q_c', 'metro_q_uc', 'bam_q_uc', 'hivdi_q_uc',
-                            'momma_q_uc', 'sads_q_uc']:
-
-                    reach_outputs[key] = np.append(
-                        reach_outputs[key], MISSING_VALUE_FLT)
-
-                # TODO: set discharge flags based on ???
+        if len(prd_items) > 0:
+            cls.add_missing_nodes(node_outputs, prd_items)
+            cls.add_missing_reaches(reach_outputs, prd_items)
 
         klass.nodes = RiverTileNodes.from_riverobs(node_outputs)
         klass.reaches = RiverTileReaches.from_riverobs(
@@ -356,6 +225,138 @@ class L2HRRiverTile(Product):
         klass.sort()
         return klass
 
+    @staticmethod
+    def add_missing_nodes(node_outputs, prd_items):
+        """
+        Appends the prior nodes of the (reach, reach_id) prd_items that are
+        not in node_outputs, with missing values for the observed
+        quantities.
+        """
+        # (reach id, node id) of each observed and prior node
+        prior_node_ids = np.concatenate(
+            [reach.node_indx for reach, reach_id in prd_items])
+        prior_reach_ids = np.concatenate([
+            np.full(len(reach.node_indx), reach_id)
+            for reach, reach_id in prd_items])
+        observed_pairs = np.column_stack([
+            node_outputs['reach_indx'], node_outputs['node_indx']])
+        prior_pairs = np.column_stack([prior_reach_ids, prior_node_ids])
+
+        _, codes = np.unique(np.concatenate(
+            [observed_pairs, prior_pairs]), axis=0, return_inverse=True)
+        observed_codes = codes[:len(observed_pairs)]
+        prior_codes = codes[len(observed_pairs):]
+
+        # first of each prior node that was not observed
+        _, missing = np.unique(prior_codes, return_index=True)
+        missing = np.sort(missing[~np.isin(prior_codes[missing], observed_codes)])
+        if len(missing) == 0:
+            return
+
+        def extend(key, values):
+            # append values to node_outputs[key], keeping its dtype
+            node_outputs[key] = np.concatenate([
+                node_outputs[key],
+                np.broadcast_to(values, missing.shape).astype(
+                    node_outputs[key].dtype)])
+
+        for key, attr in [
+            ['x_prior', 'x'], ['y_prior', 'y'], ['lon_prior', 'lon'],
+            ['lat_prior', 'lat'], ['p_wse', 'wse'], ['p_wse_var', 'wse_var'],
+            ['p_width', 'width'], ['p_wid_var', 'width_var'],
+            ['p_dist_out', 'dist_out'], ['p_length', 'node_length'],
+            ['grand_id', 'grod_id'], ['n_chan_max', 'n_chan_max'],
+            ['n_chan_mod', 'n_chan_mod']]:
+            extend(key, np.concatenate([
+                np.asarray(getattr(reach, attr)) for reach, reach_id in
+                prd_items])[missing])
+
+        extend('node_indx', prior_node_ids[missing])
+        extend('reach_indx', prior_reach_ids[missing])
+
+        for key in ['nobs', 'nobs_h', 'node_blocked']:
+            extend(key, MISSING_VALUE_INT4)
+
+        for key in [
+            'lat', 'lon', 'x', 'y', 's', 'w_ptp', 'w_std', 'w_area',
+             'w_db', 'area', 'area_u', 'area_det', 'area_det_u',
+             'area_of_ht', 'wse', 'wse_std', 'wse_u', 'rdr_sig0',
+             'rdr_sig0_u', 'latitude_u', 'longitud_u', 'width_u',
+             'geoid_hght', 'solid_tide', 'load_tidef', 'load_tideg',
+             'pole_tide', 'flow_dir', 'dark_frac', 'xtrack',
+             'h_n_ave', 'fit_height']:
+            extend(key, MISSING_VALUE_FLT)
+
+    @staticmethod
+    def add_missing_reaches(reach_outputs, prd_items):
+        """
+        Appends the prior reaches of the (reach, reach_id) prd_items that are
+        not in reach_outputs, with missing values for the observed
+        quantities.
+        """
+        reach_ids = set(reach_outputs['reach_idx'])
+        missing_items = []
+        for reach, reach_id in prd_items:
+            if reach_id not in reach_ids:
+                reach_ids.add(reach_id)
+                missing_items.append((reach, reach_id))
+
+        if len(missing_items) == 0:
+            return
+
+        reaches = [reach for reach, reach_id in missing_items]
+        for key in ['centerline_lon', 'centerline_lat']:
+            reach_outputs[key] = np.array(list(
+                reach_outputs[key])+[reach.metadata[key] for reach in reaches])
+
+        rch_ids_up = [reach.metadata['rch_id_up'].T for reach in reaches]
+        rch_ids_dn = [reach.metadata['rch_id_dn'].T for reach in reaches]
+        reach_outputs['rch_id_up'] = np.concatenate(
+            [reach_outputs['rch_id_up']] + rch_ids_up)
+        reach_outputs['rch_id_dn'] = np.concatenate(
+            [reach_outputs['rch_id_dn']] + rch_ids_dn)
+        reach_outputs['n_reach_up'] = np.append(
+            reach_outputs['n_reach_up'],
+            [(item > 0).sum() for item in rch_ids_up])
+        reach_outputs['n_reach_dn'] = np.append(
+            reach_outputs['n_reach_dn'],
+            [(item > 0).sum() for item in rch_ids_dn])
+        reach_outputs['reach_idx'] = np.append(
+            reach_outputs['reach_idx'],
+            [reach_id for reach, reach_id in missing_items])
+        reach_outputs['p_n_nodes'] = np.append(
+            reach_outputs['p_n_nodes'], [len(reach.x) for reach in reaches])
+
+        for key, metadata_key in [
+            ['p_lon', 'lon'], ['p_lat', 'lat'], ['p_wse', 'wse'],
+            ['p_wse_var', 'wse_var'], ['p_width', 'width'],
+            ['p_wid_var', 'width_var'], ['p_dist_out', 'dist_out'],
+            ['p_length', 'reach_length'], ['grand_id', 'grod_id'],
+            ['n_chan_max', 'n_chan_max'], ['n_chan_mod', 'n_chan_mod']]:
+            reach_outputs[key] = np.append(
+                reach_outputs[key],
+                [reach.metadata[metadata_key] for reach in reaches])
+
+        for key, value in [
+            ['reach_id', MISSING_VALUE_INT9], ['n_good_nod', MISSING_VALUE_INT4],
+            ['lake_flag', MISSING_VALUE_INT4]]:
+            reach_outputs[key] = np.append(
+                reach_outputs[key], [value]*len(reaches))
+
+        for key in ['length', 'node_dist', 'area', 'area_u', 'area_det',
+                    'area_det_u', 'area_of_ht', 'width', 'width_u',
+                    'loc_offset', 'xtrk_dist', 'frac_obs',
+                    'slope', 'height', 'slope_u', 'height_u',
+                    'geoid_slop', 'geoid_hght', 'prior_node_s',
+                    'd_x_area', 'd_x_area_u', 'dark_frac', 'slope2',
+                    'metro_q_c', 'bam_q_c', 'hivdi_q_c', 'momma_q_c',
+                    'sads_q_c', 'metro_q_uc', 'bam_q_uc', 'hivdi_q_uc',
+                    'momma_q_uc', 'sads_q_uc']:
+            reach_outputs[key] = np.append(
+                reach_outputs[key], [MISSING_VALUE_FLT]*len(reaches))
+
+        # TODO: set discharge flags based on ???
+
     @classmethod
     def from_shapes(cls, node_shape_path, reach_shape_path):
         """Constructs self from shapefiles"""
@@ -370,7 +371,10 @@ class L2HRRiverTile(Product):
         self.reaches.uncorrect_tides()
 
     def update_from_pixc(self, pixc_file, index_file):
-        """Adds more datasets from pixc_file file using index_file"""
+        """
+        Adds more datasets from pixc_file file using index_file (or the
+        L2PIXCVector that would be written to it)
+        """
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             self.nodes.update_from_pixc(pixc_file, index_file)
@@ -1472,8 +1476,16 @@ class RiverTileNodes(Product, ShapeWriterMixIn):
             self.load_tidef[mask] + self.pole_tide[mask])
 
     def update_from_pixc(self, pixc_file, index_file):
-        """Adds more datasets from pixc_file file using index_file"""
-        pixc_vec = L2PIXCVector.from_ncfile(index_file)
+        """
+        Adds more datasets from pixc_file file using index_file (or the
+        L2PIXCVector that would be written to it)
+        """
+        if isinstance(index_file, L2PIXCVector):
+            pixc_vec = index_file
+        else:
+            pixc_vec = L2PIXCVector.from_ncfile(
+                index_file,
+                variables=['azimuth_index', 'pixc_index', 'node_id'])
 
         pixc2rivertile_map = {
             '/pixel_cloud/model_dry_tropo_cor': 'dry_trop_c',
@@ -1484,12 +1496,20 @@ class RiverTileNodes(Product, ShapeWriterMixIn):
             '/tvp/time': 'time',
             '/tvp/time_tai': 'time_tai'}
 
+        # only read the span of pixels / lines used by pixc_vec
+        pixc_indices = {
+            'pixel_cloud': np.ma.getdata(pixc_vec.pixc_index),
+            'tvp': np.ma.getdata(pixc_vec.azimuth_index)}
+        spans = {
+            group: slice(index.min(), index.max()+1) if len(index) > 0
+            else slice(0, 0) for group, index in pixc_indices.items()}
+
         pixc_data = {}
         with netCDF4.Dataset(pixc_file, 'r') as ifp:
             for key in pixc2rivertile_map:
                 group, dset = key.split('/')[1::]
                 try:
-                    pixc_data[key] = ifp.groups[group][dset][:]
+                    pixc_data[key] = ifp.groups[group][dset][spans[group]]
                 except IndexError:
                     pass
             for attr in ATTRS_2COPY_FROM_PIXC:
@@ -1499,25 +1519,34 @@ class RiverTileNodes(Product, ShapeWriterMixIn):
                     value = getattr(ifp.groups['pixel_cloud'], attr, 'None')
                 self[attr] = value
 
+        # group the pixels by node once for all of the datasets
+        pixc_node_ids, pixc_groups = aggregate.get_groups(
+            np.ma.getdata(pixc_vec.node_id))
+        node_index, has_pixels = aggregate.get_feature_index(
+            pixc_node_ids, self.node_id)
+
         for inkey, outkey in pixc2rivertile_map.items():
             # subset pixel cloud data to look like pixcvec data
-            if inkey.split('/')[1] == 'tvp':
+            group = inkey.split('/')[1]
+            if group == 'tvp':
                 # silly hack
-                subdata = pixc_data[inkey][pixc_vec.azimuth_index]
+                subdata = pixc_data[inkey][
+                    pixc_indices[group]-spans[group].start]
             else:
                 try:
-                    subdata = pixc_data[inkey][pixc_vec.pixc_index]
+                    subdata = pixc_data[inkey][
+                        pixc_indices[group]-spans[group].start]
                 except KeyError:
                     pass
 
-            # index into pixcvec shaped data
-            outdata = np.ones(self[outkey].shape)
-            for node_id in self.node_id:
-                pixc_mask = pixc_vec.node_id == node_id
-                out_mask = self.node_id == node_id
+            # mean of the (unmasked) pixels of each node
+            # TBD some other operation than mean (median?)
+            node_means, _ = aggregate.group_mean(
+                subdata, pixc_groups, len(pixc_node_ids))
 
-                # TBD some other operation than mean (median?)
-                outdata[out_mask] = np.mean(subdata[pixc_mask])
+            # index into pixcvec shaped data
+            outdata = np.full(self[outkey].shape, np.nan)
+            outdata[has_pixels] = node_means[node_index[has_pixels]]
 
             # replace NaNs with _FillValue
             outdata[np.isnan(outdata)] = self.VARIABLES[outkey]['_FillValue']
@@ -1527,11 +1556,7 @@ class RiverTileNodes(Product, ShapeWriterMixIn):
 
     def __add__(self, other):
         """Adds other to self"""
-        klass = RiverTileNodes()
-        for key in klass.VARIABLES:
-            setattr(klass, key, np.concatenate((
-                getattr(self, key), getattr(other, key))))
-        return klass
+        return RiverTileNodes.concatenate([self, other])
 
 class RiverTileReaches(Product, ShapeWriterMixIn):
 
@@ -3131,18 +3156,27 @@ class RiverTileReaches(Product, ShapeWriterMixIn):
         node_reach_ids = (
             np.floor(nodes.node_id / 10000).astype('int'))*10 + node_reach_type
 
+        # group the nodes by reach once for all of the keys
+        node_reach_ids, node_groups = aggregate.get_groups(
+            np.ma.getdata(node_reach_ids))
+        reach_index, has_nodes = aggregate.get_feature_index(
+            node_reach_ids, self.reach_id)
+
         for key in keys:
             node_value = getattr(nodes, key)
             reach_value = getattr(self, key)
-            for ii, reach_id in enumerate(self.reach_id):
-                reach_value[ii] = np.mean(
-                    node_value[node_reach_ids == reach_id])
+
+            # mean of the (unmasked) nodes of each reach, NaN if no nodes
+            # and masked if no unmasked nodes
+            reach_means, num_valid = aggregate.group_mean(
+                node_value, node_groups, len(node_reach_ids))
+            values = np.full(reach_value.shape, np.nan)
+            values[has_nodes] = reach_means[reach_index[has_nodes]]
+            mask = np.zeros(reach_value.shape, dtype=bool)
+            mask[has_nodes] = num_valid[reach_index[has_nodes]] == 0
+            reach_value[:] = np.ma.masked_array(values, mask=mask)
             self[key] = reach_value
 
     def __add__(self, other):
         """Adds other to self"""
-        klass = RiverTileReaches()
-        for key in klass.VARIABLES:
-            setattr(klass, key, np.concatenate((
-                getattr(self, key), getattr(other, key))))
-        return klass
+        return RiverTileReaches.concatenate([self, other])
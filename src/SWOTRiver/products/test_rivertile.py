@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+import pytest
+import numpy as np
+
+from SWOTRiver.products.rivertile import L2HRRiverTile
+
+def write_rivertile(filename):
+    rivertile = L2HRRiverTile()
+    rivertile.nodes.node_id = np.array([30, 10, 20], dtype='i8')
+    rivertile.nodes.reach_id = np.array([3, 1, 2], dtype='i8')
+    rivertile.reaches.reach_id = np.array([3, 1, 2], dtype='i8')
+    rivertile.reaches.p_length = np.array([300., 100., 200.])
+    rivertile.to_ncfile(filename)
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_sort(tmp_path, lazy):
+    filename = str(tmp_path / 'rivertile.nc')
+    write_rivertile(filename)
+    rivertile = L2HRRiverTile.from_ncfile(filename, lazy=lazy)
+    # only the ids are read before sorting a lazy product
+    rivertile.nodes.node_id
+    rivertile.reaches.reach_id
+    rivertile.sort()
+    np.testing.assert_array_equal(rivertile.nodes.node_id, [10, 20, 30])
+    np.testing.assert_array_equal(rivertile.nodes.reach_id, [1, 2, 3])
+    np.testing.assert_array_equal(rivertile.reaches.p_length, [100, 200, 300])
+
+    sorted_filename = str(tmp_path / 'sorted.nc')
+    rivertile.to_ncfile(sorted_filename)
+    rivertile = L2HRRiverTile.from_ncfile(sorted_filename)
+    np.testing.assert_array_equal(rivertile.nodes.reach_id, [1, 2, 3])
+    np.testing.assert_array_equal(rivertile.reaches.reach_id, [1, 2, 3])
+    np.testing.assert_array_equal(rivertile.reaches.p_length, [100, 200, 300])
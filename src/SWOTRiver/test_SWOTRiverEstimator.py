@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import pytest
+import numpy as np
+import scipy.ndimage
+
+from SWOTRiver.SWOTRiverEstimator import nanmedian_filter, segment_pixels
+
+def reference_segmentation(img_y, img_x, is_water, dilation_iter=0):
+    """The segmentation of the full image that segment_pixels replaced"""
+    cls_img = np.zeros((np.max(img_y) + 1, np.max(img_x) + 1))
+    cls_img[img_y, img_x] = is_water
+    if dilation_iter > 0:
+        cls_tmp = np.zeros(cls_img.shape)
+        cls_tmp[img_y, img_x] = 1
+        cls_tmp = scipy.ndimage.binary_dilation(
+            cls_tmp, iterations=dilation_iter)
+        cls_img[cls_tmp == 1] = 1
+    lbl, nlbl = scipy.ndimage.label(cls_img)
+    lbl2 = scipy.ndimage.grey_dilation(lbl, 3)
+    lbl_out = lbl.copy()
+    lbl_out[lbl == 0] = lbl2[lbl == 0]
+    return lbl_out[img_y, img_x]
+
+@pytest.fixture(scope='module')
+def pixels():
+    rng = np.random.RandomState(0)
+    image = rng.rand(60, 40) < 0.5
+    img_y, img_x = np.nonzero(rng.rand(60, 40) < 0.6)
+    return img_y, img_x, image[img_y, img_x]
+
+@pytest.mark.parametrize('dilation_iter', [0, 1, 2])
+def test_segment_pixels(pixels, dilation_iter):
+    img_y, img_x, is_water = pixels
+    labels = segment_pixels(img_y, img_x, is_water, dilation_iter)
+    np.testing.assert_array_equal(labels, reference_segmentation(
+        img_y, img_x, is_water, dilation_iter))
+
+def test_segment_pixels_no_water(pixels):
+    img_y, img_x, is_water = pixels
+    labels = segment_pixels(img_y, img_x, np.zeros(is_water.shape))
+    assert np.all(labels == 0)
+
+def test_segment_pixels_repeated():
+    # the last of repeated pixels sets the class of the cell
+    img_y = np.array([0, 0, 0, 2, 2])
+    img_x = np.array([0, 1, 1, 2, 2])
+    is_water = np.array([1, 0, 1, 1, 0])
+    np.testing.assert_array_equal(
+        segment_pixels(img_y, img_x, is_water),
+        reference_segmentation(img_y, img_x, is_water))
+
+@pytest.mark.parametrize('chunk_size', [7, 100000])
+def test_nanmedian_filter(chunk_size):
+    rng = np.random.RandomState(0)
+    image = rng.randn(30, 20)
+    image[rng.rand(30, 20) < 0.3] = np.nan
+    # a window with no values
+    image[10:21, 5:16] = np.nan
+    rows, cols = np.nonzero(rng.rand(30, 20) < 0.5)
+    rows, cols = np.append(rows, 15), np.append(cols, 10)
+
+    with np.errstate(invalid='ignore'), pytest.warns(RuntimeWarning):
+        desired = scipy.ndimage.generic_filter(image, np.nanmedian, size=11)
+    medians = nanmedian_filter(image, rows, cols, chunk_size=chunk_size)
+    np.testing.assert_allclose(medians, desired[rows, cols], rtol=1e-12)
+    assert np.isnan(medians[-1])
+
+def test_nanmedian_filter_no_pixels():
+    assert len(nanmedian_filter(np.zeros((5, 5)), [], [])) == 0
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+import types
+import pytest
+import numpy as np
+
+import SWOTRiver.discharge as discharge
+from RiverObs.RiverObs import MISSING_VALUE_FLT
+
+def reference_area(observed_height, observed_width, area_fits):
+    """
+    Cross-sectional area of one reach, as CalculatedAEIV.m (the scalar
+    implementation that area_arrays replaced).
+    """
+    height_breakpoints = np.squeeze(area_fits['h_break'])
+    poly_fits = list(np.squeeze(area_fits['fit_coeffs']).T)
+    area_median_flow = np.squeeze(area_fits['med_flow_area'])
+    fit_width_var = np.squeeze(area_fits['w_err_stdev'])**2
+    fit_height_var = np.squeeze(area_fits['h_err_stdev'])**2
+    height_var = np.squeeze(area_fits['h_variance'])
+    poly_ints = np.array([np.polyint(item) for item in poly_fits])
+
+    height_fits_ll = height_breakpoints[0:-1]
+    height_fits_ul = height_breakpoints[1:]
+    ifit = np.argwhere(np.logical_and(
+        observed_height >= height_fits_ll, observed_height < height_fits_ul))
+    low_height_snr = (height_var - fit_height_var)/fit_height_var < 2
+
+    if ifit.size == 0:
+        observed_height_hat = np.nan
+        observed_width_hat = observed_width
+        if observed_height > height_breakpoints.max():
+            delta_area_hat = (
+                np.polyval(poly_ints[-1], height_breakpoints[-1]) -
+                np.polyval(poly_ints[-1], height_breakpoints[-2]) +
+                area_median_flow)
+            dAunc = np.sqrt(
+                fit_height_var*observed_width**2 +
+                2*fit_width_var*(observed_height-height_breakpoints[-1])**2)
+        else:
+            delta_area_hat = (
+                - area_median_flow - ((height_breakpoints[0]-observed_height)
+                * (observed_width + poly_fits[0][0]*height_breakpoints[0]
+                + poly_fits[0][1])/2))
+            dAunc = np.sqrt(
+                fit_height_var*observed_width**2 +
+                2*fit_width_var*(observed_height-height_breakpoints[0])**2)
+        return delta_area_hat, observed_width_hat, observed_height_hat, dAunc
+
+    ifit = ifit[0][0]
+    if low_height_snr:
+        observed_height_hat = observed_height
+    else:
+        observed_height_hat = discharge.estimate_height(
+            observed_width, observed_height, poly_fits[ifit], fit_width_var,
+            fit_height_var)
+    ifit_hat = np.argwhere(np.logical_and(
+        observed_height_hat >= height_fits_ll,
+        observed_height_hat < height_fits_ul))
+    if ifit_hat.size > 0:
+        ifit = ifit_hat[0][0]
+        observed_height_hat = discharge.estimate_height(
+            observed_width, observed_height, poly_fits[ifit], fit_width_var,
+            fit_height_var)
+    if low_height_snr:
+        observed_width_hat = observed_width
+    else:
+        observed_width_hat = np.polyval(poly_fits[ifit], observed_height_hat)
+
+    delta_area_hat = 0
+    for poly_int, height_ll, height_ul in zip(
+            poly_ints[:ifit+1], height_fits_ll[:ifit+1],
+            height_fits_ul[:ifit+1]):
+        delta_area_hat += (
+            np.polyval(poly_int, np.min([observed_height_hat, height_ul])) -
+            np.polyval(poly_int, height_ll))
+    delta_area_hat -= area_median_flow
+
+    if poly_fits[ifit][0] == 0:
+        dAunc = poly_fits[ifit][1] * np.sqrt(fit_height_var)
+    else:
+        mu = (np.sqrt(poly_fits[ifit][0]/2) * (
+            observed_height_hat - height_fits_ul[ifit]) + np.polyval(
+                poly_fits[ifit], height_fits_ul[ifit]) / np.sqrt(
+                    2 * poly_fits[ifit][0]))
+        sigma = np.sqrt(poly_fits[ifit][0]/2) * np.sqrt(fit_height_var)
+        dAunc = np.sqrt(4*mu**2*sigma**2 + 2*sigma**4)
+    return delta_area_hat, observed_width_hat, observed_height_hat, dAunc
+
+def make_reach(rng):
+    """A reach with random prior db area fits and discharge models"""
+    coeffs = np.stack([rng.uniform(0, 0.5, 3), rng.uniform(-1, 5, 3),
+                       rng.uniform(-10, 50, 3)])
+    if rng.rand() < 0.2:
+        coeffs[0, :] = 0
+    area_fits = {
+        'h_break': np.sort(rng.uniform(0, 20, 4))[:, np.newaxis],
+        'fit_coeffs': coeffs[:, :, np.newaxis],
+        'h_variance': rng.uniform(0, 3, 1),
+        'w_variance': rng.uniform(0, 1, 1),
+        'hw_covariance': rng.uniform(0, 1, 1),
+        'med_flow_area': rng.uniform(0, 100, 1),
+        'h_err_stdev': rng.uniform(0.1, 1, 1),
+        'w_err_stdev': rng.uniform(0, 10, 1),
+        'h_w_nobs': np.array([10])}
+
+    def models():
+        return {
+            'MetroMan': {'ninf': rng.uniform(-0.1, 1, 1),
+                         'Abar': rng.uniform(-50, 500, 1),
+                         'p': rng.uniform(-1, 1, 1)},
+            'BAM': {'Abar': rng.uniform(-50, 500, 1),
+                    'n': rng.uniform(-0.1, 1, 1)},
+            'HiVDI': {'Abar': rng.uniform(-50, 500, 1),
+                      'alpha': rng.uniform(-0.1, 10, 1),
+                      'beta': rng.uniform(-1, 1, 1)},
+            'MOMMA': {'B': rng.uniform(-5, 10, 1),
+                      'H': rng.uniform(0, 25, 1),
+                      'Save': rng.uniform(-0.1, 1, 1)},
+            'SADS': {'Abar': rng.uniform(-50, 500, 1),
+                     'n': rng.uniform(-0.1, 1, 1)}}
+
+    return types.SimpleNamespace(metadata={
+        'area_fits': area_fits,
+        'discharge_models': {
+            'constrained': models(), 'unconstrained': models()}})
+
+@pytest.fixture(scope='module')
+def reaches():
+    rng = np.random.RandomState(0)
+    reaches = [make_reach(rng) for ii in range(300)]
+    heights = rng.uniform(-5, 25, len(reaches))
+    heights[:5] = np.nan
+    widths = rng.uniform(-5, 200, len(reaches))
+    slopes = rng.uniform(-1e-4, 1e-3, len(reaches))
+    return reaches, heights, widths, slopes
+
+def test_area(reaches):
+    reaches, heights, widths, _ = reaches
+    with np.errstate(invalid='ignore'):
+        for reach, height, width in zip(reaches, heights, widths):
+            area_fits = reach.metadata['area_fits']
+            np.testing.assert_allclose(
+                discharge.area(height, width, area_fits),
+                reference_area(height, width, area_fits), rtol=1e-12)
+
+def test_compute_arrays(reaches):
+    reaches, heights, widths, slopes = reaches
+    outputs = discharge.compute_reaches(reaches, heights, widths, slopes)
+    for ii, reach in enumerate(reaches):
+        with np.errstate(invalid='ignore'):
+            d_x_area = reference_area(
+                heights[ii], widths[ii], reach.metadata['area_fits'])[0]
+        if d_x_area < -10000000:
+            d_x_area = MISSING_VALUE_FLT
+        np.testing.assert_allclose(outputs['d_x_area'][ii], d_x_area)
+
+        # the same as one reach at a time
+        reach_outputs = discharge.compute(
+            reach, heights[ii], widths[ii], slopes[ii])
+        for key, value in reach_outputs.items():
+            np.testing.assert_allclose(outputs[key][ii], value, rtol=1e-12)
+
+        # Manning's equation of the BAM model
+        models = reach.metadata['discharge_models']['constrained']
+        bam_Abar = models['BAM']['Abar'][0]
+        bam_n = models['BAM']['n'][0]
+        if (widths[ii] > 0 and slopes[ii] > 0 and bam_Abar+d_x_area >= 0 and
+                bam_Abar > 0 and bam_n > 0):
+            bam_q = ((d_x_area+bam_Abar)**(5/3) * widths[ii]**(-2/3) *
+                     slopes[ii]**(1/2)) / bam_n
+        else:
+            bam_q = MISSING_VALUE_FLT
+        np.testing.assert_allclose(outputs['bam_q_c'][ii], bam_q, rtol=1e-12)
+
+def test_compute_masked():
+    # masked prior db values give missing discharges
+    reach = make_reach(np.random.RandomState(1))
+    for models in reach.metadata['discharge_models'].values():
+        for model in models.values():
+            for key in model:
+                model[key] = np.ma.masked_array(model[key], mask=True)
+    outputs = discharge.compute(reach, 10., 100., 1e-4)
+    for key in ['metro_q_c', 'bam_q_c', 'hivdi_q_c', 'momma_q_c', 'sads_q_c',
+                'metro_q_uc', 'bam_q_uc', 'hivdi_q_uc', 'momma_q_uc',
+                'sads_q_uc']:
+        assert outputs[key] == MISSING_VALUE_FLT
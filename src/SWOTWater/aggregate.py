@@ -473,3 +473,484 @@ def flatten_interferogram(
 
     return interferogram_flatten
 
+
+def get_groups(feature_id):
+    """
+    Return the unique feature ids and the index of each pixel's feature
+    in them (i.e., np.unique with return_inverse).
+    """
+    features, groups = np.unique(np.asarray(feature_id), return_inverse=True)
+    return features, groups.ravel()
+
+def group_sum(in_var, groups, num_features, mask=None):
+    """
+    Sum in_var over the pixels of each feature (with mask, only over the
+    pixels where mask is True).
+    """
+    in_var = np.broadcast_to(in_var, np.shape(groups))
+    if mask is not None:
+        in_var = in_var[mask]
+        groups = groups[mask]
+    return np.bincount(groups, weights=in_var, minlength=num_features)
+
+def group_mean(in_var, groups, num_features):
+    """
+    Mean of the unmasked values of in_var over the pixels of each feature
+    (nan for features with no unmasked values). Also returns the number of
+    unmasked values of each feature.
+    """
+    is_valid = ~np.ma.getmaskarray(in_var)
+    num_valid = np.bincount(groups[is_valid], minlength=num_features)
+    out_var = np.full(num_features, np.nan)
+    some = num_valid > 0
+    out_var[some] = group_sum(
+        np.ma.getdata(in_var).astype(np.float64), groups, num_features,
+        is_valid)[some] / num_valid[some]
+    return out_var, num_valid
+
+def get_feature_index(features, out_feature_id):
+    """
+    Return the index of each of out_feature_id in the (sorted, unique)
+    features from get_groups, and whether it is in them at all (index is 0
+    where it is not).
+    """
+    out_feature_id = np.ma.getdata(out_feature_id)
+    if len(features) == 0:
+        return (np.zeros(np.shape(out_feature_id), dtype=int),
+                np.zeros(np.shape(out_feature_id), dtype=bool))
+    index = np.searchsorted(features, out_feature_id)
+    index[index == len(features)] = 0
+    return index, features[index] == out_feature_id
+
+def group_median(in_var, groups, num_features):
+    """
+    Median of in_var over the pixels of each feature, as np.median (nan
+    for features with no pixels or with nan values).
+    """
+    in_var = np.asarray(in_var, dtype=np.float64)
+    isort = np.lexsort((in_var, groups))
+    in_var, groups = in_var[isort], groups[isort]
+    count = np.bincount(groups, minlength=num_features)
+    start = np.cumsum(count) - count
+
+    out_var = np.full(num_features, np.nan)
+    some = count > 0
+    lower = in_var[(start + (count - 1) // 2)[some]]
+    upper = in_var[(start + count // 2)[some]]
+    out_var[some] = np.where(count[some] % 2 == 1, upper, (lower + upper)/2.)
+    out_var[group_sum(np.isnan(in_var), groups, num_features) > 0] = np.nan
+    return out_var
+
+def group_mode(in_var, groups, num_features):
+    """
+    Most common value of in_var for each feature (the smallest one for
+    ties, as scipy.stats.mode; nan for features with no pixels).
+    """
+    in_var = np.asarray(in_var)
+    isort = np.lexsort((in_var, groups))
+    in_var, groups = in_var[isort], groups[isort]
+
+    # runs of equal values within each feature
+    new_run = np.ones(len(in_var), dtype=bool)
+    new_run[1:] = np.logical_or(
+        in_var[1:] != in_var[:-1], groups[1:] != groups[:-1])
+    run_start = np.flatnonzero(new_run)
+    run_length = np.diff(np.append(run_start, len(in_var)))
+    run_group = groups[run_start]
+
+    # longest run of each feature, first (smallest value) for ties
+    iorder = np.lexsort((-run_length, run_group))
+    first = np.ones(len(iorder), dtype=bool)
+    first[1:] = run_group[iorder][1:] != run_group[iorder][:-1]
+
+    out_var = np.full(num_features, np.nan)
+    out_var[run_group[iorder][first]] = in_var[run_start[iorder][first]]
+    return out_var
+
+def simple_grouped(in_var, feature_id, metric='mean'):
+    """
+    Aggregate the input variable according to desired metric/accumulator,
+    for every feature at once.
+
+    INPUT:
+    in_var     = 1d array of a given variable for all pixels of all
+                 features (river nodes, raster bins, lakes)
+    feature_id = 1d array with the feature of each pixel
+
+    OUTPUT:
+    out_var = array of the aggregated variable for each feature, in the
+              order of np.unique(feature_id)
+    """
+    features, groups = get_groups(feature_id)
+    num_features = len(features)
+    in_var = np.asarray(in_var)
+    num_pixels = np.bincount(groups, minlength=num_features).astype(float)
+    if metric == 'mean':
+        out_var = group_sum(in_var, groups, num_features)/num_pixels
+    elif metric == 'median':
+        out_var = group_median(in_var, groups, num_features)
+    elif metric == 'sum':
+        out_var = group_sum(in_var, groups, num_features)
+    elif metric == 'std':
+        mean = group_sum(in_var, groups, num_features)/num_pixels
+        out_var = np.sqrt(group_sum(
+            (in_var - mean[groups])**2, groups, num_features)/num_pixels)
+    elif metric == 'count':
+        out_var = num_pixels
+    elif metric == 'mode':
+        out_var = group_mode(in_var, groups, num_features)
+    return out_var
+
+def height_only_grouped(
+        feature_id, height, good, height_std=1.0, method='weight'):
+    """
+    Return the aggregate height of every feature at once, as height_only
+
+    INPUTS:
+    feature_id  = 1d array with the feature of each pixel
+    (others as in height_only)
+
+    OUTPUTS:
+    height_out  = aggregated height of each feature, in the order of
+                  np.unique(feature_id)
+    weight_norm = normalized weighting array (for each pixel)
+    """
+    features, groups = get_groups(feature_id)
+    num_features = len(features)
+    num_pixels = np.bincount(
+        groups[good], minlength=num_features).astype(float)
+    if method == 'median':
+        # for median, use uniform weighting for uncertainty estimation later
+        height_agg = group_median(height[good], groups[good], num_features)
+        weight = np.ones(np.shape(height))
+        return height_agg, weight/num_pixels[groups]
+    elif method == 'uniform':
+        weight = np.ones(np.shape(height))
+    elif method == 'weight':
+        # inverse height variance weighting
+        weight = np.ones(np.shape(height))/(height_std)**2
+    else:
+        raise Exception("Unknown height aggregation method: {}".format(method))
+
+    height_agg = group_sum(weight*height, groups, num_features, good)
+    weight_sum = group_sum(weight, groups, num_features, good)
+
+    weight_sum_pixc = np.ones(np.shape(weight))
+    weight_sum_pixc[good] = weight_sum[groups[good]]
+
+    height_out = height_agg/weight_sum
+    weight_norm = weight/weight_sum_pixc
+    return height_out, weight_norm
+
+def height_uncert_std_grouped(
+        feature_id, height, good, num_rare_looks, num_med_looks,
+        height_std=1.0, method='weight'):
+    """
+    Compute the scaled sample standard deviation of the heights of every
+    feature at once, as height_uncert_std
+    """
+    features, groups = get_groups(feature_id)
+    num_features = len(features)
+
+    weight = np.ones(np.shape(height))# default to uniform
+    if method == 'weight':
+        weight = np.ones(np.shape(height))/(height_std)**2
+    height_agg = group_sum(weight*height, groups, num_features, good)
+    weight_sum = group_sum(weight, groups, num_features, good)
+    height_mean = height_agg/weight_sum
+    height_agg2 = group_sum(
+        weight*(height-height_mean[groups])**2.0, groups, num_features, good)
+    h_std = np.sqrt(height_agg2/weight_sum)
+
+    num_pixels = np.bincount(
+        groups[good], minlength=num_features).astype(float)
+    # num_med_looks is rare_looks*num_pix_in_adaptive_window,
+    # so need to normalize out rare to get number of independent pixels
+    num_ind_pixels = group_sum(
+        num_med_looks/num_rare_looks, groups, num_features, good)/num_pixels
+    height_std_out = h_std * np.sqrt(num_ind_pixels/num_pixels)
+    return height_std_out
+
+def height_uncert_multilook_grouped(
+        feature_id, ifgram, power1, power2, weight_norm, good, num_rare_looks,
+        looks_to_efflooks, dh_dphi, dlat_dphi, dlon_dphi):
+    """
+    compute height uncertainty bound by multilooking every feature at once,
+    as height_uncert_multilook
+
+    OUTPUTS:
+    height_uncert_out, lat_uncert_out, lon_uncert_out = uncertainties of
+        each feature, in the order of np.unique(feature_id)
+    """
+    features, groups = get_groups(feature_id)
+    num_features = len(features)
+    num_pixels = np.bincount(
+        groups[good], minlength=num_features).astype(float)
+
+    def agg_mean(in_var):
+        return group_sum(in_var, groups, num_features, good)/num_pixels
+
+    # multilook the rare interferogram over the feature
+    #  by averaging cerain fields
+    agg_real = agg_mean(np.real(ifgram)*weight_norm)
+    agg_imag = agg_mean(np.imag(ifgram)*weight_norm)
+    agg_p1 = agg_mean(power1*weight_norm)
+    agg_p2 = agg_mean(power2*weight_norm)
+
+    # compute coherence
+    coh = abs(agg_real + 1j *agg_imag)/np.sqrt(agg_p1*agg_p2)
+
+    # get total num_eff_looks
+    rare_looks = num_rare_looks#/looks_to_efflooks
+    agg_looks = agg_mean(rare_looks)
+
+    num_looks = agg_looks * num_pixels
+
+    # get phase noise variance using CRB
+    phase_var = (0.5 / num_looks) * (1.0-coh**2)/(coh**2)
+    agg_dh_dphi = agg_mean(dh_dphi*weight_norm)
+    agg_dh_dphi2 = agg_mean(dh_dphi**2*weight_norm)
+
+    agg_dlat_dphi = agg_mean(dlat_dphi*weight_norm)
+    agg_dlat_dphi2 = agg_mean(dlat_dphi**2*weight_norm)
+
+    agg_dlon_dphi = agg_mean(dlon_dphi*weight_norm)
+    agg_dlon_dphi2 = agg_mean(dlon_dphi**2*weight_norm)
+
+    height_uncert_out = np.sqrt(phase_var) * np.abs(agg_dh_dphi2/agg_dh_dphi)
+    lat_uncert_out = np.sqrt(phase_var) * np.abs(agg_dlat_dphi2/agg_dlat_dphi)
+    lon_uncert_out = np.sqrt(phase_var) * np.abs(agg_dlon_dphi2/agg_dlon_dphi)
+    return height_uncert_out, lat_uncert_out, lon_uncert_out
+
+def height_with_uncerts_grouped(
+        feature_id, height, good, num_rare_looks, num_med_looks,
+        ifgram, power1, power2, look_to_efflooks, dh_dphi,
+        dlat_dphi, dlon_dphi, height_std=1.0, method='weight'):
+    """
+    Return the aggregate height with corresponding uncertainty of every
+    feature at once, as height_with_uncerts. Outputs are arrays in the
+    order of np.unique(feature_id).
+    """
+    # first aggregate the heights
+    height_out, weight_norm = height_only_grouped(
+        feature_id, height, good, height_std=height_std, method=method)
+
+    # now compute uncertainties
+    height_std_out = height_uncert_std_grouped(
+        feature_id, height, good, num_rare_looks, num_med_looks,
+        height_std=height_std, method=method)
+
+    height_uncert_out, lat_uncert_out, lon_uncert_out = \
+        height_uncert_multilook_grouped(
+            feature_id, ifgram, power1, power2, weight_norm, good,
+            num_rare_looks, look_to_efflooks, dh_dphi, dlat_dphi, dlon_dphi)
+
+    return (height_out, height_std_out, height_uncert_out, lat_uncert_out,
+            lon_uncert_out)
+
+def area_only_grouped(
+        feature_id, pixel_area, water_fraction, klass, good,
+        interior_water_klass=4, water_edge_klass=3, land_edge_klass=2,
+        method='composite'):
+    """
+    Return the aggregate area of every feature at once, as area_only.
+    Outputs are arrays in the order of np.unique(feature_id).
+    """
+    features, groups = get_groups(feature_id)
+    num_features = len(features)
+
+    def agg_sum(in_var):
+        return group_sum(in_var, groups, num_features, good)
+
+    Idw_in = np.zeros(np.shape(pixel_area))
+    Idw_in[klass == interior_water_klass] = 1.0
+
+    Idw = np.zeros(np.shape(pixel_area))
+    Idw[klass == interior_water_klass] = 1.0
+    Idw[klass == water_edge_klass] = 1.0
+
+    Ide = np.zeros(np.shape(pixel_area))
+    Ide[klass == water_edge_klass] = 1.0
+    Ide[klass == land_edge_klass] = 1.0
+
+    I = np.zeros(np.shape(pixel_area))
+    I[(Idw + Idw_in+ Ide) > 0] = 1.0 #all pixels near water
+
+    if method == 'simple':
+        area_agg = agg_sum(pixel_area * Idw)
+        num_pixels = agg_sum(Idw)
+    elif method == 'water_fraction':
+        area_agg = agg_sum(pixel_area * water_fraction * I)
+        num_pixels = agg_sum(I)
+    elif method == 'composite':
+        area_agg_in = agg_sum(pixel_area * Idw_in)
+        area_agg_edge = agg_sum(pixel_area * water_fraction * Ide)
+        area_agg = area_agg_in + area_agg_edge
+        num_pixels = agg_sum(Idw_in + Ide)
+    else:
+        raise Exception("Unknown area aggregation method: {}".format(method))
+    return area_agg, num_pixels
+
+def area_uncert_grouped(
+    feature_id, pixel_area, water_fraction, water_fraction_uncert,
+    darea_dheight, klass, Pfd, Pmd, good, Pca=0.9, Pw=0.5,Ptf=0.5,
+    ref_dem_std=10, interior_water_klass=4, water_edge_klass=3,
+    land_edge_klass=2, method='composite'):
+    '''
+    Area uncertainty of every feature at once, as area_uncert. Output is an
+    array in the order of np.unique(feature_id).
+    '''
+    features, groups = get_groups(feature_id)
+    num_features = len(features)
+
+    def agg_sum(in_var, mask=good):
+        return group_sum(in_var, groups, num_features, mask)
+
+    # get indicator functions
+    Ide = np.zeros(np.shape(pixel_area))
+    Ide[klass == water_edge_klass] = 1.0
+    Ide[klass == land_edge_klass] = 1.0
+    Pe = Ide # use detected edge asprobablity of true edge pixels...
+
+    I = np.zeros(np.shape(pixel_area))
+    I[Ide > 0] = 1.0
+    I[klass == interior_water_klass] = 1.0 #all pixels near water
+
+    # get false and missed assignment rates from correct assignment rate
+    Pfa = 1 - Pca
+    Pma = 1 - Pca
+
+    # get the assignment rates, bias and variance
+    Pf = Pca * Ptf + Pfa *(1-Ptf)
+    Bf = Pfa * (1-Ptf) - Pma * Pf
+    Vf = Pfa*(1-Ptf) + Pma * Pf
+
+    # handle pixel size uncertainty
+    sigma_a = darea_dheight*ref_dem_std*pixel_area #0.05* pixel_area
+
+    # handle the sampling error
+    sigma_s2 = 1.0/12.0
+
+    # get detection rates
+    if method == 'simple' or method == 'composite':
+        Pcd = 1 - Pmd
+        Pdw = Pcd*Pw + Pfd*(1-Pw)
+
+        Vdw = (Pfd*(1-Pw)+Pmd*Pw)
+        V_dwf = (Pf*Vdw+Pw*Vf - 2*Pmd*Pw*Pfa*(1-Ptf))
+
+        # get the aggregate sampling error
+        # first term in Eq. 18  using Pe = Ie
+        var_samp_bar = agg_sum(pixel_area**2.0 * sigma_s2 * Pe * Ptf)
+
+        # handle the case where there are no edge pixels...
+        num_pixels_edge = agg_sum(Pe)
+        var_samp_bar[num_pixels_edge == 0] = 0
+
+        # the area uncertainty to be aggregated (2nd term in Eq. 12)
+        var_pix_area_dw = sigma_a**2 * Pdw * Pf
+        var_pix_area_dw_bar = agg_sum(var_pix_area_dw*I)
+
+        # the detection and assignement rate uncertainty to be aggregated
+        # 3rd term in Eq. 12
+        var_area_dw = pixel_area**2 * V_dwf
+        var_area_dw_bar = agg_sum(var_area_dw * I)
+
+        # aggregate bias term (last term in Eq. 12)
+        Bdw = Pfd * (1-Pw) - Pmd * Pw
+        Bdwf = Bdw * Ptf + Pw * Bf
+
+        Bdwf_bar = agg_sum(pixel_area * Bdwf * I)
+        Bdwf2_bar = agg_sum(pixel_area**2 * Bdwf**2 * I)
+        B_term_dw = Bdwf_bar**2 - Bdwf2_bar #
+        # sqrt of Eq. 12, std_dw = sigma_{A_f}
+        std_dw = np.sqrt(
+            var_samp_bar + var_pix_area_dw_bar + var_area_dw_bar + B_term_dw)
+
+    if method == 'water_fraction' or method == 'composite':
+        # use water_fraction (only for edge pixels if composite)
+        # implements Eq. 26
+        alpha2 = water_fraction_uncert
+        alpha = water_fraction
+
+        sig_alpha2 = alpha2**2
+        alpha_t = alpha
+
+        Valpha=(sig_alpha2*Pf + alpha_t**2*Vf)
+        var_area_alpha = pixel_area**2 * Valpha
+        # 2nd term in Eq. 26
+        var_area_alpha_bar = agg_sum(var_area_alpha*I)
+
+        var_pix_area_alpha = sigma_a**2 * (sig_alpha2 + alpha**2) * Pf
+        # 1st term in Eq. 26
+        var_pix_area_alpha_bar = agg_sum(var_pix_area_alpha*I)
+
+        B_tmp = pixel_area*alpha_t*Bf
+        Balphaf_bar = agg_sum(B_tmp * I)
+        Balphaf2_bar = agg_sum(B_tmp**2 * I)
+
+        # 3rd term in Eq 26
+        B_term_alpha = Balphaf_bar**2 - Balphaf2_bar
+        # sqrt of Eq. 26, std_alpha = sigma_{A_f,alpha}
+        std_alpha = np.sqrt(
+            var_area_alpha_bar + var_pix_area_alpha_bar +
+            B_term_alpha)#/abs(area_bar)
+
+    if method == 'composite':
+        # assume that Pde is constant over each feature
+        N_edges = agg_sum(Ide, mask=None)
+        N_tot = agg_sum(I, mask=None)
+        Pde = np.zeros(num_features)
+        some = N_edges != 0
+        Pde[some] = np.minimum(N_edges[some]/N_tot[some], 1)
+        Pde_x = Pde[groups]
+
+        # fakely account for Pme < Pe by scaling by 10%
+        var_samp_composite_bar = 0.1 * var_samp_bar
+        var_area_composite_bar = (
+            var_area_alpha_bar * Pde + (1-Pde) * var_area_dw_bar)
+        var_pix_area_composite_bar = (
+            var_pix_area_alpha_bar * Pde + (1-Pde) * var_pix_area_dw_bar)
+        B_tmp = pixel_area*((1-Pde_x) * Bdwf + Pde_x* alpha_t*Bf)
+
+        Bcomposite_bar = agg_sum(B_tmp, mask=None)
+        Bcomposite2_bar = agg_sum(B_tmp**2, mask=None)
+        B_term_composite = Bcomposite_bar**2 - Bcomposite2_bar
+        # sqrt of Eq. 30, std_compsite = sigma_{A'_f}
+        std_composite = np.sqrt(var_samp_composite_bar
+                                + var_area_composite_bar
+                                + var_pix_area_composite_bar
+                                + B_term_composite)
+        std_out = std_composite
+    if method == 'simple':
+        std_out = std_dw
+    if method == 'water_fraction':
+        std_out = std_alpha
+    return std_out
+
+def area_with_uncert_grouped(
+    feature_id, pixel_area, water_fraction, water_fraction_uncert,
+    darea_dheight, klass, Pfd, Pmd, good, Pca=0.9, Pw=0.5, Ptf=0.5,
+    ref_dem_std=10, interior_water_klass=4, water_edge_klass=3,
+    land_edge_klass=2, method='composite'):
+    """
+    Aggregate area with uncertainty of every feature at once, as
+    area_with_uncert. Outputs are arrays in the order of
+    np.unique(feature_id).
+    """
+    area_agg, num_pixels = area_only_grouped(
+        feature_id, pixel_area, water_fraction, klass, good, method=method,
+        interior_water_klass=interior_water_klass,
+        water_edge_klass=water_edge_klass,
+        land_edge_klass=land_edge_klass)
+
+    area_unc = area_uncert_grouped(
+        feature_id, pixel_area, water_fraction, water_fraction_uncert,
+        darea_dheight, klass, Pfd, Pmd, good, Pca=Pca, Pw=Pw, Ptf=Ptf,
+        ref_dem_std=ref_dem_std, interior_water_klass=interior_water_klass,
+        water_edge_klass=water_edge_klass, land_edge_klass=land_edge_klass,
+        method=method)
+
+    # normalize to get area percent error
+    area_pcnt_uncert = area_unc/abs(area_agg)*100.0
+    return area_agg, area_unc, area_pcnt_uncert
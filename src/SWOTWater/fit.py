@@ -0,0 +1,86 @@
+'''
+Description:
+Least squares fits (e.g., of reach heights and slopes) computed directly
+with numpy, optionally for many features at once, giving the same results
+as the statsmodels WLS / OLS fits that were used before.
+
+Copyright (c) 2018-, California Institute of Technology ("Caltech"). U.S.
+Government sponsorship acknowledged.
+All rights reserved.
+'''
+
+import numpy as np
+
+# same cutoff for small singular values as statsmodels' pinv_extended
+RCOND = 1e-15
+
+def wls(endog, exog, weights=None):
+    """
+    Weighted (or ordinary if weights is None) least squares fit of endog on
+    the columns of exog, as statsmodels.api.WLS(endog, exog, weights).fit().
+
+    INPUT:
+    endog = 1d array of the values to fit
+    exog = 2d array (num values, num params) of the regressors
+    weights = 1d array of the weights of the values (1/variance)
+
+    OUTPUT:
+    params = fitted parameters (num params)
+    params_u = White's (1980) heteroskedasticity robust standard errors of
+               the parameters (HC0_se in statsmodels)
+    """
+    endog = np.asarray(endog, dtype=np.float64)
+    exog = np.asarray(exog, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(endog.shape)
+    sqrt_weights = np.sqrt(np.asarray(weights, dtype=np.float64))
+
+    # whiten, then solve with the pseudo-inverse as statsmodels does
+    wendog = sqrt_weights * endog
+    wexog = sqrt_weights[:, np.newaxis] * exog
+    pinv_wexog = np.linalg.pinv(wexog, rcond=RCOND)
+    params = pinv_wexog.dot(wendog)
+    wresid = wendog - wexog.dot(params)
+
+    # HC0 covariance: pinv(X) diag(resid**2) pinv(X)^T
+    cov_hc0 = (pinv_wexog * wresid**2).dot(pinv_wexog.T)
+    params_u = np.sqrt(np.diag(cov_hc0))
+    return params, params_u
+
+def wls_grouped(feature_id, endog, exog, weights=None):
+    """
+    Like wls, but does a separate fit for each feature_id, all at once.
+
+    OUTPUT:
+    params, params_u = 2d arrays (num features, num params) with the fits of
+                       the features in np.unique(feature_id) order
+    """
+    endog = np.asarray(endog, dtype=np.float64)
+    exog = np.asarray(exog, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(endog.shape)
+    sqrt_weights = np.sqrt(np.asarray(weights, dtype=np.float64))
+
+    # stack the (whitened) values of each feature, padded with zeros that do
+    # not change the fits
+    _, groups = np.unique(feature_id, return_inverse=True)
+    counts = np.bincount(groups)
+    order = np.argsort(groups, kind='stable')
+    position = np.arange(len(order)) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+
+    wendog = np.zeros((len(counts), counts.max()))
+    wexog = np.zeros((len(counts), counts.max(), exog.shape[1]))
+    wendog[groups[order], position] = (sqrt_weights * endog)[order]
+    wexog[groups[order], position] = (sqrt_weights[:, np.newaxis] * exog)[
+        order]
+
+    pinv_wexog = np.linalg.pinv(wexog, rcond=RCOND)
+    params = np.einsum('ijk,ik->ij', pinv_wexog, wendog)
+    wresid = wendog - np.einsum('ijk,ik->ij', wexog, params)
+
+    # HC0 covariance: pinv(X) diag(resid**2) pinv(X)^T
+    cov_hc0 = np.einsum(
+        'ijk,ik,ilk->ijl', pinv_wexog, wresid**2, pinv_wexog)
+    params_u = np.sqrt(np.diagonal(cov_hc0, axis1=1, axis2=2))
+    return params, params_u
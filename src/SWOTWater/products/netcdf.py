@@ -16,13 +16,19 @@ from SWOTWater.products.constants import FILL_VALUES
 
 DEPTH_DIMNAMES = ['depth', 'complex_depth']
 
+# Maximum number of values written to a variable at once (so that the
+# temporary copies made when writing masked arrays stay small)
+WRITE_BLOCK_SIZE = 2**22
+
 def get_fill(dtype):
     """Get the SWOT approved fill value for a data type"""
     dtype_str = np.dtype(dtype).str[1:]
     return FILL_VALUES[dtype_str]
 
 
-def set_variable(dataset, key, array, dimensions, attributes=None):
+def set_variable(
+        dataset, key, array, dimensions, attributes=None, zlib=False,
+        complevel=4, shuffle=True, chunk_length=None):
     '''Set the NetCDF variable, dealing with complex numbers.
 
     If array is complex, it is stored in the dataset with a third dimension,
@@ -30,16 +36,36 @@ def set_variable(dataset, key, array, dimensions, attributes=None):
         variable.shape == (lines, pixels, 2)
         variable[:, :, 0] == array.real
         variable[:, :, 1] == array.imag
+
+    zlib, complevel and shuffle set the compression of the variable (see
+    netCDF4.Dataset.createVariable). If chunk_length is given, the variable
+    is stored in chunks of chunk_length along its first dimension.
+
+    The data are written in blocks of at most WRITE_BLOCK_SIZE values, and
+    are not copied if array already has the type of the variable and no
+    masked values.
     '''
     # np.ma.mask_array has fill_value attr, else use default fill value
     fill_value = getattr(array, 'fill_value', get_fill(array.dtype))
     def _make_variable(key, data, dimensions, attributes=None):
+        kwargs = {}
+        if data.dtype.kind != 'O':
+            kwargs = {'zlib': zlib, 'complevel': complevel, 'shuffle': shuffle}
+            if chunk_length is not None and data.ndim > 0:
+                kwargs['chunksizes'] = [
+                    max(1, min(chunk_length, data.shape[0]))] + [
+                    max(1, size) for size in data.shape[1:]]
         dataset.createVariable(
-            key, data.dtype, dimensions, fill_value=fill_value)
+            key, data.dtype, dimensions, fill_value=fill_value, **kwargs)
         if data.dtype.str[0] == 'S' and np.ma.isMaskedArray(data):
-            dataset[key][:] = data.data
-        else:
+            data = data.data
+        if data.ndim == 0 or data.shape[0] == 0:
             dataset[key][:] = data
+        else:
+            block_length = max(1, WRITE_BLOCK_SIZE // max(1, data[0].size))
+            for start in range(0, data.shape[0], block_length):
+                dataset[key][start:start+block_length] = data[
+                    start:start+block_length]
         if attributes is not None:
             for name, value in attributes.items():
                 if name in ('dtype', 'dimensions', '_FillValue'):
@@ -74,22 +100,26 @@ def get_variable_keys(dataset):
     return [key for key in dataset.variables]
 
 
-def get_variable(dataset, key):
+def get_variable(dataset, key, span=slice(None)):
     '''Get the NetCDF variable and dimensions, dealing with complex numbers.
 
     Key is assumed to be complex if the variable has a first or last dimension
     of 'complex_depth' or 'depth' with length 2.
+
+    If span (a slice) is given, only that span of the last (non-complex)
+    dimension is read.
     '''
     variable = dataset[key]
     if len(variable.dimensions) == 0:
         return variable[0]
     if variable.dimensions[0] in DEPTH_DIMNAMES and variable.shape[0] == 2:
-        tmp = np.ma.MaskedArray(variable[0] + 1j*variable[1])
+        tmp = np.ma.MaskedArray(
+            variable[0, ..., span] + 1j*variable[1, ..., span])
         return tmp
     if variable.dimensions[-1] in DEPTH_DIMNAMES and variable.shape[-1] == 2:
         n_bytes = int(variable.dtype.itemsize*2)
         complex_type = np.dtype('c'+str(n_bytes))
-        tmp = variable[:]
+        tmp = variable[..., span, :]
         fill_value = get_fill(complex_type)
         mask = None
         if isinstance(tmp, np.ma.MaskedArray):
@@ -111,7 +141,7 @@ def get_variable(dataset, key):
         if mask is not None:
             tmp[mask] = np.ma.masked
         return tmp
-    variable = variable[:]
+    variable = variable[..., span]
     if isinstance(variable, np.ma.MaskedArray):
         return variable
     variable = variable.view(np.ma.MaskedArray)
@@ -120,6 +150,21 @@ def get_variable(dataset, key):
     return variable
 
 
+def get_variable_dtype(dataset, key):
+    '''Get the NetCDF variable data type, dealing with complex numbers.
+
+    Same as get_variable(dataset, key).dtype, without reading the data.
+    '''
+    variable = dataset[key]
+    if len(variable.dimensions) > 0 and (
+            variable.dimensions[0] in DEPTH_DIMNAMES and
+            variable.shape[0] == 2 or
+            variable.dimensions[-1] in DEPTH_DIMNAMES and
+            variable.shape[-1] == 2):
+        return np.dtype('c'+str(int(variable.dtype.itemsize*2)))
+    return variable.dtype
+
+
 def get_variable_dimensions(dataset, key):
     '''Get the NetCDF variable dimensons, dealing with complex numbers.
 
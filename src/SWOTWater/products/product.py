@@ -69,19 +69,34 @@ class Product(object):
     DIMENSIONS = odict()
     VARIABLES = odict()
     GROUPS = odict()
+    # Options for writing the variables to NetCDF (zlib, complevel, shuffle,
+    # chunk_length, see netcdf.set_variable). Groups use the options of their
+    # parent product updated with their own.
+    NETCDF_OPTIONS = odict()
     ATTRS = [
-        'ATTRIBUTES', 'DIMENSIONS', 'VARIABLES', 'GROUPS', '_attributes',
-        '_variables', '_groups']
+        'ATTRIBUTES', 'DIMENSIONS', 'VARIABLES', 'GROUPS', 'NETCDF_OPTIONS',
+        '_attributes', '_variables', '_groups', '_source', '_dimensions']
 
     def __init__(self):
         # These hold what actually exists in memory
         self._attributes = odict()
         self._variables = odict()
         self._groups = odict()
-        # reorder the attributes of the variables to the blessed order
-        for key, attr_odict in self.VARIABLES.items():
-            self.VARIABLES[key] = copy.deepcopy(
-                sort_variable_attribute_odict(attr_odict))
+        # The sizes of the dimensions of the variables in memory
+        self._dimensions = odict()
+        # The (filename, group names) to read variables from on first access
+        self._source = None
+        # reorder the attributes of the variables to the blessed order (once
+        # for each class when its instances share the class' forms)
+        cls = type(self)
+        is_class_form = 'VARIABLES' not in self.__dict__
+        if not (is_class_form and
+                cls.__dict__.get('_sorted_variables') is self.VARIABLES):
+            for key, attr_odict in self.VARIABLES.items():
+                self.VARIABLES[key] = copy.deepcopy(
+                    sort_variable_attribute_odict(attr_odict))
+            if is_class_form:
+                cls._sorted_variables = self.VARIABLES
         # For bug finding
         assert isinstance(self.ATTRIBUTES, odict)
         assert isinstance(self.DIMENSIONS, odict)
@@ -101,6 +116,9 @@ class Product(object):
 
     @property
     def variables(self):
+        # read the rest of a lazy from_ncfile, so callers that reorder or
+        # cast all of the variables keep them in step
+        self.load_variables()
         return odict(
             (key, variable) for key, variable in self._variables.items())
 
@@ -111,13 +129,18 @@ class Product(object):
         dimensions = odict(
             (key, value) for key, value in self.DIMENSIONS.items())
         # Update with any initialied values
-        for key, variable in self.VARIABLES.items():
-            for i, vdim in enumerate(variable['dimensions']):
-                assert vdim in dimensions, vdim+", "+str(list(dimensions.keys()))
-                if key in self.variables:
-                    dimensions[vdim] = self[key].shape[i]
+        dimensions.update(self._dimensions)
         return dimensions
 
+    def _set_variables(self, variables):
+        """Sets the variables in the dict variables, without checking them
+        against the dimensions (e.g., when they are known to be consistent)"""
+        for key, item in variables.items():
+            self._variables[key] = item
+            for i, dimension in enumerate(
+                    self.VARIABLES[key]['dimensions']):
+                self._dimensions[dimension] = item.shape[i]
+
     @property
     def full_attributes(self):
         dictionary = self.attributes
@@ -139,6 +162,7 @@ class Product(object):
 
     def append(self, product):
         """Return a copy of self with values in product appended"""
+        self.load_variables()
         new_product = self.copy(with_variables=False)
         for key, value in self._groups.items():
             new_product[key] = value.append(product[key])
@@ -147,17 +171,31 @@ class Product(object):
                 new_product[key] = np.append(variable, product[key], axis=0)
         return new_product
 
+    @classmethod
+    def concatenate(cls, products):
+        """Return a new product of this type with the variables of all the
+        given products concatenated (in one go, same as adding them one by
+        one)"""
+        klass = cls()
+        for key in klass.VARIABLES:
+            setattr(klass, key, np.concatenate(
+                [getattr(product, key) for product in products]))
+        return klass
+
     def _copy(self, new_product, with_variables=True):
         # Copy all of self into new_product
+        if with_variables:
+            self.load_variables()
         for key, value in self._attributes.items():
             new_product[key] = value
         for key, value in self._groups.items():
             #print('copy group', key)
             new_product[key] = value.copy(with_variables=with_variables)
         if with_variables:
-            for key, variable in self._variables.items():
-                if variable is not None:
-                    new_product[key] = copy.deepcopy(variable)
+            new_product._set_variables(odict(
+                (key, copy.deepcopy(variable))
+                for key, variable in self._variables.items()
+                if variable is not None))
 
     def _copy_from(self, product, with_variables=True):
         # Copy all of self into new_product
@@ -191,11 +229,14 @@ class Product(object):
                 assert len(item.shape) == len(form['dimensions'])
                 # Check the product-variable dimensions against the
                 # product-global ones
+                dimensions = self.dimensions
                 for i, dimension in enumerate(form['dimensions']):
-                    if self.dimensions[dimension] != 0:
+                    assert dimension in dimensions, dimension+", "+str(
+                        list(dimensions.keys()))
+                    if dimensions[dimension] != 0:
                         # Only check if this dimension is already initialized
-                        assert self.dimensions[dimension] == item.shape[i]
-                self._variables[key] = item
+                        assert dimensions[dimension] == item.shape[i]
+                self._set_variables({key: item})
                 return
         if key in self.ATTRIBUTES:
             self._attributes[key] = item
@@ -210,6 +251,11 @@ class Product(object):
             return self._variables[key]
         if key in self._groups:
             return self._groups[key]
+        # Not read yet from a lazy from_ncfile
+        if key in self.VARIABLES and self.__dict__.get('_source') is not None:
+            self._read_variables([key])
+            if key in self._variables:
+                return self._variables[key]
         # Nothing in memory, return empty data
         if key in self.ATTRIBUTES:
             return self.ATTRIBUTES[key].get('value', 'None')
@@ -250,6 +296,17 @@ class Product(object):
             fill = FILL_VALUES[dtype_str]
         return fill
 
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        # Bypass __getattr__, as nothing is set up yet when unpickling
+        self.__dict__.update(state)
+        if '_dimensions' not in state:
+            # pickled before the dimension sizes were kept
+            self._dimensions = odict()
+            self._set_variables(self._variables)
+
     def __setitem__(self, key, item):
         return setattr(self, key, item)
 
@@ -265,14 +322,17 @@ class Product(object):
         if isinstance(variable, np.ma.MaskedArray):
             mask = variable.mask
         else:
-            mask = False
+            mask = np.ma.nomask
         quantized_fill = self._getfill(key, dtype)
+        # no copy if variable already has the type
         return np.ma.masked_array(
-            data=variable.astype(dtype), dtype=dtype,
+            data=variable.astype(dtype, copy=False), dtype=dtype,
             fill_value=quantized_fill, mask=mask)
 
     def to_ncfile(self, filename):
         """Write self to a netCDF file."""
+        # read everything first, in case filename is where it comes from
+        self.load_variables()
         dataset = nc.Dataset(filename, 'w')
         self.to_dataset(dataset)
         dataset.sync()
@@ -282,6 +342,7 @@ class Product(object):
         """Store self in a folder on disk.
 
         Will recursively store groups in self in subfolders."""
+        self.load_variables()
         os.mkdir(folder)
         for key, value in self._groups.items():
             subfolder = os.path.join(folder, key)
@@ -305,14 +366,18 @@ class Product(object):
             else:
                 variable.data.tofile(os.path.join(folder, key))
 
-    def to_dataset(self, dataset):
+    def to_dataset(self, dataset, netcdf_options=None):
         """Store self in a NetCDF dataset/group.
 
-        Will recursively store groups in self under dataset."""
+        Will recursively store groups in self under dataset. netcdf_options
+        are the NETCDF_OPTIONS of the parent product, if any."""
+        netcdf_options = odict(
+            netcdf_options if netcdf_options is not None else {})
+        netcdf_options.update(self.NETCDF_OPTIONS)
         for key in self.GROUPS:
             netcdf_group = dataset.createGroup(key)
             # Recursively add the group members
-            self[key].to_dataset(netcdf_group)
+            self[key].to_dataset(netcdf_group, netcdf_options)
         for key in self.ATTRIBUTES:
             value = self[key]
             if value is None:
@@ -327,7 +392,7 @@ class Product(object):
             # Use a helper function to deal with complex numbers
             netcdf.set_variable(
                 dataset, key, variable, list(form['dimensions']),
-                attributes=form)
+                attributes=form, **netcdf_options)
 
     def get_biggest_var(self):
         var_names = [key for key, attr in self.VARIABLES.items()
@@ -337,7 +402,7 @@ class Product(object):
         return biggest[1], biggest[0]
 
     @classmethod
-    def from_ncfile(cls, filename, variables=None):
+    def from_ncfile(cls, filename, variables=None, lazy=False):
         """Generate a product directly from a NetCDF file.
 
         By default, will only read values defined in this Product.
@@ -346,19 +411,28 @@ class Product(object):
         they are not defined in this Product
 
         If 'variables' is given, will load only those variables with names in
-        the list.
+        the list (in any group).
+
+        If 'lazy' is True, the variables that are not loaded are read from
+        the file when first accessed (so the file should not change until
+        then, see load_variables).
         """
         dataset = nc.Dataset(filename, 'r')
         product = cls()
-        product.from_dataset(dataset, variables)
+        source = (filename, []) if lazy else None
+        if lazy and variables is None:
+            variables = []
+        product.from_dataset(dataset, variables, source)
         dataset.close()
         return product
 
-
-    def from_dataset(self, dataset, variables=None):
+    def from_dataset(self, dataset, variables=None, source=None):
         """Load self from a NetCDF dataset/group.
 
-        Will recursively load groups in dataset into self._groups."""
+        Will recursively load groups in dataset into self._groups. If
+        variables is given, only loads those variables. If source is given
+        as (filename, group names of dataset), the other variables are read
+        from it when first accessed."""
         for key in dataset.ncattrs():
             if key in self.ATTRIBUTES:
                 setattr(self, key, dataset.getncattr(key))
@@ -366,21 +440,48 @@ class Product(object):
                 warnings.warn(FIELD_WARNING.format(key, type(self).__name__))
         for key in netcdf.get_variable_keys(dataset):
             if key in self.VARIABLES:
+                if variables is not None and key not in variables:
+                    continue
                 # Use a helper function to deal with complex numbers
                 variable = netcdf.get_variable(dataset, key)
                 setattr(self, key, variable)
             else:
                 warnings.warn(FIELD_WARNING.format(key, type(self).__name__))
+        if source is not None:
+            self._source = source
         for key, group in dataset.groups.items():
             if key in self.GROUPS:
                 # Recursively load NetCDF groups into self groups
                 class_name = self.GROUPS[key]
                 cls = self.get_product(class_name)()
                 self[key] = cls
-                self[key].from_dataset(dataset[key], variables)
+                group_source = None
+                if source is not None:
+                    group_source = (source[0], source[1] + [key])
+                self[key].from_dataset(dataset[key], variables, group_source)
             else:
                 raise ValueError('{} not in product'.format(key))
 
+    def _read_variables(self, keys):
+        """Read variables from the file given to a lazy from_ncfile"""
+        filename, group_names = self._source
+        with nc.Dataset(filename, 'r') as dataset:
+            group = dataset
+            for name in group_names:
+                group = group.groups[name]
+            for key in keys:
+                if (key not in self._variables and
+                        key in netcdf.get_variable_keys(group)):
+                    setattr(self, key, netcdf.get_variable(group, key))
+
+    def load_variables(self):
+        """Read all variables not yet read from a lazy from_ncfile"""
+        if self.__dict__.get('_source') is not None:
+            self._read_variables(list(self.VARIABLES))
+            self._source = None
+        for group in self._groups.values():
+            group.load_variables()
+
     @classmethod
     def print_xml(cls, prefix=None, ofp=sys.stdout, shape_names=[],
                   shape_dims={}, is_shapefile=False, keys_to_drop=[]):
@@ -623,8 +724,9 @@ class Product(object):
     def cast(self):
         for group in self.GROUPS:
             self[group].cast()
-        for key in self.variables:
-            self[key] = self._casted_variable(key)
+        # casting does not change the shapes
+        self._set_variables(odict(
+            (key, self._casted_variable(key)) for key in self.variables))
 
     def reset_valid_minmax(self):
         """open up valid data range to whole range of datatype"""
@@ -689,24 +791,20 @@ class MutableProduct(Product):
         elif isinstance(groups, dict):
             self.GROUPS.update(groups)
 
-    def from_dataset(self, dataset, variables=None):
+    def from_dataset(self, dataset, variables=None, source=None):
         """Just like Product()'s version, but set self's forms from the file"""
         self._form_from_dataset(dataset)
-        super().from_dataset(dataset, variables)
+        super().from_dataset(dataset, variables, source)
 
     def _form_from_dataset(self, dataset):
         """Make a MutableProduct with forms set from dataset"""
         for key in dataset.ncattrs():
             self.ATTRIBUTES.append(key)
         for key in netcdf.get_variable_keys(dataset):
-            variable = netcdf.get_variable(dataset, key)
             variable_dimensions = netcdf.get_variable_dimensions(
                 dataset, key)
-            dimensions = odict()
-            for i, dimension in enumerate(variable_dimensions):
-                dimensions[dimension] = variable.shape[i]
             self.VARIABLES[key] = odict([
-                ['dtype', variable.dtype],
+                ['dtype', netcdf.get_variable_dtype(dataset, key)],
                 ['dimensions', odict(
                     [[dimension, 0] for dimension in variable_dimensions])],
             ])
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+import pytest
+import numpy as np
+import netCDF4
+
+import SWOTWater.products.netcdf as netcdf
+
+@pytest.fixture()
+def arrays():
+    rng = np.random.RandomState(0)
+    height = np.ma.masked_array(
+        rng.randn(1000, 3).astype('f4'), mask=rng.rand(1000, 3) > 0.9)
+    return {'height': height, 'node_id': np.arange(1000, dtype='i8')}
+
+def write(filename, arrays, **kwargs):
+    with netCDF4.Dataset(filename, 'w') as dataset:
+        dataset.createDimension('points', 1000)
+        dataset.createDimension('depth', 3)
+        netcdf.set_variable(
+            dataset, 'height', arrays['height'], ['points', 'depth'],
+            {'units': 'm', 'valid_min': -1000}, **kwargs)
+        netcdf.set_variable(
+            dataset, 'node_id', arrays['node_id'], ['points'], **kwargs)
+
+@pytest.mark.parametrize('kwargs', [
+    {}, {'zlib': True}, {'zlib': True, 'complevel': 9, 'chunk_length': 64},
+    {'chunk_length': 5000}])
+def test_set_variable(tmp_path, arrays, kwargs):
+    filename = str(tmp_path / 'test.nc')
+    write(filename, arrays, **kwargs)
+    with netCDF4.Dataset(filename, 'r') as dataset:
+        height = dataset['height'][:]
+        np.testing.assert_array_equal(
+            np.ma.getmaskarray(height), arrays['height'].mask)
+        np.testing.assert_array_equal(
+            height.compressed(), arrays['height'].compressed())
+        assert dataset['height'].units == 'm'
+        assert dataset['height'].valid_min.dtype == np.float32
+        np.testing.assert_array_equal(
+            dataset['node_id'][:], arrays['node_id'])
+
+        filters = dataset['height'].filters()
+        assert filters['zlib'] == kwargs.get('zlib', False)
+        if kwargs.get('zlib'):
+            assert filters['complevel'] == kwargs.get('complevel', 4)
+        if 'chunk_length' in kwargs:
+            assert dataset['height'].chunking() == [
+                min(kwargs['chunk_length'], 1000), 3]
+            assert dataset['node_id'].chunking() == [
+                min(kwargs['chunk_length'], 1000)]
+
+def test_set_variable_blocks(tmp_path, arrays, monkeypatch):
+    # writing in several blocks gives the same file contents
+    monkeypatch.setattr(netcdf, 'WRITE_BLOCK_SIZE', 100)
+    filename = str(tmp_path / 'test.nc')
+    write(filename, arrays)
+    with netCDF4.Dataset(filename, 'r') as dataset:
+        height = dataset['height'][:]
+        np.testing.assert_array_equal(
+            np.ma.getmaskarray(height), arrays['height'].mask)
+        np.testing.assert_array_equal(
+            height.compressed(), arrays['height'].compressed())
+        np.testing.assert_array_equal(
+            dataset['node_id'][:], arrays['node_id'])
+
+def test_set_variable_empty(tmp_path):
+    filename = str(tmp_path / 'test.nc')
+    with netCDF4.Dataset(filename, 'w') as dataset:
+        dataset.createDimension('points', 0)
+        netcdf.set_variable(
+            dataset, 'height', np.ma.masked_array([], dtype='f8'),
+            ['points'], zlib=True, chunk_length=64)
+    with netCDF4.Dataset(filename, 'r') as dataset:
+        assert dataset['height'].shape == (0,)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+import pytest
+import numpy as np
+import scipy.stats
+
+import SWOTWater.aggregate as aggregate
+
+NUM_PIXELS = 200
+
+@pytest.fixture(scope='module')
+def pixels():
+    rng = np.random.RandomState(0)
+    feature_id = rng.randint(10, 16, NUM_PIXELS)
+    # a feature with a single pixel and one (15) with no good pixels
+    feature_id[0] = 99
+    good = rng.rand(NUM_PIXELS) > 0.3
+    good[feature_id == 15] = False
+    return {
+        'feature_id': feature_id,
+        'good': good,
+        'height': rng.randn(NUM_PIXELS),
+        'height_std': 0.1 + rng.rand(NUM_PIXELS),
+        'num_rare_looks': rng.randint(1, 5, NUM_PIXELS).astype(float),
+        'num_med_looks': rng.randint(5, 50, NUM_PIXELS).astype(float),
+        'ifgram': rng.randn(NUM_PIXELS) + 1j*rng.randn(NUM_PIXELS),
+        'power1': 1 + rng.rand(NUM_PIXELS),
+        'power2': 1 + rng.rand(NUM_PIXELS),
+        'dh_dphi': rng.randn(NUM_PIXELS),
+        'dlat_dphi': rng.randn(NUM_PIXELS),
+        'dlon_dphi': rng.randn(NUM_PIXELS),
+        'pixel_area': 100 * rng.rand(NUM_PIXELS),
+        'water_fraction': rng.rand(NUM_PIXELS),
+        'water_fraction_uncert': 0.1 * rng.rand(NUM_PIXELS),
+        'darea_dheight': 0.01 * rng.rand(NUM_PIXELS),
+        'klass': rng.randint(1, 5, NUM_PIXELS),
+        'Pfd': 0.1 * rng.rand(NUM_PIXELS),
+        'Pmd': 0.1 * rng.rand(NUM_PIXELS)}
+
+def each_feature(pixels):
+    for ii, feature in enumerate(np.unique(pixels['feature_id'])):
+        yield ii, pixels['feature_id'] == feature
+
+def assert_close(actual, desired):
+    np.testing.assert_allclose(actual, desired, rtol=1e-10, atol=1e-12)
+
+def test_simple_masked():
+    # masked values are left out of the scalar aggregates
+    in_var = np.ma.masked_array([1, 2, 100], mask=[False, False, True])
+    assert aggregate.simple(in_var) == 1.5
+    assert aggregate.simple(in_var, metric='sum') == 3
+
+def test_simple_empty():
+    with np.errstate(invalid='ignore'), pytest.warns(RuntimeWarning):
+        assert np.isnan(aggregate.simple(np.array([])))
+
+def test_simple_types():
+    in_var = np.array([3, 1, 3, 2])
+    out_var = aggregate.simple(in_var, metric='sum')
+    assert out_var == 9 and np.asarray(out_var).dtype.kind == 'i'
+    mode, _ = scipy.stats.mode(in_var)
+    out_var = aggregate.simple(in_var, metric='mode')
+    assert np.squeeze(out_var) == 3
+    assert np.asarray(out_var).dtype == np.asarray(mode).dtype
+
+@pytest.mark.parametrize('metric', ['mean', 'median', 'sum', 'std', 'count'])
+def test_simple_grouped(pixels, metric):
+    out_var = aggregate.simple_grouped(
+        pixels['height'], pixels['feature_id'], metric=metric)
+    accumulator = {
+        'mean': np.mean, 'median': np.median, 'sum': np.sum, 'std': np.std,
+        'count': len}[metric]
+    for ii, this in each_feature(pixels):
+        assert_close(out_var[ii], accumulator(pixels['height'][this]))
+
+def test_simple_grouped_mode(pixels):
+    in_var = pixels['klass']
+    out_var = aggregate.simple_grouped(
+        in_var, pixels['feature_id'], metric='mode')
+    for ii, this in each_feature(pixels):
+        mode, _ = scipy.stats.mode(in_var[this])
+        assert out_var[ii] == np.squeeze(mode)
+
+@pytest.mark.parametrize('method', ['weight', 'uniform', 'median'])
+def test_height_only_grouped(pixels, method):
+    height, good = pixels['height'], pixels['good']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        height_out, weight_norm = aggregate.height_only_grouped(
+            pixels['feature_id'], height, good, pixels['height_std'], method)
+    for ii, this in each_feature(pixels):
+        this_good = np.logical_and(this, good)
+        if not this_good.any():
+            assert np.isnan(height_out[ii])
+            continue
+        if method == 'median':
+            assert_close(height_out[ii], np.median(height[this_good]))
+            assert_close(weight_norm[this], 1/this_good.sum())
+            continue
+        weight = np.ones(NUM_PIXELS)
+        if method == 'weight':
+            weight = 1/pixels['height_std']**2
+        assert_close(height_out[ii], np.sum(
+            weight[this_good]*height[this_good])/np.sum(weight[this_good]))
+        assert_close(
+            weight_norm[this_good],
+            weight[this_good]/np.sum(weight[this_good]))
+
+def test_height_uncert_std_grouped(pixels):
+    height, good = pixels['height'], pixels['good']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        height_std_out = aggregate.height_uncert_std_grouped(
+            pixels['feature_id'], height, good, pixels['num_rare_looks'],
+            pixels['num_med_looks'], method='uniform')
+    for ii, this in each_feature(pixels):
+        this_good = np.logical_and(this, good)
+        if not this_good.any():
+            assert np.isnan(height_std_out[ii])
+            continue
+        num_ind_pixels = np.mean(
+            pixels['num_med_looks'][this_good] /
+            pixels['num_rare_looks'][this_good])
+        assert_close(height_std_out[ii], np.std(height[this_good]) * np.sqrt(
+            num_ind_pixels/this_good.sum()))
+
+def test_height_with_uncerts_grouped(pixels):
+    keys = ['height', 'good', 'num_rare_looks', 'num_med_looks', 'ifgram',
+            'power1', 'power2']
+    sensitivities = ['dh_dphi', 'dlat_dphi', 'dlon_dphi']
+    args = [pixels[key] for key in keys] + [1.] + [
+        pixels[key] for key in sensitivities] + [pixels['height_std']]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        outputs = aggregate.height_with_uncerts_grouped(
+            pixels['feature_id'], *args)
+        # each feature by itself gives the same values
+        for ii, this in each_feature(pixels):
+            these_outputs = aggregate.height_with_uncerts(
+                *[arg[this] if np.ndim(arg) > 0 else arg for arg in args])
+            for output, this_output in zip(outputs, these_outputs):
+                assert_close(output[ii], this_output)
+
+@pytest.mark.parametrize('method', ['simple', 'water_fraction', 'composite'])
+def test_area_with_uncert_grouped(pixels, method):
+    keys = ['pixel_area', 'water_fraction', 'water_fraction_uncert',
+            'darea_dheight', 'klass', 'Pfd', 'Pmd', 'good']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        outputs = aggregate.area_with_uncert_grouped(
+            pixels['feature_id'], *[pixels[key] for key in keys],
+            method=method)
+        for ii, this in each_feature(pixels):
+            these_outputs = aggregate.area_with_uncert(
+                *[pixels[key][this] for key in keys], method=method)
+            for output, this_output in zip(outputs, these_outputs):
+                assert_close(output[ii], this_output)
+
+    # the area itself, from Eq.s (15), (16), and (17)
+    area_agg, num_pixels = aggregate.area_only_grouped(
+        pixels['feature_id'], pixels['pixel_area'], pixels['water_fraction'],
+        pixels['klass'], pixels['good'], method=method)
+    klass = pixels['klass']
+    weight = {
+        'simple': np.isin(klass, [3, 4]).astype(float),
+        'water_fraction': np.isin(klass, [2, 3, 4]) * pixels['water_fraction'],
+        'composite': np.where(
+            klass == 4, 1., np.isin(klass, [2, 3]) * pixels['water_fraction'])
+    }[method]
+    for ii, this in each_feature(pixels):
+        this_good = np.logical_and(this, pixels['good'])
+        assert_close(area_agg[ii], np.sum(
+            pixels['pixel_area'][this_good] * weight[this_good]))
+
+def test_group_mean():
+    in_var = np.ma.masked_array(
+        [1., 2., 4., 5., 7.], mask=[False, False, True, False, True])
+    features, groups = aggregate.get_groups([3, 1, 3, 3, 8])
+    out_var, num_valid = aggregate.group_mean(in_var, groups, len(features))
+    assert list(features) == [1, 3, 8]
+    assert_close(out_var[:2], [2., 3.])
+    assert np.isnan(out_var[2])
+    assert list(num_valid) == [1, 2, 0]
+
+def test_group_mean_empty():
+    features, groups = aggregate.get_groups(np.array([], dtype=int))
+    out_var, num_valid = aggregate.group_mean(
+        np.ma.masked_array([], dtype=float), groups, len(features))
+    assert len(out_var) == 0 and len(num_valid) == 0
+
+    index, found = aggregate.get_feature_index(features, [5, 6])
+    assert list(index) == [0, 0]
+    assert not found.any()
+
+def test_get_feature_index():
+    features = np.array([1, 3, 8])
+    index, found = aggregate.get_feature_index(
+        features, np.ma.masked_array([8, 2, 1, 9]))
+    assert list(found) == [True, False, True, False]
+    assert list(index[found]) == [2, 0]
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+import pytest
+import numpy as np
+
+import SWOTWater.fit
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.RandomState(0)
+    xx = rng.randn(20)
+    exog = np.vstack([xx, np.ones(20)]).T
+    endog = 2*xx + 1 + 0.1*rng.randn(20)
+    weights = 1 + rng.rand(20)
+    return endog, exog, weights
+
+def test_wls_params(data):
+    endog, exog, weights = data
+    params, _ = SWOTWater.fit.wls(endog, exog, weights)
+    desired = np.linalg.lstsq(
+        np.sqrt(weights)[:, np.newaxis]*exog, np.sqrt(weights)*endog,
+        rcond=None)[0]
+    np.testing.assert_allclose(params, desired, rtol=1e-10)
+
+@pytest.mark.parametrize('use_weights', [True, False])
+def test_wls_vs_statsmodels(data, use_weights):
+    sm = pytest.importorskip('statsmodels.api')
+    endog, exog, weights = data
+    if not use_weights:
+        weights = None
+    params, params_u = SWOTWater.fit.wls(endog, exog, weights)
+    results = sm.WLS(
+        endog, exog, weights=1. if weights is None else weights).fit()
+    np.testing.assert_allclose(params, results.params, rtol=1e-10)
+    np.testing.assert_allclose(params_u, results.HC0_se, rtol=1e-10)
+
+def test_wls_rank_deficient():
+    # same minimum norm solution as the pseudo-inverse for collinear columns
+    exog = np.ones((5, 2))
+    endog = np.arange(5.)
+    params, params_u = SWOTWater.fit.wls(endog, exog)
+    np.testing.assert_allclose(params, [1., 1.])
+    assert np.all(np.isfinite(params_u))
+
+def test_wls_grouped():
+    rng = np.random.RandomState(1)
+    feature_id = rng.randint(0, 4, 40) * 10
+    xx = rng.randn(40)
+    exog = np.vstack([xx, np.ones(40)]).T
+    endog = feature_id * xx + 1 + 0.1*rng.randn(40)
+    weights = 1 + rng.rand(40)
+    params, params_u = SWOTWater.fit.wls_grouped(
+        feature_id, endog, exog, weights)
+    assert params.shape == params_u.shape == (4, 2)
+    for item, item_params, item_params_u in zip(
+            np.unique(feature_id), params, params_u):
+        mask = feature_id == item
+        desired, desired_u = SWOTWater.fit.wls(
+            endog[mask], exog[mask], weights[mask])
+        np.testing.assert_allclose(item_params, desired, rtol=1e-10)
+        np.testing.assert_allclose(item_params_u, desired_u, rtol=1e-8)
+
+def test_wls_grouped_rank_deficient():
+    # a single value fit gives the same minimum norm solution as wls
+    feature_id = np.array([0, 1, 1, 1])
+    exog = np.vstack([[-2., 0., 1., 2.], np.ones(4)]).T
+    endog = np.array([3., 1., 2., 3.])
+    params, _ = SWOTWater.fit.wls_grouped(feature_id, endog, exog)
+    desired, _ = SWOTWater.fit.wls(endog[:1], exog[:1])
+    np.testing.assert_allclose(params[0], desired)
+    np.testing.assert_allclose(params[1], [1., 1.])
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""
+Makes the catalog of the tiles of a prior reach database directory, used by
+ReachDatabase.from_dir to find the tiles to read without opening them all.
+
+Useage:
+    make_prd_catalog.py reach_db_path
+"""
+import logging
+import argparse
+
+import RiverObs.ReachDatabase
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'reach_db_path', type=str,
+        help='directory of prior reach database tiles')
+    parser.add_argument(
+        '-l', '--log-level', type=str, default="info",
+        help="logging level, one of: debug info warning error")
+    args = parser.parse_args()
+
+    level = {'debug': logging.DEBUG, 'info': logging.INFO,
+             'warning': logging.WARNING, 'error': logging.ERROR}[args.log_level]
+    format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=level, format=format)
+
+    catalog = RiverObs.ReachDatabase.make_catalog(args.reach_db_path)
+    logging.info('Wrote catalog of {} tiles'.format(len(catalog)))
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,19 @@ Useage:
 import os
 import logging
 import argparse
+import functools
+import concurrent.futures
 import numpy as np
 
 from SWOTRiver.products.riversp import L2HRRiverSP
 from SWOTRiver.products.rivertile import L2HRRiverTile
 
+def load_rivertile(rivertile_file, from_shapes=False):
+    """Loads one rivertile (a (nodes, reaches) pair if from_shapes)"""
+    if from_shapes:
+        return L2HRRiverTile.from_shapes(rivertile_file[0], rivertile_file[1])
+    return L2HRRiverTile.from_ncfile(rivertile_file)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -22,6 +30,9 @@ def main():
     parser.add_argument('--from-shapes', help='From shapefiles',
         action='store_true', default=False)
     parser.add_argument('--shpbasedir', type=str, default=None)
+    parser.add_argument(
+        '-j', '--num-workers', type=int, default=1,
+        help="number of processes used to load the rivertiles")
     parser.add_argument(
         '-l', '--log-level', type=str, default="info",
         help="logging level, one of: debug info warning error")
@@ -38,15 +49,14 @@ def main():
     else:
         rivertile_files = args.rivertile_files
 
-    river_tiles = []
-    for ii, rivertile_file in enumerate(rivertile_files):
-        if args.from_shapes:
-            river_tile = L2HRRiverTile.from_shapes(
-                rivertile_file[0], rivertile_file[1])
-        else:
-            river_tile = L2HRRiverTile.from_ncfile(rivertile_file)
-
-        river_tiles.append(river_tile)
+    load = functools.partial(load_rivertile, from_shapes=args.from_shapes)
+    if args.num_workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.num_workers) as executor:
+            river_tiles = list(executor.map(load, rivertile_files))
+    else:
+        river_tiles = [load(rivertile_file)
+                       for rivertile_file in rivertile_files]
 
     # write river sp
     river_sp = L2HRRiverSP.from_rivertiles(river_tiles)